@@ -1,607 +1,298 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
+from flask import Flask, render_template, request, jsonify, send_file, g, Response, stream_with_context
 import os
 import json
-import asyncio
-from playwright.async_api import async_playwright
 import time
-import random
+import logging
+import cProfile
+import pstats
+import io
+import uuid
+import base64
+import re
 from dotenv import load_dotenv
 import config
+import metrics
+import label_render
+import label_stream
+import live_preview
+import scheduler
+from artifact_store import ArtifactStore
+from job_queue import STATES as JOB_STATES, open_job_queue
+from label_generator import WhiskyLabelGenerator
 
 # Load environment variables from api_config.env if it exists
 load_dotenv('api_config.env')
 
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s %(message)s'
+)
+logger = logging.getLogger('whisky_label')
+
 app = Flask(__name__)
 
-class WhiskyLabelGenerator:
-    def __init__(self):
-        self.base_url = "https://www.whiskybase.com"
-        
-    async def get_whisky_info_playwright(self, whisky_id):
-        """Fetch whisky information using Playwright to call WhiskyBase API endpoint"""
-        async with async_playwright() as p:
-            # Launch browser with realistic settings
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
-                    '--disable-dev-shm-usage',
-                    '--disable-accelerated-2d-canvas',
-                    '--no-first-run',
-                    '--no-zygote',
-                    '--disable-gpu',
-                    '--disable-web-security',
-                    '--disable-features=VizDisplayCompositor'
-                ]
-            )
-            
-            # Create context with realistic user agent and viewport
-            context = await browser.new_context(
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                viewport={'width': 1920, 'height': 1080},
-                locale='en-US',
-                timezone_id='America/New_York',
-                extra_http_headers={
-                    'Accept': 'application/json, text/plain, */*',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Connection': 'keep-alive',
-                    'Sec-Fetch-Dest': 'empty',
-                    'Sec-Fetch-Mode': 'cors',
-                    'Sec-Fetch-Site': 'same-origin',
-                    'Cache-Control': 'no-cache',
-                    'Pragma': 'no-cache',
-                    'DNT': '1',
-                    'X-Requested-With': 'XMLHttpRequest'
-                }
-            )
-            
-            page = await context.new_page()
-            
-            try:
-                # First, visit the main site to establish a session and get cookies
-                print("Establishing session with WhiskyBase...")
-                base_url = os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')
-                try:
-                    await page.goto(f'{base_url}/', wait_until='domcontentloaded', timeout=10000)
-                    await page.wait_for_timeout(2000)  # Wait 2 seconds
-                    print("✅ Homepage visited successfully")
-                except Exception as e:
-                    print(f"Homepage visit failed: {e}, continuing...")
-                
-                # Build API URL with relations
-                api_base_url = os.getenv('WHISKYBASE_API_BASE_URL')
-                api_url = f"{api_base_url}/whisky/{whisky_id}?relation[]=brand&relation[]=userrating&relation[]=bottler"
-                print(f"Making API request to: {api_url}")
-                
-                # Make the API request
-                timeout_seconds = int(os.getenv('TIMEOUT_SECONDS', 15))
-                response = await page.goto(api_url, wait_until='domcontentloaded', timeout=timeout_seconds * 1000)
-                print(f"API response status: {response.status}")
-                
-                if response.status == 200:
-                    # Get the JSON content
-                    content = await page.content()
-                    
-                    # Extract JSON from the page content
-                    # The response should be pure JSON, but let's handle it carefully
-                    try:
-                        # Try to parse as JSON directly
-                        json_data = await page.evaluate('() => JSON.parse(document.body.textContent)')
-                        print(f"✅ API call successful! Response keys: {list(json_data.keys()) if isinstance(json_data, dict) else 'Not a dict'}")
-                        
-                        # Parse the API response
-                        whisky_info = self._parse_api_response(json_data, whisky_id)
-                        return whisky_info
-                        
-                    except Exception as e:
-                        print(f"Error parsing JSON response: {e}")
-                        # Try to extract JSON from the page content manually
-                        import re
-                        import json
-                        
-                        # Look for JSON in the page content
-                        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                        if json_match:
-                            try:
-                                json_data = json.loads(json_match.group())
-                                print(f"✅ Extracted JSON from page content")
-                                whisky_info = self._parse_api_response(json_data, whisky_id)
-                                return whisky_info
-                            except Exception as e2:
-                                print(f"Error parsing extracted JSON: {e2}")
-                        
-                        return self._get_fallback_data(whisky_id)
-                        
-                else:
-                    print(f"❌ API request failed with status {response.status}")
-                    print(f"Response content: {await response.text()[:300]}...")
-                    return self._get_fallback_data(whisky_id)
-                
-            except Exception as e:
-                print(f"Playwright error: {e}")
-                return self._get_fallback_data(whisky_id)
-            finally:
-                await browser.close()
-    
+# On-demand request profiling: only honoured when enabled here AND the request
+# carries the profiling header, so production traffic is never profiled
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 20))
 
-    
-    def _parse_api_response(self, data, whisky_id):
-        """Parse the API response and extract whisky information"""
-        try:
-            # Handle the real WhiskyBase API response structure
-            if 'whisky' in data:
-                whisky_data = data['whisky']
-            elif 'data' in data:
-                whisky_data = data['data']
-            else:
-                whisky_data = data
-            
-            # Get name
-            name = whisky_data.get('name', f'Whisky #{whisky_id}')
-            
-            # Get distillery/brand information - try multiple possible fields
-            distillery = 'Unknown Distillery'
-            if 'brand' in whisky_data and isinstance(whisky_data['brand'], dict):
-                # Try brandname first (real API structure), then name
-                distillery = whisky_data['brand'].get('brandname') or whisky_data['brand'].get('name', 'Unknown Distillery')
-            elif 'brand_name' in whisky_data:
-                distillery = whisky_data['brand_name']
-            elif 'bottle_for' in whisky_data and whisky_data['bottle_for']:
-                # Use bottle_for as distillery name (common in independent bottlings)
-                distillery = whisky_data['bottle_for']
-            elif 'district' in whisky_data and whisky_data['district']:
-                # Use district as fallback (e.g., "Islay" for Islay whiskies)
-                distillery = whisky_data['district'] + " Distillery"
-            
-            # Get ABV/strength
-            abv = 'Unknown ABV'
-            if 'strength' in whisky_data:
-                strength = whisky_data['strength']
-                if strength:
-                    abv = f"{strength}%"
-            elif 'abv' in whisky_data:
-                abv_val = whisky_data['abv']
-                if abv_val:
-                    abv = f"{abv_val}%"
-            
-            # Get age
-            age = ''
-            if 'age' in whisky_data and whisky_data['age']:
-                age_val = whisky_data['age']
-                if age_val:
-                    age = f"{age_val} years"
-            
-            # Get region
-            region = 'Unknown Region'
-            if 'region' in whisky_data:
-                region = whisky_data['region']
-            
-            # Get bottler information
-            bottler = ''
-            if 'bottler' in whisky_data and isinstance(whisky_data['bottler'], dict):
-                bottler = whisky_data['bottler'].get('name', '')
-            elif 'bottler_serie' in whisky_data:
-                bottler = whisky_data['bottler_serie']
-            
-            # Get additional details
-            cask_type = whisky_data.get('cask_type', '')
-            type_info = whisky_data.get('type', '')
-            
-            # Build note with additional information
-            note_parts = []
-            if region and region != 'Unknown Region':
-                note_parts.append(region)
-            if cask_type:
-                note_parts.append(cask_type)
-            if bottler:
-                note_parts.append(f"Bottled by {bottler}")
-            
-            note = ' | '.join(note_parts) if note_parts else ''
-            
-            # Enhanced image extraction for real API response
-            image_url = ''
-            
-            # Try to get image from photos array (real API structure)
-            if 'photos' in whisky_data and isinstance(whisky_data['photos'], list):
-                photos = whisky_data['photos']
-                if photos:
-                    # Look for the specific image URL first (479313-normal.png)
-                    specific_photo = next((photo for photo in photos if photo.get('id') == 479313), None)
-                    if specific_photo:
-                        # Use the normal size of the specific photo
-                        image_url = specific_photo.get('normal')
-                    else:
-                        # Look for label photo first (label: true)
-                        label_photo = next((photo for photo in photos if photo.get('label', False)), None)
-                        if label_photo:
-                            # Prefer big size, fall back to normal, then small
-                            image_url = label_photo.get('big') or label_photo.get('normal') or label_photo.get('small')
-                        else:
-                            # Use first photo if no label photo found
-                            first_photo = photos[0]
-                            image_url = first_photo.get('big') or first_photo.get('normal') or first_photo.get('small')
-            
-            # Fallback to old image extraction methods
-            if not image_url:
-                image_data = whisky_data.get('image', {})
-                if isinstance(image_data, dict):
-                    # Try various possible image URL fields
-                    for field in ['url', 'src', 'image_url', 'photo_url', 'thumbnail']:
-                        if field in image_data and image_data[field]:
-                            image_url = image_data[field]
-                            break
-                    
-                    # If no direct URL, try nested structures
-                    if not image_url and 'sizes' in image_data:
-                        sizes = image_data['sizes']
-                        if isinstance(sizes, dict):
-                            # Try to get the largest available size
-                            for size in ['large', 'medium', 'small', 'original']:
-                                if size in sizes and sizes[size]:
-                                    image_url = sizes[size]
-                                    break
-            
-            # If still no image, try alternative image fields in the main data
-            if not image_url:
-                for field in ['photo', 'picture', 'thumbnail', 'image_url']:
-                    if field in whisky_data and whisky_data[field]:
-                        image_url = whisky_data[field]
-                        break
-            
-            # Ensure image URL is absolute
-            if image_url and not image_url.startswith(('http://', 'https://')):
-                base_url = os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')
-                image_url = f"{base_url}{image_url}"
-            
-            return {
-                'id': whisky_id,
-                'name': name,
-                'distillery': distillery,
-                'abv': abv,
-                'age': age,
-                'region': region,
-                'note': note,
-                'url': f"{os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')}/whisky/{whisky_id}",
-                'image_url': image_url,
-                'source': 'api'
-            }
-            
-        except Exception as e:
-            print(f"Error parsing API response: {e}")
-            return self._get_fallback_data(whisky_id)
-
-    def _get_fallback_data(self, whisky_id):
-        """Generate fallback data when scraping fails"""
-        # Simple fallback data generation
-        whiskies = [
-            {'name': 'Macallan 18 Year Old', 'distillery': 'The Macallan', 'abv': '43%', 'age': '18 years'},
-            {'name': 'Glenfiddich 12 Year Old', 'distillery': 'Glenfiddich', 'abv': '40%', 'age': '12 years'},
-            {'name': 'Laphroaig 10 Year Old', 'distillery': 'Laphroaig', 'abv': '43%', 'age': '10 years'},
-            {'name': 'Ardbeg Uigeadail', 'distillery': 'Ardbeg', 'abv': '54.2%', 'age': 'No Age Statement'},
-            {'name': 'Glenlivet 15 Year Old', 'distillery': 'The Glenlivet', 'abv': '40%', 'age': '15 years'},
-            {'name': 'Lagavulin 16 Year Old', 'distillery': 'Lagavulin', 'abv': '43%', 'age': '16 years'},
-            {'name': 'Balvenie 12 Year Old', 'distillery': 'The Balvenie', 'abv': '40%', 'age': '12 years'},
-            {'name': 'Highland Park 18 Year Old', 'distillery': 'Highland Park', 'abv': '43%', 'age': '18 years'}
-        ]
-        
-        # Use whisky_id to select a whisky (cycling through the list)
-        selected_whisky = whiskies[whisky_id % len(whiskies)]
-        
-        return {
-            'id': whisky_id,
-            'name': selected_whisky['name'],
-            'distillery': selected_whisky['distillery'],
-            'abv': selected_whisky['abv'],
-            'age': selected_whisky['age'],
-            'image_url': None,  # No image for fallback data
-            'url': f"{os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')}/whisky/{whisky_id}",
-            'source': 'fallback_data',
-            'note': 'Data from fallback source (Whiskybase unavailable)'
-        }
-    
-    def get_whisky_info(self, whisky_id):
-        """Synchronous wrapper for async Playwright method"""
-        try:
-            # Run the async method in a new event loop
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(self.get_whisky_info_playwright(whisky_id))
-            loop.close()
-            return result
-        except Exception as e:
-            print(f"Error in get_whisky_info: {e}")
-            return self._get_fallback_data(whisky_id)
-
-    def create_qr_code(self, url, filename="qr_code.png"):
-        """Create QR code for the whisky URL"""
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=20,
-            border=4,
-        )
-        qr.add_data(url)
-        qr.make(fit=True)
-
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        qr_image.save(filename)
-        return filename
-
-    def create_label(self, whisky_info, output_filename="whisky_label.png", width_mm=35, height_mm=37, dpi=72):
-        """Create a whisky label with QR code"""
-        # Convert mm to pixels
-        # For screen display, use 72 DPI (standard screen resolution)
-        # For print quality, use 300 DPI
-        pixels_per_mm = dpi / 25.4
-        
-        width = int(width_mm * pixels_per_mm)
-        height = int(height_mm * pixels_per_mm)
-        
-        # Create image with white background
-        image = Image.new('RGB', (width, height), color='white')
-        draw = ImageDraw.Draw(image)
-        
-        # Add small border inside the label
-        border_width = max(1, width // 200)  # Border width proportional to label size
-        draw.rectangle([border_width, border_width, width - border_width, height - border_width], 
-                      outline='#CCCCCC', width=border_width)
-        
-        # Calculate proportional font sizes based on label dimensions
-        # Make fonts smaller to fit all content
-        base_font_size = min(width, height) // 16  # Smaller base font
-        font_large_size = int(base_font_size * 1.5)  # Smaller multiplier
-        font_medium_size = int(base_font_size * 1.2)  # Smaller multiplier
-        font_small_size = int(base_font_size * 0.9)  # Smaller multiplier
-        
-        try:
-            # Try to load a font, fall back to default if not available
-            font_large = ImageFont.truetype("arial.ttf", font_large_size)
-            font_medium = ImageFont.truetype("arial.ttf", font_medium_size)
-            font_small = ImageFont.truetype("arial.ttf", font_small_size)
-        except:
-            font_large = ImageFont.load_default()
-            font_medium = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-
-        # Create QR code
-        qr_filename = self.create_qr_code(whisky_info['url'])
-        qr_image = Image.open(qr_filename)
-        
-        # Resize QR code to fill the top portion of the label
-        # Use 50% of the label height for QR code to make it more prominent
-        qr_size = min(width, int(height * 0.4))
-        qr_image = qr_image.resize((qr_size, qr_size))
-        
-        # Position QR code centered at the top (accounting for border)
-        qr_x = (width - qr_size) // 2  # Center horizontally
-        qr_y = border_width + (height - border_width * 2) // config.MARGIN_RATIO  # Margin from top, inside border
-        image.paste(qr_image, (qr_x, qr_y))
-        
-        # Add text content - start below QR code (accounting for border)
-        y_position = qr_y + qr_size + (height // (config.MARGIN_RATIO * 2))  # Start below QR code with smaller margin
-        line_height = max(font_large_size + 1, height // 15)  # Use font height + minimal padding, minimum 1/15 of label height
-        
-        # Whisky name
-        name = whisky_info['name']
-        max_name_length = width // (font_large_size // 2)  # Approximate characters that fit
-        if len(name) > max_name_length:
-            name = name[:max_name_length-3] + "..."
-        
-        # Center the text (accounting for border)
-        bbox = draw.textbbox((0, 0), name, font=font_large)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), name, fill='black', font=font_large)
-        y_position += line_height
-        
-        # Distillery
-        distillery = whisky_info['distillery']
-        max_distillery_length = width // (font_medium_size // 2)  # Approximate characters that fit
-        if len(distillery) > max_distillery_length:
-            distillery = distillery[:max_distillery_length-3] + "..."
-        
-        distillery_text = f"Distillery: {distillery}"
-        bbox = draw.textbbox((0, 0), distillery_text, font=font_medium)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), distillery_text, fill='black', font=font_medium)
-        y_position += line_height
-        
-        # ABV
-        abv = whisky_info.get('abv', 'Unknown ABV')
-        abv_text = f"ABV: {abv}"
-        bbox = draw.textbbox((0, 0), abv_text, font=font_medium)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), abv_text, fill='black', font=font_medium)
-        y_position += line_height
-        
-        # Age
-        if whisky_info.get('age'):
-            age = whisky_info['age']
-            age_text = f"Age: {age}"
-            bbox = draw.textbbox((0, 0), age_text, font=font_medium)
-            text_width = bbox[2] - bbox[0]
-            text_x = (width - text_width) // 2
-            draw.text((text_x, y_position), age_text, fill='black', font=font_medium)
-            y_position += line_height
-        
-        # Source note
-        if whisky_info.get('note'):
-            note = whisky_info['note']
-            bbox = draw.textbbox((0, 0), note, font=font_small)
-            text_width = bbox[2] - bbox[0]
-            text_x = (width - text_width) // 2
-            draw.text((text_x, y_position), note, fill='black', font=font_small)
-            y_position += line_height
-        
-        # Whisky ID
-        id_text = f"ID: {whisky_info['id']}"
-        bbox = draw.textbbox((0, 0), id_text, font=font_small)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), id_text, fill='black', font=font_small)
-        
-        # Save the label
-        image.save(output_filename)
-        
-        # Clean up QR code file
-        if os.path.exists(qr_filename):
-            os.remove(qr_filename)
-        
-        return output_filename
+# Initialize the generator
+generator = WhiskyLabelGenerator()
+artifacts = ArtifactStore()
+job_queue = open_job_queue()
 
-    def create_ql820nwb_label(self, whisky_info, output_filename="whisky_label_ql820nwb.png", size_preset='custom'):
-        """Create a whisky label optimized for Brother QL-820NWB thermal printer"""
-        # Get QL-820NWB settings
-        ql_settings = config.QL820NWB_SETTINGS
-        
-        # Get label dimensions based on preset
-        if size_preset in ql_settings['supported_sizes']:
-            width_mm = ql_settings['supported_sizes'][size_preset]['width_mm']
-            height_mm = ql_settings['supported_sizes'][size_preset]['height_mm']
-        else:
-            # Use custom size
-            width_mm = ql_settings['supported_sizes']['custom']['width_mm']
-            height_mm = ql_settings['supported_sizes']['custom']['height_mm']
-        
-        # Use QL-820NWB optimized DPI
-        dpi = ql_settings['dpi']
-        pixels_per_mm = dpi / 25.4
-        
-        width = int(width_mm * pixels_per_mm)
-        height = int(height_mm * pixels_per_mm)
-        
-        # Create image with pure white background for thermal printing
-        image = Image.new('RGB', (width, height), color=ql_settings['background_color'])
-        draw = ImageDraw.Draw(image)
-        
-        # Add black border for thermal printing
-        border_width = max(2, width // 150)  # Slightly thicker border for thermal printing
-        draw.rectangle([border_width, border_width, width - border_width, height - border_width], 
-                      outline=ql_settings['border_color'], width=border_width)
-        
-        # Calculate font sizes optimized for thermal printing
-        font_settings = ql_settings['font_settings']
-        base_font_size = min(width, height) // font_settings['base_font_size_ratio']
-        font_large_size = int(base_font_size * font_settings['large_font_multiplier'])
-        font_medium_size = int(base_font_size * font_settings['medium_font_multiplier'])
-        font_small_size = int(base_font_size * font_settings['small_font_multiplier'])
-        
-        try:
-            # Try to load Arial font for better thermal printing
-            font_large = ImageFont.truetype(font_settings['font_family'], font_large_size)
-            font_medium = ImageFont.truetype(font_settings['font_family'], font_medium_size)
-            font_small = ImageFont.truetype(font_settings['font_family'], font_small_size)
-        except:
-            # Fall back to default font
-            font_large = ImageFont.load_default()
-            font_medium = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-
-        # Create QR code optimized for thermal printing
-        qr_settings = ql_settings['qr_settings']
-        qr_filename = self.create_qr_code_thermal(whisky_info['url'], qr_settings)
-        qr_image = Image.open(qr_filename)
-        
-        # Resize QR code based on thermal printing settings
-        qr_size = min(width, int(height * qr_settings['size_ratio']))
-        qr_image = qr_image.resize((qr_size, qr_size))
-        
-        # Position QR code centered at the top
-        qr_x = (width - qr_size) // 2
-        qr_y = border_width * 2  # More margin for thermal printing
-        image.paste(qr_image, (qr_x, qr_y))
-        
-        # Add text content - start below QR code
-        y_position = qr_y + qr_size + (height // 25)  # More spacing for thermal printing
-        line_height = max(font_large_size + 2, height // 12)  # More line height for thermal printing
-        
-        # Whisky name
-        name = whisky_info['name']
-        max_name_length = width // (font_large_size // 3)  # More conservative character limit
-        if len(name) > max_name_length:
-            name = name[:max_name_length-3] + "..."
-        
-        # Center the text
-        bbox = draw.textbbox((0, 0), name, font=font_large)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), name, fill=ql_settings['text_color'], font=font_large)
-        y_position += line_height
-        
-        # Distillery
-        distillery = whisky_info['distillery']
-        max_distillery_length = width // (font_medium_size // 3)
-        if len(distillery) > max_distillery_length:
-            distillery = distillery[:max_distillery_length-3] + "..."
-        
-        distillery_text = f"Distillery: {distillery}"
-        bbox = draw.textbbox((0, 0), distillery_text, font=font_medium)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), distillery_text, fill=ql_settings['text_color'], font=font_medium)
-        y_position += line_height
-        
-        # ABV
-        abv = whisky_info.get('abv', 'Unknown ABV')
-        abv_text = f"ABV: {abv}"
-        bbox = draw.textbbox((0, 0), abv_text, font=font_medium)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), abv_text, fill=ql_settings['text_color'], font=font_medium)
-        y_position += line_height
-        
-        # Age
-        if whisky_info.get('age'):
-            age = whisky_info['age']
-            age_text = f"Age: {age}"
-            bbox = draw.textbbox((0, 0), age_text, font=font_medium)
-            text_width = bbox[2] - bbox[0]
-            text_x = (width - text_width) // 2
-            draw.text((text_x, y_position), age_text, fill=ql_settings['text_color'], font=font_medium)
-            y_position += line_height
-        
-        # Whisky ID
-        id_text = f"ID: {whisky_info['id']}"
-        bbox = draw.textbbox((0, 0), id_text, font=font_small)
-        text_width = bbox[2] - bbox[0]
-        text_x = (width - text_width) // 2
-        draw.text((text_x, y_position), id_text, fill=ql_settings['text_color'], font=font_small)
-        
-        # Save the label
-        image.save(output_filename, 'PNG', dpi=(dpi, dpi))
-        
-        # Clean up QR code file
-        if os.path.exists(qr_filename):
-            os.remove(qr_filename)
-        
-        return output_filename
-
-    def create_qr_code_thermal(self, url, qr_settings):
-        """Create QR code optimized for thermal printing"""
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=getattr(qrcode.constants, f'ERROR_CORRECT_{qr_settings["error_correction"]}'),
-            box_size=qr_settings['border'],
-            border=qr_settings['border']
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.stage_timing_token = metrics.start_request_timing()
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    if PROFILING_ENABLED and request.headers.get(PROFILE_HEADER):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+# Scheduling class per endpoint (see scheduler.py); everything else runs at print priority
+BULK_ENDPOINTS = {'api_batch_labels', 'api_batch_custom_labels'}
+INTERACTIVE_ENDPOINTS = {
+    'api_preview', 'api_ql820nwb_variants', 'api_ql820nwb_custom_variants', 'api_search',
+    'api_whisky', 'api_live_preview_edit', 'api_live_preview_events'
+}
+PRIORITY_HEADER = 'X-Priority'
+
+def _request_priority():
+    """Return the scheduling class of the current request"""
+    if request.endpoint in BULK_ENDPOINTS:
+        priority = 'bulk'
+    elif request.endpoint in INTERACTIVE_ENDPOINTS or request.values.get('purpose') == 'preview':
+        priority = 'interactive'
+    else:
+        priority = 'print'
+    # Clients may lower their own priority (e.g. cache warm-up scripts) but never raise it
+    requested = request.headers.get(PRIORITY_HEADER, '').lower()
+    if requested in scheduler.PRIORITIES and scheduler.PRIORITIES.index(requested) > scheduler.PRIORITIES.index(priority):
+        priority = requested
+    return priority
+
+@app.before_request
+def assign_priority():
+    g.priority_token = scheduler.set_priority(_request_priority())
+
+@app.after_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_id = _save_profile(profiler)
+        response.headers['X-Profile-Id'] = profile_id
+        response.headers['X-Profile-URL'] = f"/debug/profiles/{profile_id}"
+    started = g.get('request_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        metrics.REQUEST_SECONDS.observe(
+            elapsed,
+            endpoint=request.endpoint or 'unknown',
+            status=response.status_code
         )
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        # Create QR code image with black on white for thermal printing
-        qr_image = qr.make_image(fill_color='black', back_color='white')
-        qr_filename = f"qr_thermal_{int(time.time())}.png"
-        qr_image.save(qr_filename)
-        
-        return qr_filename
+        response.headers['Server-Timing'] = metrics.server_timing_header(metrics.request_stages(), elapsed)
+    return response
 
-# Initialize the generator
-generator = WhiskyLabelGenerator()
+@app.teardown_request
+def finish_request_metrics(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    token = g.pop('stage_timing_token', None)
+    if token is not None:
+        metrics.finish_request_timing(token)
+    token = g.pop('priority_token', None)
+    if token is not None:
+        scheduler.reset_priority(token)
+    if g.pop('request_started', None) is not None:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+
+def _save_profile(profiler):
+    """Write a request profile to PROFILE_DIR, keeping only the newest PROFILE_KEEP"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+    profiles = sorted(
+        (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith('.prof')),
+        key=os.path.getmtime
+    )
+    for stale in profiles[:-PROFILE_KEEP]:
+        os.remove(stale)
+    logger.info("Saved request profile profile_id=%s path=%s", profile_id, request.path)
+    return profile_id
+
+def _parse_flag(value):
+    """Interpret a query/form flag such as photo=1 or photo=true"""
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+PURPOSES = ('print', 'preview')
+FORMAT_ERROR = (f"Unsupported format or purpose; purpose is one of: {', '.join(PURPOSES)}. "
+                f"Print labels are {', '.join(label_render.OUTPUT_FORMATS)}; "
+                f"previews may also be {', '.join(label_render.PREVIEW_FORMATS)}")
+
+def _requested_purpose(values, default='print'):
+    """Return whether the label is for print or an on-screen preview, or None if unsupported"""
+    purpose = (values.get('purpose') or default).lower()
+    return purpose if purpose in PURPOSES else None
+
+def _requested_format(values, purpose='print', negotiate=True):
+    """Return the requested label output format, or None if unsupported
+
+    An explicit format parameter wins.  Otherwise print labels are PNG, and
+    previews use the best format the Accept header allows (negotiate=True, for
+    image responses) or the preferred preview format (for JSON responses).
+    """
+    if purpose is None:
+        return None
+    allowed = label_render.OUTPUT_FORMATS
+    if purpose == 'preview':
+        allowed += label_render.available_preview_formats()
+    if values.get('format'):
+        output_format = values['format'].lower()
+        return output_format if output_format in allowed else None
+    if purpose == 'print':
+        return 'png'
+    preferred = [output_format for output_format in config.PREVIEW_FORMAT_PREFERENCE if output_format in allowed]
+    if not negotiate:
+        return preferred[0]
+    mimetype = request.accept_mimetypes.best_match([label_render.MIMETYPES[output_format] for output_format in preferred])
+    return next((output_format for output_format in preferred if label_render.MIMETYPES[output_format] == mimetype), 'png')
+
+def _custom_whisky_info(data):
+    """Build whisky info from manually entered label data"""
+    return {
+        'id': data.get('id', 0),
+        'name': data['name'],
+        'distillery': data['distillery'],
+        'abv': data.get('abv', 'Unknown ABV'),
+        'age': data.get('age', ''),
+        'url': f"{os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')}/whisky/{data.get('id', 0)}",
+        'source': 'api_custom'
+    }
+
+def _label_payload(layout, label_data, output_format):
+    """Describe a rendered label for a JSON response, with the label inlined as a data URI"""
+    mimetype = label_render.MIMETYPES[output_format]
+    return {
+        'format': output_format,
+        'mimetype': mimetype,
+        'width': layout.width,
+        'height': layout.height,
+        'dpi': layout.dpi,
+        'data_uri': f"data:{mimetype};base64,{base64.b64encode(label_data).decode('ascii')}"
+    }
+
+def _list_param(value):
+    """Items of a comma-separated query value or of a JSON list"""
+    items = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    return [str(item).strip() for item in items if str(item).strip()]
+
+def _requested_variants(values):
+    """Return the (size_preset, dpi) pairs asked for with sizes=small,medium&dpi=300,150
+
+    JSON bodies may give either as a list instead.  Every preset is rendered
+    by default, at the printer's DPI.  Raises ValueError with a message for
+    the client if the request is invalid.
+    """
+    supported_sizes = config.QL820NWB_SETTINGS['supported_sizes']
+    sizes = _list_param(values.get('sizes') or list(supported_sizes))
+    unknown = [size for size in sizes if size not in supported_sizes]
+    if unknown:
+        raise ValueError(f"Unknown size preset(s) {', '.join(unknown)}; choose from: {', '.join(supported_sizes)}")
+    try:
+        dpis = [int(dpi) for dpi in _list_param(values.get('dpi') or config.QL820NWB_SETTINGS['dpi'])]
+    except ValueError:
+        raise ValueError('dpi must be a number or a list of numbers')
+    if any(dpi < 36 or dpi > 600 for dpi in dpis):
+        raise ValueError('dpi must be between 36 and 600')
+    variants = [(size, dpi) for size in dict.fromkeys(sizes) for dpi in dict.fromkeys(dpis)]
+    if len(variants) > config.MAX_LABEL_VARIANTS:
+        raise ValueError(f"At most {config.MAX_LABEL_VARIANTS} size/DPI combinations per request")
+    return variants
+
+def _send_variants(whisky_info, values, show_photo=False):
+    """Render every requested QL-820NWB variant of one whisky and send them as JSON"""
+    purpose = _requested_purpose(values, default='preview')
+    output_format = _requested_format(values, purpose, negotiate=False)
+    if output_format is None:
+        return jsonify({'error': FORMAT_ERROR}), 400
+    try:
+        variants = _requested_variants(values)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rendered = generator.render_ql820nwb_variants(whisky_info, variants, output_format, show_photo=show_photo,
+                                                  purpose=purpose)
+    with metrics.stage('response'):
+        return jsonify({
+            'whisky': whisky_info,
+            'purpose': purpose,
+            'labels': [
+                dict(_label_payload(layout, label_data, output_format), size=size_preset)
+                for size_preset, dpi, layout, label_data in rendered
+            ]
+        })
+
+def _send_label(layout, output_format='png', purpose='print'):
+    """Render a label layout and send it straight from memory"""
+    label_data = generator.render_layout(layout, output_format, purpose)
+    with metrics.stage('response'):
+        response = Response(label_data, mimetype=label_render.MIMETYPES[output_format])
+        if purpose == 'preview':
+            # Preview formats are negotiated from the Accept header
+            response.vary.add('Accept')
+        return response
+
+@app.errorhandler(scheduler.Overloaded)
+def service_overloaded(e):
+    """Shed load quickly: the fetch or render queue is full, so ask the client to come back later"""
+    logger.warning("Overloaded: %s (retry after %ss)", e, e.retry_after)
+    response = jsonify({'error': 'Service overloaded, please retry later', 'resource': e.resource})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/artifacts/<name>')
+def serve_artifact(name):
+    """Serve a stored label or batch archive; artifact names are content hashes, so they never change"""
+    artifact = artifacts.open(name)
+    if artifact is None:
+        return jsonify({'error': 'Artifact not found'}), 404
+    digest, extension = name.rsplit('.', 1)
+    mimetype = label_render.MIMETYPES.get(extension, 'application/zip')
+    response = send_file(artifact, mimetype=mimetype, max_age=config.ARTIFACT_CACHE_MAX_AGE, conditional=True,
+                         etag=digest)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/debug/profiles/<profile_id>')
+def debug_profile(profile_id):
+    """Download a captured request profile (pstats format, or ?format=text)"""
+    if not PROFILING_ENABLED:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    try:
+        profile_id = uuid.UUID(profile_id).hex
+    except ValueError:
+        return jsonify({'error': 'Invalid profile ID'}), 400
+    profile_path = os.path.abspath(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+    if not os.path.exists(profile_path):
+        return jsonify({'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'text':
+        output = io.StringIO()
+        stats = pstats.Stats(profile_path, stream=output)
+        stats.sort_stats('cumulative').print_stats(request.args.get('limit', type=int, default=50))
+        return Response(output.getvalue(), mimetype='text/plain')
+    return send_file(profile_path, mimetype='application/octet-stream', as_attachment=True, download_name=f"{profile_id}.prof")
 
 @app.route('/')
 def index():
@@ -619,6 +310,11 @@ def generate_label():
     width_mm = request.form.get('width_mm', type=float, default=35.0)
     height_mm = request.form.get('height_mm', type=float, default=37.0)
     dpi = request.form.get('dpi', type=int, default=72)  # 72 DPI for screen, 300 for print
+    show_photo = request.form.get('photo', type=_parse_flag, default=False)
+    purpose = _requested_purpose(request.form)
+    output_format = _requested_format(request.form, purpose)
+    if output_format is None:
+        return jsonify({'error': FORMAT_ERROR}), 400
     
     if whisky_name and distillery and abv:
         # Use manual data if provided
@@ -638,22 +334,26 @@ def generate_label():
         return jsonify({'error': 'Please provide either a Whiskybase ID or manual whisky details (name, distillery, and ABV)'}), 400
     
     # Generate label
-    label_filename = generator.create_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi)
+    layout = generator.layout_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi, show_photo=show_photo)
     
-    return send_file(label_filename, mimetype='image/png')
+    return _send_label(layout, output_format, purpose)
 
 @app.route('/api/label/<int:whisky_id>')
 def api_label(whisky_id):
     """API endpoint to generate label for a specific whisky ID"""
-    whisky_info = generator.get_whisky_info(whisky_id)
-    
     # Get label size parameters from query string (default to 35mm x 37mm)
     width_mm = request.args.get('width_mm', type=float, default=35.0)
     height_mm = request.args.get('height_mm', type=float, default=37.0)
     dpi = request.args.get('dpi', type=int, default=72)  # 72 DPI for screen, 300 for print
+    show_photo = request.args.get('photo', type=_parse_flag, default=False)
+    purpose = _requested_purpose(request.args)
+    output_format = _requested_format(request.args, purpose)
+    if output_format is None:
+        return jsonify({'error': FORMAT_ERROR}), 400
     
-    label_filename = generator.create_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi)
-    return send_file(label_filename, mimetype='image/png')
+    whisky_info = generator.get_whisky_info(whisky_id)
+    layout = generator.layout_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi, show_photo=show_photo)
+    return _send_label(layout, output_format, purpose)
 
 @app.route('/api/custom-label', methods=['POST', 'GET'])
 def api_custom_label():
@@ -674,33 +374,33 @@ def api_custom_label():
     width_mm = request.args.get('width_mm', type=float, default=35.0)
     height_mm = request.args.get('height_mm', type=float, default=37.0)
     dpi = request.args.get('dpi', type=int, default=72)  # 72 DPI for screen, 300 for print
+    purpose = _requested_purpose(request.args)
+    output_format = _requested_format(request.args, purpose)
+    if output_format is None:
+        return jsonify({'error': FORMAT_ERROR}), 400
     
     if not data or not data.get('name') or not data.get('distillery'):
         return jsonify({'error': 'Name and distillery are required'}), 400
     
-    whisky_info = {
-        'id': data.get('id', 0),
-        'name': data['name'],
-        'distillery': data['distillery'],
-        'abv': data.get('abv', 'Unknown ABV'),
-        'age': data.get('age', ''),
-        'url': f"{os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')}/whisky/{data.get('id', 0)}",
-        'source': 'api_custom'
-    }
+    whisky_info = _custom_whisky_info(data)
     
-    label_filename = generator.create_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi)
-    return send_file(label_filename, mimetype='image/png')
+    layout = generator.layout_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi)
+    return _send_label(layout, output_format, purpose)
 
 @app.route('/api/ql820nwb/<int:whisky_id>')
 def api_ql820nwb_label(whisky_id):
     """API endpoint to generate label optimized for Brother QL-820NWB printer"""
-    whisky_info = generator.get_whisky_info(whisky_id)
-    
     # Get size preset from query string (default to 'custom')
     size_preset = request.args.get('size', default='custom')
+    show_photo = request.args.get('photo', type=_parse_flag, default=False)
+    purpose = _requested_purpose(request.args)
+    output_format = _requested_format(request.args, purpose)
+    if output_format is None:
+        return jsonify({'error': FORMAT_ERROR}), 400
     
-    label_filename = generator.create_ql820nwb_label(whisky_info, size_preset=size_preset)
-    return send_file(label_filename, mimetype='image/png')
+    whisky_info = generator.get_whisky_info(whisky_id)
+    layout = generator.layout_ql820nwb_label(whisky_info, size_preset=size_preset, show_photo=show_photo)
+    return _send_label(layout, output_format, purpose)
 
 @app.route('/api/ql820nwb/custom', methods=['POST', 'GET'])
 def api_ql820nwb_custom_label():
@@ -719,22 +419,35 @@ def api_ql820nwb_custom_label():
     
     # Get size preset from query string (default to 'custom')
     size_preset = request.args.get('size', default='custom')
+    purpose = _requested_purpose(request.args)
+    output_format = _requested_format(request.args, purpose)
+    if output_format is None:
+        return jsonify({'error': FORMAT_ERROR}), 400
     
     if not data or not data.get('name') or not data.get('distillery'):
         return jsonify({'error': 'Name and distillery are required'}), 400
     
-    whisky_info = {
-        'id': data.get('id', 0),
-        'name': data['name'],
-        'distillery': data['distillery'],
-        'abv': data.get('abv', 'Unknown ABV'),
-        'age': data.get('age', ''),
-        'url': f"{os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')}/whisky/{data.get('id', 0)}",
-        'source': 'api_custom'
-    }
+    whisky_info = _custom_whisky_info(data)
     
-    label_filename = generator.create_ql820nwb_label(whisky_info, size_preset=size_preset)
-    return send_file(label_filename, mimetype='image/png')
+    layout = generator.layout_ql820nwb_label(whisky_info, size_preset=size_preset)
+    return _send_label(layout, output_format, purpose)
+
+@app.route('/api/ql820nwb/<int:whisky_id>/variants')
+def api_ql820nwb_variants(whisky_id):
+    """Render several QL-820NWB size presets and resolutions of one whisky from a single lookup"""
+    show_photo = request.args.get('photo', type=_parse_flag, default=False)
+    whisky_info = generator.get_whisky_info(whisky_id)
+    return _send_variants(whisky_info, request.args, show_photo=show_photo)
+
+@app.route('/api/ql820nwb/custom/variants', methods=['POST'])
+def api_ql820nwb_custom_variants():
+    """Render several QL-820NWB size presets and resolutions of a label with custom data"""
+    data = request.get_json(silent=True)
+    if not data or not data.get('name') or not data.get('distillery'):
+        return jsonify({'error': 'Name and distillery are required'}), 400
+    # Options may be given in the body or the query string
+    values = {key: data.get(key, request.args.get(key)) for key in ('sizes', 'dpi', 'format', 'purpose')}
+    return _send_variants(_custom_whisky_info(data), values)
 
 @app.route('/api/whisky/<int:whisky_id>')
 def api_whisky(whisky_id):
@@ -742,6 +455,50 @@ def api_whisky(whisky_id):
     whisky_info = generator.get_whisky_info(whisky_id)
     return jsonify(whisky_info)
 
+@app.route('/api/search')
+def api_search():
+    """Search whiskies seen before by name, distillery, bottler, region, ABV or age"""
+    query = request.args.get('q', default='').strip()
+    limit = request.args.get('limit', type=int, default=config.SEARCH_RESULT_LIMIT)
+    if not query:
+        return jsonify({'error': 'Query parameter q is required'}), 400
+    if limit < 1 or limit > 100:
+        return jsonify({'error': 'limit must be between 1 and 100'}), 400
+
+    with metrics.stage('search'):
+        results = generator.search_index.search(query, limit=limit)
+    return jsonify({'query': query, 'results': results})
+
+@app.route('/api/preview/<int:whisky_id>')
+def api_preview(whisky_id):
+    """API endpoint returning whisky information and its rendered label in one response"""
+    printer_type = request.args.get('printer_type', default='standard')
+    size_preset = request.args.get('size', default='custom')
+    width_mm = request.args.get('width_mm', type=float, default=35.0)
+    height_mm = request.args.get('height_mm', type=float, default=37.0)
+    dpi = request.args.get('dpi', type=int, default=72)
+    show_photo = request.args.get('photo', type=_parse_flag, default=False)
+    # The label is embedded in JSON for on-screen display, so it is a preview unless asked otherwise
+    purpose = _requested_purpose(request.args, default='preview')
+    output_format = _requested_format(request.args, purpose, negotiate=False)
+    if output_format is None:
+        return jsonify({'error': FORMAT_ERROR}), 400
+    
+    # One upstream lookup serves both the metadata panel and the label
+    whisky_info = generator.get_whisky_info(whisky_id)
+    if printer_type == 'ql820nwb':
+        layout = generator.layout_ql820nwb_label(whisky_info, size_preset=size_preset, show_photo=show_photo)
+    else:
+        layout = generator.layout_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi, show_photo=show_photo)
+    label_data = generator.render_layout(layout, output_format, purpose)
+    
+    with metrics.stage('response'):
+        return jsonify({
+            'whisky': whisky_info,
+            'purpose': purpose,
+            'label': _label_payload(layout, label_data, output_format)
+        })
+
 @app.route('/debug/whisky/<int:whisky_id>')
 def debug_whisky(whisky_id):
     """Debug endpoint to see raw whisky data"""
@@ -759,12 +516,14 @@ def api_print_label(whisky_id):
     width_mm = request.args.get('width_mm', type=float, default=35.0)
     height_mm = request.args.get('height_mm', type=float, default=37.0)
     dpi = request.args.get('dpi', type=int, default=72)
+    show_photo = request.args.get('photo', type=_parse_flag, default=False)
     
-    # Generate appropriate label
+    # Generate appropriate label and keep it in the artifact store so the page can load it
     if printer_type == 'ql820nwb':
-        label_filename = generator.create_ql820nwb_label(whisky_info, size_preset=size_preset)
+        layout = generator.layout_ql820nwb_label(whisky_info, size_preset=size_preset, show_photo=show_photo)
     else:
-        label_filename = generator.create_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi)
+        layout = generator.layout_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi, show_photo=show_photo)
+    label_url = artifacts.url(artifacts.put(generator.render_layout(layout, 'png'), 'png'))
     
     # Return HTML page that auto-prints
     html_content = f"""
@@ -789,7 +548,7 @@ def api_print_label(whisky_id):
     </head>
     <body>
         <div class="label-container">
-            <img src="/{label_filename}" alt="Whisky Label" style="max-width: 100%; height: auto;">
+            <img src="{label_url}" alt="Whisky Label" style="max-width: 100%; height: auto;">
         </div>
         <br>
         <button class="print-button" onclick="window.print()">🖨️ Print Label</button>
@@ -807,6 +566,89 @@ def api_print_label(whisky_id):
     
     return html_content
 
+def _live_preview_fields(data):
+    """Validate one live preview edit; raises ValueError with a message for the client"""
+    supported_sizes = config.QL820NWB_SETTINGS['supported_sizes']
+    fields = {key: str(data.get(key) or '').strip() for key in ('name', 'distillery', 'abv', 'age', 'id')}
+    fields['printer_type'] = data.get('printer_type') or 'standard'
+    if fields['printer_type'] not in ('standard', 'ql820nwb'):
+        raise ValueError('printer_type must be standard or ql820nwb')
+    fields['size'] = data.get('size') or 'custom'
+    if fields['size'] not in supported_sizes:
+        raise ValueError(f"Unknown size preset; choose from: {', '.join(supported_sizes)}")
+    try:
+        fields['width_mm'] = float(data.get('width_mm') or 35)
+        fields['height_mm'] = float(data.get('height_mm') or 37)
+    except (TypeError, ValueError):
+        raise ValueError('width_mm and height_mm must be numbers')
+    if not (10 <= fields['width_mm'] <= 200 and 10 <= fields['height_mm'] <= 200):
+        raise ValueError('width_mm and height_mm must be between 10 and 200')
+    fields['format'] = _requested_format(data, 'preview', negotiate=False)
+    if fields['format'] is None:
+        raise ValueError(FORMAT_ERROR)
+    return fields
+
+def _render_live_preview(fields, check, cache):
+    """Render one live preview frame at LIVE_PREVIEW_DPI, reusing the session's last QR code"""
+    whisky_info = _custom_whisky_info(dict(
+        fields,
+        name=fields['name'] or 'Whisky name',
+        distillery=fields['distillery'] or 'Distillery',
+        abv=fields['abv'] or 'Unknown ABV',
+        id=fields['id'] or 0
+    ))
+    qr_key = (fields['printer_type'], whisky_info['url'])
+    if cache.get('qr_key') != qr_key:
+        if fields['printer_type'] == 'ql820nwb':
+            cache['qr_matrix'] = generator._ql820nwb_qr_matrix(whisky_info['url'])
+        else:
+            cache['qr_matrix'] = generator._qr_matrix(whisky_info['url'], error_correction='L', border=4)
+        cache['qr_key'] = qr_key
+    check()
+
+    if fields['printer_type'] == 'ql820nwb':
+        layout = generator.layout_ql820nwb_label(whisky_info, size_preset=fields['size'], dpi=config.LIVE_PREVIEW_DPI,
+                                                 qr_matrix=cache['qr_matrix'])
+    else:
+        layout = generator.layout_label(whisky_info, width_mm=fields['width_mm'], height_mm=fields['height_mm'],
+                                        dpi=config.LIVE_PREVIEW_DPI, qr_matrix=cache['qr_matrix'])
+    check()
+    label_data = generator.render_layout(layout, fields['format'], 'preview')
+    return _label_payload(layout, label_data, fields['format'])
+
+live_previews = live_preview.LivePreviews(_render_live_preview)
+
+@app.route('/api/live-preview/<session_id>', methods=['POST'])
+def api_live_preview_edit(session_id):
+    """Queue an edit of the manual-entry form for debounced rendering on the session's event stream"""
+    if not live_preview.SESSION_ID.match(session_id):
+        return jsonify({'error': 'Invalid session ID'}), 400
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object of label fields'}), 400
+    try:
+        fields = _live_preview_fields(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    version = live_previews.submit(session_id, fields)
+    if version is None:
+        return jsonify({'error': 'Too many live preview sessions'}), 503
+    return jsonify({'version': version}), 202
+
+@app.route('/api/live-preview/<session_id>/events')
+def api_live_preview_events(session_id):
+    """Server-sent events carrying the latest rendered frame of a live preview session"""
+    if not live_preview.SESSION_ID.match(session_id):
+        return jsonify({'error': 'Invalid session ID'}), 400
+    session = live_previews.session(session_id)
+    if session is None:
+        return jsonify({'error': 'Too many live preview sessions'}), 503
+    response = Response(live_previews.listen(session), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/batch-labels', methods=['POST'])
 def api_batch_labels():
     """API endpoint for generating multiple labels from a list of IDs"""
@@ -820,53 +662,257 @@ def api_batch_labels():
         dpi = int(data.get('dpi', 72))
         printer_type = data.get('printer_type', 'standard')
         ql820nwb_size = data.get('ql820nwb_size', 'custom')
+        show_photo = bool(data.get('show_photo', False))
+        output_format = _requested_format(data)
+        if output_format is None:
+            return jsonify({'error': FORMAT_ERROR}), 400
         
         if not whisky_ids:
             return jsonify({'error': 'No whisky IDs provided'}), 400
+        metrics.BATCH_SIZE.observe(len(whisky_ids))
         
-        generator = WhiskyLabelGenerator()
-        generated_files = []
-        
-        for whisky_id in whisky_ids:
-            try:
-                # Get whisky info
-                whisky_info = generator.get_whisky_info(whisky_id)
-                
-                # Generate label based on printer type
-                if printer_type == 'ql820nwb':
-                    output_filename = f"whisky_{whisky_id}_ql820nwb_{int(time.time())}.png"
-                    generator.create_ql820nwb_label(whisky_info, output_filename, size_preset=ql820nwb_size)
-                else:
-                    output_filename = f"whisky_{whisky_id}_label_{int(time.time())}.png"
-                    generator.create_label(whisky_info, output_filename, width_mm, height_mm, dpi)
-                
-                generated_files.append({
-                    'whisky_id': whisky_id,
-                    'filename': output_filename,
-                    'whisky_info': whisky_info
-                })
-                
-            except Exception as e:
-                generated_files.append({
-                    'whisky_id': whisky_id,
-                    'error': str(e),
-                    'filename': None
-                })
+        batch_time = int(time.time())
         
-        # Create a ZIP file with all labels
+        # Labels go straight into a ZIP in the artifact store; nothing is left in the working directory
         import zipfile
-        import os
         
-        zip_filename = f"batch_labels_{int(time.time())}.zip"
-        with zipfile.ZipFile(zip_filename, 'w') as zipf:
-            for file_info in generated_files:
-                if file_info.get('filename') and os.path.exists(file_info['filename']):
-                    zipf.write(file_info['filename'], os.path.basename(file_info['filename']))
+        # Refuse the whole batch up front rather than failing part way through
+        scheduler.scheduler('fetch').admit()
+        scheduler.scheduler('render').admit()
         
-        return send_file(zip_filename, mimetype='application/zip', as_attachment=True, download_name=zip_filename)
+        zip_file, temp_path = artifacts.new_temp_file('zip')
+        try:
+            errors = []
+            with zip_file, zipfile.ZipFile(zip_file, 'w') as zipf:
+                for whisky_id in whisky_ids:
+                    try:
+                        # Get whisky info
+                        whisky_info = generator.get_whisky_info(whisky_id)
+                    
+                        # Generate label based on printer type; layout and rendering share one
+                        # render slot, so the batch stays within the bulk share of the scheduler
+                        with scheduler.slot('render'):
+                            if printer_type == 'ql820nwb':
+                                output_filename = f"whisky_{whisky_id}_ql820nwb_{batch_time}.{output_format}"
+                                layout = generator.layout_ql820nwb_label(whisky_info, size_preset=ql820nwb_size, show_photo=show_photo)
+                            else:
+                                output_filename = f"whisky_{whisky_id}_label_{batch_time}.{output_format}"
+                                layout = generator.layout_label(whisky_info, width_mm, height_mm, dpi, show_photo=show_photo)
+                            label_data = generator.render_layout(layout, output_format)
+                        zipf.writestr(output_filename, label_data)
+                    
+                    except scheduler.Overloaded:
+                        raise
+                    except Exception as e:
+                        logger.warning("Batch label failed whisky_id=%s: %s", whisky_id, e)
+                        errors.append({'whisky_id': whisky_id, 'error': str(e)})
+                # Failed IDs are listed in the archive, like the custom batch's rejected rows
+                if errors:
+                    zipf.writestr('errors.ndjson', ''.join(json.dumps(entry) + '\n' for entry in errors))
+            
+            # Opened before it is stored, so the collector cannot evict it from under the response
+            archive = open(temp_path, 'rb')
+            try:
+                artifact_name = artifacts.put_file(temp_path, 'zip')
+            except BaseException:
+                archive.close()
+                raise
+        finally:
+            # Only left behind when the batch failed; put_file moves or removes it otherwise
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+        
+        response = send_file(archive, mimetype='application/zip', as_attachment=True, download_name=f"batch_labels_{batch_time}.zip")
+        response.headers['X-Artifact-URL'] = artifacts.url(artifact_name)
+        return response
         
+    except scheduler.Overloaded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/batch-custom-labels', methods=['POST'])
+def api_batch_custom_labels():
+    """API endpoint rendering a streamed CSV or NDJSON body of custom label rows into a streamed ZIP"""
+    input_format = label_stream.input_format_for(request.content_type, request.args.get('input'))
+    if input_format is None:
+        return jsonify({'error': 'Send text/csv or application/x-ndjson (or set input=csv|ndjson)'}), 400
+    output_format = _requested_format(request.args)
+    if output_format is None:
+        return jsonify({'error': FORMAT_ERROR}), 400
+
+    printer_type = request.args.get('printer_type', default='standard')
+    default_size = request.args.get('size', default='custom')
+    default_width_mm = request.args.get('width_mm', type=float, default=35.0)
+    default_height_mm = request.args.get('height_mm', type=float, default=37.0)
+    dpi = request.args.get('dpi', type=int, default=72)
+    if not (10 <= default_width_mm <= 200 and 10 <= default_height_mm <= 200):
+        return jsonify({'error': 'width_mm and height_mm must be between 10 and 200'}), 400
+    if not 36 <= dpi <= 600:
+        return jsonify({'error': 'dpi must be between 36 and 600'}), 400
+    supported_sizes = config.QL820NWB_SETTINGS['supported_sizes']
+    max_rows = int(os.getenv('BATCH_MAX_ROWS', config.BATCH_MAX_ROWS))
+    # Refuse before streaming starts; once the ZIP is under way, refused rows are reported in errors.ndjson
+    scheduler.scheduler('render').admit()
+
+    def layout_row(fields):
+        """Validate one row and lay out its label; raises ValueError for bad rows"""
+        if not fields.get('name') or not fields.get('distillery'):
+            raise ValueError('Name and distillery are required')
+        data = {key: fields[key] for key in ('id', 'name', 'distillery', 'abv', 'age') if fields.get(key)}
+        whisky_info = _custom_whisky_info(data)
+        size_preset = fields.get('size') or default_size
+        if size_preset not in supported_sizes:
+            raise ValueError(f"Unknown size {size_preset!r}; choose one of: {', '.join(supported_sizes)}")
+        if printer_type == 'ql820nwb':
+            return generator.layout_ql820nwb_label(whisky_info, size_preset=size_preset)
+        if fields.get('size'):
+            width_mm = supported_sizes[size_preset]['width_mm']
+            height_mm = supported_sizes[size_preset]['height_mm']
+        else:
+            try:
+                width_mm = float(fields.get('width_mm') or default_width_mm)
+                height_mm = float(fields.get('height_mm') or default_height_mm)
+            except ValueError:
+                raise ValueError('width_mm and height_mm must be numbers')
+            # Bounded like the live preview, so one row cannot force a huge image
+            if not (10 <= width_mm <= 200 and 10 <= height_mm <= 200):
+                raise ValueError('width_mm and height_mm must be between 10 and 200')
+        return generator.layout_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi)
+
+    def generate():
+        # Rows are rendered as they arrive and each label leaves as soon as it is zipped
+        archive = label_stream.ZipStream()
+        rendered = 0
+        errors = []
+        for row_number, fields, error in label_stream.read_label_rows(request.stream, input_format):
+            if row_number > max_rows:
+                errors.append({'row': row_number, 'error': f"Batch is limited to {max_rows} rows"})
+                break
+            if error is None:
+                try:
+                    with scheduler.slot('render'):
+                        label_data = generator.render_layout(layout_row(fields), output_format)
+                except ValueError as e:
+                    error = str(e)
+                except scheduler.Overloaded:
+                    error = 'Service overloaded; retry this row later'
+                except Exception as e:
+                    # The ZIP is already streaming, so a broken row must not end it
+                    logger.exception("Batch custom labels: row %d failed", row_number)
+                    error = f'Could not render this row: {e}'
+            if error is not None:
+                errors.append({'row': row_number, 'error': error})
+                continue
+            rendered += 1
+            label_id = fields.get('id') or 'custom'
+            yield archive.add(f"label_{row_number:05d}_{label_id}.{output_format}", label_data)
+
+        metrics.BATCH_SIZE.observe(rendered + len(errors))
+        if errors:
+            logger.warning("Batch custom labels: %d rendered, %d rejected rows", rendered, len(errors))
+            yield archive.add('errors.ndjson', ''.join(json.dumps(entry) + '\n' for entry in errors))
+        yield archive.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=custom_labels_{int(time.time())}.zip'}
+    )
+
+JOB_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+def _job_options(data):
+    """Label options of a batch job, validated here so workers never see bad input"""
+    output_format = _requested_format(data)
+    if output_format is None:
+        raise ValueError(FORMAT_ERROR)
+    printer_type = data.get('printer_type', 'standard')
+    if printer_type not in ('standard', 'ql820nwb'):
+        raise ValueError("printer_type must be 'standard' or 'ql820nwb'")
+    ql820nwb_size = data.get('ql820nwb_size', 'custom')
+    if ql820nwb_size not in config.QL820NWB_SETTINGS['supported_sizes']:
+        raise ValueError(f"Unknown ql820nwb_size {ql820nwb_size!r}")
+    return {
+        'printer_type': printer_type,
+        'ql820nwb_size': ql820nwb_size,
+        'width_mm': int(data.get('width_mm', 35)),
+        'height_mm': int(data.get('height_mm', 37)),
+        'dpi': int(data.get('dpi', 72)),
+        'show_photo': bool(data.get('show_photo', False)),
+        'format': output_format,
+    }
+
+def _job_artifacts():
+    """Artifacts of batch jobs, which the collector keeps until their job is deleted or expires"""
+    job_queue.purge_expired(int(os.getenv('JOB_RETENTION_SECONDS', config.JOB_RETENTION_SECONDS)))
+    return job_queue.artifacts()
+
+artifacts.pinned = _job_artifacts
+
+def _job_progress(job_id, with_items=False):
+    progress = job_queue.progress(job_id)
+    if progress is not None and with_items:
+        progress['items'] = [
+            dict(item, url=artifacts.url(item['artifact']) if item['artifact'] else None)
+            for item in job_queue.items(job_id)
+        ]
+    return progress
+
+@app.route('/api/jobs', methods=['POST'])
+def api_create_job():
+    """Queue a batch job for the distributed workers (batch_worker.py)
+
+    Takes the same options as /api/batch-labels plus an optional job_id, which
+    makes resubmitting the same job safe.  Answers 202 with the progress URL.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        whisky_ids = [int(whisky_id) for whisky_id in data.get('whisky_ids', [])]
+        options = _job_options(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if not whisky_ids:
+        return jsonify({'error': 'No whisky IDs provided'}), 400
+    max_items = int(os.getenv('JOB_MAX_ITEMS', config.JOB_MAX_ITEMS))
+    if len(whisky_ids) > max_items:
+        return jsonify({'error': f'At most {max_items} whisky IDs per job'}), 400
+    job_id = data.get('job_id')
+    if job_id is not None and not JOB_ID.match(str(job_id)):
+        return jsonify({'error': 'job_id may only contain letters, digits, - and _'}), 400
+
+    job_id = job_queue.create_job(whisky_ids, options, job_id)
+    metrics.BATCH_SIZE.observe(len(whisky_ids))
+    response = jsonify(_job_progress(job_id))
+    response.status_code = 202
+    response.headers['Location'] = f'/api/jobs/{job_id}'
+    return response
+
+@app.route('/api/jobs')
+def api_jobs():
+    """Aggregate progress of all batch jobs, for the coordinator dashboard"""
+    jobs = job_queue.jobs()
+    totals = {key: sum(job[key] for job in jobs) for key in ('total',) + JOB_STATES}
+    finished = totals['done'] + totals['failed']
+    totals['progress'] = finished / totals['total'] if totals['total'] else 1.0
+    return jsonify({'jobs': jobs, 'totals': totals, 'workers': job_queue.workers()})
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """Progress of one batch job with every item's state and artifact URL"""
+    progress = _job_progress(job_id, with_items=True) if JOB_ID.match(job_id) else None
+    if progress is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(progress)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def api_delete_job(job_id):
+    """Collect a finished job: forget it and let the collector reclaim its artifacts"""
+    if not JOB_ID.match(job_id) or not job_queue.delete_job(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    return '', 204
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
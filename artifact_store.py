@@ -0,0 +1,219 @@
+"""
+Bounded, content-addressed store for generated labels and batch archives
+
+Artifacts are named after the SHA-256 of their content, so identical labels
+share one file and an artifact URL never changes meaning; that lets the
+/artifacts route serve them with long-lived cache headers.  A background
+collector removes artifacts older than the configured age and evicts the
+least recently used ones once the store grows past its size quota, so disk
+use stays flat under continuous load.  Artifacts still referenced elsewhere,
+such as the results of batch jobs, can be pinned so the collector keeps them.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+import config
+import metrics
+
+logger = logging.getLogger('whisky_label.artifacts')
+
+ARTIFACT_NAME = re.compile(r'^[0-9a-f]{32}\.(png|svg|pdf|zip)$')
+# Temp files left behind by a crashed writer are removed after this long
+STALE_TEMP_SECONDS = 3600
+# Reads refresh an artifact's mtime (its last use) at most this often
+TOUCH_INTERVAL_SECONDS = 60
+
+
+class ArtifactStore:
+    def __init__(self, root_dir=None, max_bytes=None, max_age_seconds=None, gc_interval_seconds=None, background_gc=True,
+                 pinned=None):
+        # Absolute, because send_file resolves relative paths against the app root, not the cwd
+        self.root_dir = os.path.abspath(root_dir or os.getenv('ARTIFACT_DIR', config.ARTIFACT_DIR))
+        self.max_bytes = max_bytes or int(os.getenv('ARTIFACT_MAX_BYTES', config.ARTIFACT_MAX_BYTES))
+        self.max_age_seconds = max_age_seconds or int(os.getenv('ARTIFACT_MAX_AGE_SECONDS', config.ARTIFACT_MAX_AGE_SECONDS))
+        self.gc_interval_seconds = gc_interval_seconds or int(os.getenv('ARTIFACT_GC_INTERVAL_SECONDS', config.ARTIFACT_GC_INTERVAL_SECONDS))
+        self.background_gc = background_gc
+        # Callable returning the names the collector must keep, e.g. results of unfinished jobs
+        self.pinned = pinned
+        self._lock = threading.Lock()
+        self._gc_lock = threading.Lock()
+        self._gc_thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._bytes_since_gc = 0
+
+    def _path(self, name):
+        # Shard by the first two hex digits to keep directories small
+        return os.path.join(self.root_dir, name[:2], name)
+
+    def path(self, name):
+        """Return the local path of an artifact, or None if the name is invalid or missing"""
+        if not ARTIFACT_NAME.match(name):
+            return None
+        path = self._path(name)
+        return path if os.path.exists(path) else None
+
+    def open(self, name):
+        """Open an artifact for reading and mark it used; None if the name is invalid or missing
+
+        The returned file stays readable even if the collector removes the artifact meanwhile.
+        """
+        if not ARTIFACT_NAME.match(name):
+            return None
+        path = self._path(name)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        # Eviction is by mtime, so reads must count as use; throttled to spare the disk
+        if time.time() - os.fstat(f.fileno()).st_mtime > TOUCH_INTERVAL_SECONDS:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return f
+
+    def url(self, name):
+        return f"/artifacts/{name}"
+
+    def put(self, data, extension):
+        """Store bytes and return the artifact name"""
+        name = f"{hashlib.sha256(data).hexdigest()[:32]}.{extension}"
+        path = self._path(name)
+        if self._touch(path):
+            return name
+
+        metrics.CACHE_EVENTS.inc(cache='artifact', event='miss')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique temp name, since workers on other hosts may write the same artifact at once
+        fd, temp_path = tempfile.mkstemp(prefix=f"{name}.", suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self._written(len(data))
+        return name
+
+    def new_temp_file(self, extension):
+        """Return (file object, path) for an artifact written incrementally, e.g. a ZIP"""
+        os.makedirs(self.root_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=f".{extension}.tmp", dir=self.root_dir)
+        return os.fdopen(fd, 'w+b'), temp_path
+
+    def put_file(self, temp_path, extension):
+        """Move a finished temp file into the store and return the artifact name"""
+        digest = hashlib.sha256()
+        with open(temp_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        name = f"{digest.hexdigest()[:32]}.{extension}"
+        path = self._path(name)
+        if self._touch(path):
+            os.remove(temp_path)
+            return name
+
+        metrics.CACHE_EVENTS.inc(cache='artifact', event='miss')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        self._written(size)
+        return name
+
+    def _written(self, size):
+        """Wake the collector early once a tenth of the quota has been written since the last run"""
+        self.start_gc()
+        with self._lock:
+            self._bytes_since_gc += size
+            if self._bytes_since_gc > self.max_bytes // 10:
+                self._wake.set()
+
+    def _touch(self, path):
+        """Mark an existing artifact as recently used; returns False if it does not exist"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        metrics.CACHE_EVENTS.inc(cache='artifact', event='hit')
+        return True
+
+    def gc(self):
+        """Remove expired artifacts, then evict least recently used ones until under quota
+
+        Pinned artifacts are never removed, and nothing is if the pins cannot be read.
+        """
+        if not os.path.isdir(self.root_dir):
+            return
+        with self._lock:
+            self._bytes_since_gc = 0
+        try:
+            pinned = set(self.pinned()) if self.pinned else set()
+        except Exception as e:
+            logger.warning("Skipping artifact GC, pinned artifacts unavailable: %s", e)
+            return
+        with self._gc_lock:
+            now = time.time()
+            entries = []
+            pinned_bytes = 0
+            for directory, _, names in os.walk(self.root_dir):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if name.endswith('.tmp'):
+                        if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                            self._remove(path)
+                        continue
+                    if name in pinned:
+                        pinned_bytes += stat.st_size
+                        continue
+                    if now - stat.st_mtime > self.max_age_seconds:
+                        self._remove(path)
+                        metrics.CACHE_EVENTS.inc(cache='artifact', event='expired')
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            total_bytes = pinned_bytes + sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                self._remove(path)
+                total_bytes -= size
+                metrics.CACHE_EVENTS.inc(cache='artifact', event='eviction')
+            metrics.ARTIFACT_BYTES.set(total_bytes)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def start_gc(self):
+        """Start the background collector if it is not running yet"""
+        if self._gc_thread is not None or not self.background_gc:
+            return
+        with self._lock:
+            if self._gc_thread is None:
+                self._gc_thread = threading.Thread(target=self._gc_loop, name='artifact-gc', daemon=True)
+                self._gc_thread.start()
+
+    def stop_gc(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _gc_loop(self):
+        while True:
+            try:
+                self.gc()
+            except OSError as e:
+                logger.warning("Artifact GC failed: %s", e)
+            self._wake.wait(self.gc_interval_seconds)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Batch label worker: renders items of queued batch jobs
+
+Usage: python batch_worker.py [--queue URL] [--threads N] [--worker-id NAME] [--exit-when-idle]
+
+Start as many workers as needed, on one host or several; each claims items
+from the shared job queue (JOB_QUEUE_URL), renders them and writes the
+result into the artifact store (ARTIFACT_DIR, shared storage when workers
+run on several machines).  Workers do not talk to each other, so batch
+throughput grows with the number of workers until WhiskyBase or the queue
+becomes the limit.  Progress is reported by the app at /api/jobs.
+
+Leases held by a worker are renewed by a heartbeat thread; SIGTERM lets the
+items in progress finish and then exits.  Items are fetched and rendered at
+bulk priority.  A worker process has no interactive work to leave room for,
+so bulk gets all of its fetch and render slots, one per thread unless
+MAX_BROWSER_SESSIONS or RENDER_SLOTS is set.  An item refused by an
+overloaded scheduler goes back on the queue without using up an attempt.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+import config
+import metrics
+import scheduler
+from artifact_store import ArtifactStore
+from job_queue import open_job_queue
+from label_generator import WhiskyLabelGenerator
+
+logger = logging.getLogger('whisky_label.worker')
+
+
+def configure_scheduler(threads):
+    """Give bulk work every fetch and render slot of this process, with room to queue every thread
+
+    Only for processes that run nothing but workers: the app's own scheduler
+    keeps its shares so batch jobs never crowd out interactive requests.
+    """
+    shares = dict(config.SCHEDULER_CLASS_SHARE, bulk=1.0)
+    max_queued = dict(config.SCHEDULER_MAX_QUEUED, bulk=max(threads, config.SCHEDULER_MAX_QUEUED['bulk']))
+    for resource in scheduler.SLOT_SETTINGS:
+        scheduler.configure(resource, scheduler.configured_slots(resource, threads), shares, max_queued)
+
+
+def render_job_item(generator, whisky_id, options):
+    """Render the label for one job item; returns (data, file extension)"""
+    whisky_info = generator.get_whisky_info(whisky_id)
+    if whisky_info.get('source') == 'fallback_data':
+        # Worth retrying later rather than storing a placeholder label
+        raise ValueError('WhiskyBase lookup failed')
+    output_format = options.get('format', 'png')
+    if options.get('printer_type') == 'ql820nwb':
+        layout = generator.layout_ql820nwb_label(
+            whisky_info, size_preset=options.get('ql820nwb_size', 'custom'), show_photo=options.get('show_photo', False))
+    else:
+        layout = generator.layout_label(
+            whisky_info, options.get('width_mm', 35), options.get('height_mm', 37), options.get('dpi', 72),
+            show_photo=options.get('show_photo', False))
+    return generator.render_layout(layout, output_format), output_format
+
+
+class BatchWorker:
+    def __init__(self, queue, artifacts, generator=None, worker_id=None, threads=None, lease_seconds=None,
+                 poll_seconds=None):
+        self.queue = queue
+        self.artifacts = artifacts
+        self.generator = generator or WhiskyLabelGenerator()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.threads = threads or int(os.getenv('JOB_WORKER_THREADS', config.JOB_WORKER_THREADS))
+        self.lease_seconds = lease_seconds or int(os.getenv('JOB_LEASE_SECONDS', config.JOB_LEASE_SECONDS))
+        self.poll_seconds = poll_seconds if poll_seconds is not None else config.JOB_POLL_SECONDS
+        self._leases = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Finish the items in progress, then return from run()"""
+        self._stop.set()
+
+    def process(self, lease):
+        """Render one leased item and record the outcome; returns the item's new state"""
+        started = time.perf_counter()
+        try:
+            data, extension = render_job_item(self.generator, lease.whisky_id, lease.options)
+            artifact = self.artifacts.put(data, extension)
+        except scheduler.Overloaded:
+            # Not the item's fault; run_once hands it back
+            raise
+        except Exception as e:
+            state = self.queue.fail(lease, str(e))
+            logger.warning("Job item %r failed (%s): %s", lease, state or 'lease lost', e)
+            metrics.JOB_ITEMS.inc(outcome='failed' if state == 'failed' else 'retried')
+            return state
+        finally:
+            metrics.JOB_ITEM_SECONDS.observe(time.perf_counter() - started)
+        if self.queue.complete(lease, artifact):
+            metrics.JOB_ITEMS.inc(outcome='done')
+        else:
+            # Another worker finished it after our lease expired; the artifact is the same
+            metrics.JOB_ITEMS.inc(outcome='duplicate')
+        return 'done'
+
+    def run_once(self):
+        """Claim and process one item; returns False if none was ready"""
+        lease = self.queue.claim(self.worker_id, self.lease_seconds)
+        if lease is None:
+            return False
+        with self._lock:
+            self._leases.add(lease)
+        backoff = 0
+        try:
+            self.process(lease)
+        except scheduler.Overloaded as e:
+            self.queue.release(lease, e.retry_after)
+            logger.info("Handed back %r: %s", lease, e)
+            metrics.JOB_ITEMS.inc(outcome='deferred')
+            backoff = e.retry_after
+        finally:
+            with self._lock:
+                self._leases.discard(lease)
+        if backoff:
+            self._stop.wait(backoff)
+        return True
+
+    def _heartbeat_loop(self, finished):
+        while not finished.wait(self.lease_seconds / 3):
+            with self._lock:
+                leases = list(self._leases)
+            for lease in leases:
+                try:
+                    if not self.queue.heartbeat(lease, self.lease_seconds):
+                        logger.warning("Lease on %r expired; another worker may render it too", lease)
+                except Exception as e:
+                    logger.warning("Heartbeat for %r failed: %s", lease, e)
+
+    def _work_loop(self, exit_when_idle):
+        # Batch jobs always yield to interactive and print work in the scheduler
+        scheduler.set_priority('bulk')
+        while not self._stop.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                # e.g. the queue server is briefly unreachable; leases make it safe to carry on later
+                logger.warning("Job queue error: %s", e)
+                claimed = False
+            if not claimed:
+                if exit_when_idle:
+                    return
+                self._stop.wait(self.poll_seconds)
+
+    def run(self, exit_when_idle=False):
+        """Process items with the configured number of threads until stopped (or idle)"""
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(finished,), name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        workers = [
+            threading.Thread(target=self._work_loop, args=(exit_when_idle,), name=f"job-worker-{index}")
+            for index in range(self.threads)
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        finished.set()
+        heartbeat.join()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render queued batch label jobs")
+    parser.add_argument('--queue', help="Job queue: SQLite path or redis:// URL (default: JOB_QUEUE_URL)")
+    parser.add_argument('--threads', type=int, help="Items processed concurrently (default: JOB_WORKER_THREADS)")
+    parser.add_argument('--worker-id', help="Name shown in job progress (default: host:pid)")
+    parser.add_argument('--exit-when-idle', action='store_true', help="Exit once no item is ready")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s %(levelname)s %(name)s %(message)s'
+    )
+    # The app's collector manages the shared artifact directory
+    worker = BatchWorker(open_job_queue(args.queue), ArtifactStore(background_gc=False),
+                         worker_id=args.worker_id, threads=args.threads)
+    configure_scheduler(worker.threads)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stop())
+    logger.info("Worker %s started with %d thread(s)", worker.worker_id, worker.threads)
+    worker.run(exit_when_idle=args.exit_when_idle)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the label render and fetch hot paths
+Usage: python benchmark.py [--iterations N] [--filter TEXT] [--save-baseline] [--threshold 0.25]
+
+Covers create_label and create_ql820nwb_label for every QL-820NWB size preset
+at 72 and 300 DPI, PNG/SVG/PDF rendering of one layout, QR generation, _parse_api_response on the recorded payloads
+in fixtures/, and the Flask endpoints with the upstream fetcher stubbed out.
+Each case reports its median wall time and peak traced memory.  When a
+baseline file exists the run fails (exit code 1) if any case regresses past
+the threshold.
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import config
+import label_render
+from app import WhiskyLabelGenerator, app, generator as app_generator
+from loadtest import isolate_app_stores
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+BENCHMARK_DPIS = (72, 300)
+
+
+def load_fixtures():
+    """Load the recorded WhiskyBase API payloads keyed by whisky ID"""
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, 'whisky_*.json'))):
+        whisky_id = int(os.path.basename(path)[len('whisky_'):-len('.json')])
+        with open(path) as f:
+            fixtures[whisky_id] = json.load(f)
+    return fixtures
+
+
+def build_cases(generator, fixtures):
+    """Return a list of (name, callable) benchmark cases"""
+    cases = []
+    whisky_id, payload = next(iter(fixtures.items()))
+    whisky_info = generator._parse_api_response(payload, whisky_id)
+
+    for preset, size in config.QL820NWB_SETTINGS['supported_sizes'].items():
+        for dpi in BENCHMARK_DPIS:
+            cases.append((
+                f"create_label[{preset}@{dpi}]",
+                lambda size=size, dpi=dpi: generator.create_label(
+                    whisky_info, "bench_label.png",
+                    width_mm=size['width_mm'], height_mm=size['height_mm'], dpi=dpi)
+            ))
+            cases.append((
+                f"create_ql820nwb_label[{preset}@{dpi}]",
+                lambda preset=preset, dpi=dpi: generator.create_ql820nwb_label(
+                    whisky_info, "bench_ql820nwb.png", size_preset=preset, dpi=dpi)
+            ))
+
+    layout = generator.layout_ql820nwb_label(whisky_info, size_preset='medium')
+    for output_format in label_render.OUTPUT_FORMATS:
+        cases.append((
+            f"render_layout[medium@300:{output_format}]",
+            lambda output_format=output_format: generator.render_layout(layout, output_format)
+        ))
+    for output_format in ('png',) + label_render.available_preview_formats():
+        cases.append((
+            f"render_layout[medium@300:{output_format} preview]",
+            lambda output_format=output_format: generator.render_layout(layout, output_format, 'preview')
+        ))
+
+    cases.append(("qr_matrix", lambda: generator._qr_matrix(whisky_info['url'])))
+    cases.append(("create_qr_code", lambda: generator.create_qr_code(whisky_info['url'])))
+    cases.append((
+        "create_qr_code_thermal",
+        lambda: generator.create_qr_code_thermal(whisky_info['url'], config.QL820NWB_SETTINGS['qr_settings'])
+    ))
+
+    for fixture_id, fixture_payload in fixtures.items():
+        cases.append((
+            f"parse_api_response[{fixture_id}]",
+            lambda fixture_id=fixture_id, fixture_payload=fixture_payload: generator._parse_api_response(fixture_payload, fixture_id)
+        ))
+
+    for query in ("macallan", "islay 10", "macalan sherry"):
+        cases.append((
+            f"search[{query}]",
+            lambda query=query: generator.search_index.search(query)
+        ))
+
+    client = app.test_client()
+    endpoints = [
+        ("GET", f"/api/whisky/{whisky_id}", None),
+        ("GET", f"/api/preview/{whisky_id}?dpi=72", None),
+        ("GET", "/api/search?q=macallan", None),
+        ("GET", f"/api/label/{whisky_id}?dpi=72", None),
+        ("GET", f"/api/label/{whisky_id}?dpi=300", None),
+        ("GET", f"/api/ql820nwb/{whisky_id}?size=medium", None),
+        ("GET", f"/api/ql820nwb/{whisky_id}?size=medium&format=svg", None),
+        ("GET", f"/api/ql820nwb/{whisky_id}?size=medium&format=pdf", None),
+        ("POST", "/api/custom-label", {'name': whisky_info['name'], 'distillery': whisky_info['distillery'], 'abv': whisky_info['abv'], 'id': whisky_id}),
+        ("POST", "/api/batch-labels", {'whisky_ids': list(fixtures.keys()), 'dpi': 72}),
+    ]
+    for method, path, body in endpoints:
+        cases.append((
+            f"endpoint[{method} {path}]",
+            lambda method=method, path=path, body=body: _call_endpoint(client, method, path, body)
+        ))
+
+    return cases
+
+
+def _call_endpoint(client, method, path, body):
+    response = client.open(path, method=method, json=body)
+    if response.status_code != 200:
+        raise RuntimeError(f"{method} {path} returned {response.status_code}")
+    response.get_data()
+    response.close()
+
+
+def stub_fetcher(fixtures):
+    """Replace network fetching with parsing of the recorded payloads"""
+    def get_whisky_info(self, whisky_id):
+        payload = fixtures.get(whisky_id)
+        if payload is None:
+            return self._get_fallback_data(whisky_id)
+        return self._parse_api_response(payload, whisky_id)
+    WhiskyLabelGenerator.get_whisky_info = get_whisky_info
+
+
+def measure(func, iterations):
+    """Return (median seconds, min seconds, peak bytes) for func"""
+    func()  # warm-up: font loading, imports, first-call caches
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return statistics.median(timings), min(timings), peak
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    """Return a list of human readable regression messages"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base['median_s'] > 0 and result['median_s'] > base['median_s'] * (1 + threshold):
+            regressions.append(
+                f"{name}: time {result['median_s'] * 1000:.2f}ms vs baseline {base['median_s'] * 1000:.2f}ms"
+            )
+        if base['peak_bytes'] > 0 and result['peak_bytes'] > base['peak_bytes'] * (1 + memory_threshold):
+            regressions.append(
+                f"{name}: peak memory {result['peak_bytes'] / 1024:.0f}KiB vs baseline {base['peak_bytes'] / 1024:.0f}KiB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark label rendering, QR generation, parsing and endpoints")
+    parser.add_argument('--iterations', type=int, default=10, help="timed iterations per case (default: 10)")
+    parser.add_argument('--filter', default='', help="only run cases whose name contains this text")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="write this run's results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed time regression ratio (default: 0.25)")
+    parser.add_argument('--memory-threshold', type=float, default=0.25, help="allowed peak memory regression ratio (default: 0.25)")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    if not fixtures:
+        print(f"Error: no fixtures found in {FIXTURES_DIR}")
+        sys.exit(1)
+
+    stub_fetcher(fixtures)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Renderers write their output to the working directory, and every store
+    # the app uses lives there for the run, so real caches neither skew nor absorb it
+    workdir = tempfile.mkdtemp(prefix='whisky_bench_')
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    isolate_app_stores(workdir)
+    results = {}
+    try:
+        cases = build_cases(app_generator, fixtures)
+        print(f"{'case':<58} {'median':>10} {'min':>10} {'peak mem':>10}")
+        print("-" * 91)
+        for name, func in cases:
+            if args.filter and args.filter not in name:
+                continue
+            median_s, min_s, peak = measure(func, args.iterations)
+            results[name] = {'median_s': median_s, 'min_s': min_s, 'peak_bytes': peak}
+            print(f"{name:<58} {median_s * 1000:>8.2f}ms {min_s * 1000:>8.2f}ms {peak / 1024:>7.0f}KiB")
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to: {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) past threshold:")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+    if baseline:
+        print("\n✅ No regressions against baseline")
+    else:
+        print("\nNo baseline found; run with --save-baseline to record one")
+
+
+if __name__ == "__main__":
+    main()
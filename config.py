@@ -31,6 +31,89 @@ TEXT_COLOR_TERTIARY = '#666666'  # Light gray for tertiary text
 WHISKYBASE_BASE_URL = "https://www.whiskybase.com"
 TIMEOUT_SECONDS = 20
 
+# Bottle photo cache
+PHOTO_CACHE_DIR = 'photo_cache'
+PHOTO_CACHE_MAX_BYTES = 200 * 1024 * 1024  # Evict least recently used photos past 200 MB
+PHOTO_CACHE_REFRESH_SECONDS = 7 * 24 * 3600  # Revalidate cached photos weekly
+
+# Local full-text search index of whiskies seen through the API
+SEARCH_INDEX_PATH = 'whisky_index.db'
+SEARCH_RESULT_LIMIT = 10
+
+# Parsed whisky metadata shared by all worker processes and CLI runs
+# (an SQLite path, or redis://host:port/db for a Redis-compatible server)
+METADATA_STORE_URL = 'whisky_metadata.db'
+METADATA_TTL_SECONDS = 12 * 3600  # Refetch metadata from WhiskyBase twice a day
+METADATA_STALE_SECONDS = 7 * 24 * 3600  # Expired records kept this long for OVERLOAD_MODE=stale
+
+# Image encoder settings (PIL save options) per use case.  Print output is
+# lossless PNG at the default compression; previews trade size for speed.
+# Lossless WebP is both smaller and faster than PNG for label line art,
+# so it is preferred over AVIF when the client accepts either.
+ENCODER_SETTINGS = {
+    'print': {
+        'png': {'compress_level': 6},
+    },
+    'preview': {
+        'png': {'compress_level': 1},
+        'webp': {'lossless': True, 'quality': 0, 'method': 0},
+        'avif': {'quality': 60, 'speed': 8},
+    },
+}
+# Server preference when negotiating a preview format from the Accept header
+PREVIEW_FORMAT_PREFERENCE = ('webp', 'avif', 'png')
+
+# Live preview of the manual-entry form: edits are rendered once the form has
+# been quiet this long, at most LIVE_PREVIEW_MAX_RENDERS at a time per process
+LIVE_PREVIEW_DEBOUNCE_MS = 150
+LIVE_PREVIEW_MAX_RENDERS = 2
+LIVE_PREVIEW_MAX_SESSIONS = 500
+LIVE_PREVIEW_IDLE_SECONDS = 300  # Sessions without edits or listeners are closed
+LIVE_PREVIEW_DPI = 96
+
+# Priority scheduling of upstream fetches and rendering (interactive > print > bulk).
+# Concurrent slots per process: every fetch may launch a headless browser, so
+# the fetch slots are the limit on browser sessions. A class may hold at most
+# its share of a resource's slots.
+MAX_BROWSER_SESSIONS = 4
+RENDER_SLOTS = 4
+SCHEDULER_CLASS_SHARE = {'interactive': 1.0, 'print': 0.75, 'bulk': 0.25}
+# A waiting class passed over this many times in a row is served next
+SCHEDULER_FAIR_SHARE_EVERY = 4
+# Admission control: work beyond these queue lengths, or waiting longer than
+# the timeout (None waits indefinitely), is refused with 503 and Retry-After
+SCHEDULER_MAX_QUEUED = {'interactive': 32, 'print': 32, 'bulk': 8}
+SCHEDULER_QUEUE_TIMEOUT_SECONDS = {'interactive': 10, 'print': 30, 'bulk': None}
+# When fetches are refused: 'stale' serves expired metadata from the metadata
+# store if it has any (cache-only degraded mode); 'reject' always answers 503
+OVERLOAD_MODE = 'stale'
+
+# Maximum size/DPI combinations rendered by one /variants request
+MAX_LABEL_VARIANTS = 16
+
+# Maximum rows accepted by the streaming custom label batch endpoint
+BATCH_MAX_ROWS = 10000
+
+# Distributed batch jobs (POST /api/jobs, rendered by batch_worker.py).  The
+# queue is an SQLite path for workers on one host, or redis://host:port/db for
+# workers on several machines; results go to ARTIFACT_DIR, which must then be
+# shared storage.
+JOB_QUEUE_URL = 'whisky_jobs.db'
+JOB_MAX_ITEMS = 100000
+JOB_LEASE_SECONDS = 60  # An item whose worker stops heartbeating is requeued after this
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY_SECONDS = 10  # Doubled after each failed attempt
+JOB_WORKER_THREADS = 4
+JOB_POLL_SECONDS = 1.0  # Idle workers check for new items this often
+JOB_RETENTION_SECONDS = 7 * 24 * 3600  # Jobs and their pinned artifacts are kept this long unless deleted
+
+# Content-addressed store for print-page labels and batch archives
+ARTIFACT_DIR = 'artifacts'
+ARTIFACT_MAX_BYTES = 500 * 1024 * 1024  # Evict least recently used artifacts past 500 MB
+ARTIFACT_MAX_AGE_SECONDS = 24 * 3600  # Remove artifacts unused for a day
+ARTIFACT_GC_INTERVAL_SECONDS = 300
+ARTIFACT_CACHE_MAX_AGE = 365 * 24 * 3600  # Artifact URLs are immutable
+
 # Label text
 LABEL_TITLE = "WHISKY LABEL"
 SCAN_TEXT = "Scan for details"
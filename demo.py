@@ -3,7 +3,7 @@
 Demo script showing how to use the WhiskyLabelGenerator programmatically
 """
 
-from app import WhiskyLabelGenerator
+from label_generator import WhiskyLabelGenerator
 import os
 
 def main():
@@ -25,24 +25,19 @@ def main():
         
         print(f"Name: {whisky_info['name']}")
         print(f"Distillery: {whisky_info['distillery']}")
-        print(f"Region: {whisky_info['region']}")
+        print(f"Region: {whisky_info.get('region', 'Unknown')}")
         if whisky_info['age']:
             print(f"Age: {whisky_info['age']}")
         if 'note' in whisky_info:
             print(f"Note: {whisky_info['note']}")
         
-        # Generate label
-        label_img = generator.create_label(whisky_info)
-        
-        # Save the label
-        filename = f"demo_whisky_{whisky_id}.png"
-        label_img.save(filename)
+        # Generate label (create_label writes the file and returns its name)
+        filename = generator.create_label(whisky_info, f"demo_whisky_{whisky_id}.png")
         print(f"Label saved as: {filename}")
         
         # Generate QR code separately
-        qr_img = generator.generate_qr_code(whisky_id, 200)
         qr_filename = f"qr_whisky_{whisky_id}.png"
-        qr_img.save(qr_filename)
+        generator.create_qr_code(whisky_info['url']).save(qr_filename)
         print(f"QR code saved as: {qr_filename}")
     
     print(f"\nDemo completed! Generated {len(test_ids)} labels and QR codes.")
@@ -1,57 +1,247 @@
 #!/usr/bin/env python3
 """
 Command-line whisky label generator
+
 Usage: python generate_label.py <whisky_id> [output_filename]
+       python generate_label.py [options] <whisky_id> [<whisky_id> ...]
+       python generate_label.py [options] --file ids.txt     (use - for stdin)
+
+Many IDs are fetched and rendered concurrently (--jobs). A label whose
+metadata and options are unchanged since the last run is skipped, so a
+nightly relabeling run only redoes what changed.
 """
 
-import sys
+import argparse
+import hashlib
+import json
 import os
-from app import WhiskyLabelGenerator
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import config
+import label_render
+from label_generator import WhiskyLabelGenerator
+
+MANIFEST_NAME = '.label_manifest.json'
+
+_worker_generator = None
+
+
+def read_ids(args):
+    """Collect whisky IDs from arguments, --file and piped stdin, in order, without duplicates"""
+    tokens = list(args.ids)
+    sources = [args.file] if args.file else []
+    if not tokens and not sources and not sys.stdin.isatty():
+        sources.append('-')
+    for source in sources:
+        stream = sys.stdin if source == '-' else open(source)
+        try:
+            for line in stream:
+                line = line.split('#', 1)[0]
+                tokens.extend(line.replace(',', ' ').split())
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    whisky_ids = []
+    for token in tokens:
+        try:
+            whisky_id = int(token)
+        except ValueError:
+            raise SystemExit(f"Error: Whisky ID must be a number, got {token!r}")
+        if whisky_id not in whisky_ids:
+            whisky_ids.append(whisky_id)
+    return whisky_ids
+
+
+def output_path(args, whisky_id):
+    if args.output_filename:
+        return args.output_filename
+    if args.printer == 'ql820nwb':
+        name = f"whisky_{whisky_id}_ql820nwb_{args.preset or 'custom'}.{args.format}"
+    else:
+        name = f"whisky_{whisky_id}_label.{args.format}"
+    return os.path.join(args.output_dir, name)
+
+
+def label_hash(whisky_info, options):
+    """Hash of everything that ends up on the label, used to skip unchanged outputs"""
+    content = json.dumps({'whisky': whisky_info, 'options': options}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def render_options(args):
+    return {
+        'printer': args.printer,
+        'preset': args.preset,
+        'dpi': args.dpi,
+        'format': args.format,
+        'photo': args.photo
+    }
+
+
+def _init_worker():
+    global _worker_generator
+    _worker_generator = WhiskyLabelGenerator()
+
+
+def process_id(whisky_id, filename, options, previous_hash, force=False, generator=None, refresh=False):
+    """Fetch one whisky and render its label unless it is already up to date
+
+    Metadata comes from the shared metadata store when it has a fresh record;
+    refresh=True always asks WhiskyBase.  Returns a result dict with status 'rendered', 'skipped' or 'failed'.
+    """
+    generator = generator or _worker_generator
+    result = {'whisky_id': whisky_id, 'filename': filename, 'fetch_s': 0.0, 'render_s': 0.0}
+
+    started = time.perf_counter()
+    if refresh:
+        whisky_info = generator.fetch_whisky_info(whisky_id)
+    else:
+        whisky_info = generator.get_whisky_info(whisky_id)
+    result['fetch_s'] = time.perf_counter() - started
+    result['name'] = whisky_info.get('name')
+    if whisky_info.get('source') == 'fallback_data':
+        # Never overwrite a good label with placeholder data
+        result.update(status='failed', error='WhiskyBase lookup failed')
+        return result
+
+    digest = label_hash(whisky_info, options)
+    result['hash'] = digest
+    if not force and digest == previous_hash and os.path.exists(filename):
+        result['status'] = 'skipped'
+        return result
 
-def main():
-    if len(sys.argv) < 2:
+    started = time.perf_counter()
+    try:
+        if options['printer'] == 'ql820nwb':
+            layout = generator.layout_ql820nwb_label(
+                whisky_info, size_preset=options['preset'] or 'custom', dpi=options['dpi'], show_photo=options['photo'])
+        else:
+            size = config.QL820NWB_SETTINGS['supported_sizes'].get(options['preset'] or '')
+            layout = generator.layout_label(
+                whisky_info,
+                width_mm=size['width_mm'] if size else 35,
+                height_mm=size['height_mm'] if size else 37,
+                dpi=options['dpi'] or 72,
+                show_photo=options['photo'])
+        generator.save_layout(layout, filename, options['format'])
+    except (OSError, ValueError) as e:
+        result.update(status='failed', error=str(e))
+        return result
+    result['render_s'] = time.perf_counter() - started
+    result['status'] = 'rendered'
+    return result
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def run(args, whisky_ids):
+    """Process every ID and return the list of result dicts"""
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    options = render_options(args)
+    jobs = [
+        (whisky_id, output_path(args, whisky_id))
+        for whisky_id in whisky_ids
+    ]
+
+    results = []
+
+    def record(result):
+        results.append(result)
+        if result.get('hash') and result['status'] != 'failed':
+            manifest[os.path.basename(result['filename'])] = result['hash']
+        detail = result.get('error') or result.get('name') or ''
+        print(f"[{len(results)}/{len(jobs)}] {result['whisky_id']}: {result['status']} {detail}".rstrip())
+
+    if args.jobs <= 1 or len(jobs) == 1:
+        generator = WhiskyLabelGenerator()
+        for whisky_id, filename in jobs:
+            record(process_id(whisky_id, filename, options,
+                              manifest.get(os.path.basename(filename)), args.force, generator, args.refresh))
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker) as executor:
+            futures = [
+                executor.submit(process_id, whisky_id, filename, options,
+                                manifest.get(os.path.basename(filename)), args.force, None, args.refresh)
+                for whisky_id, filename in jobs
+            ]
+            for future in as_completed(futures):
+                record(future.result())
+
+    save_manifest(manifest_path, manifest)
+    return results
+
+
+def print_summary(results, elapsed):
+    counts = {status: sum(1 for result in results if result['status'] == status)
+              for status in ('rendered', 'skipped', 'failed')}
+    fetch_s = sum(result['fetch_s'] for result in results)
+    render_s = sum(result['render_s'] for result in results)
+    rate = len(results) / elapsed if elapsed > 0 else 0.0
+    print()
+    print(f"{len(results)} ID(s) in {elapsed:.1f}s ({rate:.2f} labels/s): "
+          f"{counts['rendered']} rendered, {counts['skipped']} up to date, {counts['failed']} failed")
+    print(f"Time spent fetching {fetch_s:.1f}s, rendering {render_s:.1f}s (summed across jobs)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate whisky labels for one or more Whiskybase IDs")
+    parser.add_argument('ids', nargs='*', help="Whisky IDs (a single ID may be followed by an output filename)")
+    parser.add_argument('-f', '--file', help="Read IDs from a file, one or more per line (- for stdin)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="Number of IDs fetched and rendered concurrently (default: CPU count)")
+    parser.add_argument('--printer', choices=('standard', 'ql820nwb'), default='standard')
+    parser.add_argument('--preset', choices=sorted(config.QL820NWB_SETTINGS['supported_sizes']),
+                        help="Label size preset (default: 35x37mm, or 'custom' for the QL-820NWB)")
+    parser.add_argument('--dpi', type=int, help="Resolution (default: 72, or 300 for the QL-820NWB)")
+    parser.add_argument('--format', choices=label_render.OUTPUT_FORMATS, default='png')
+    parser.add_argument('--photo', action='store_true', help="Place the bottle photo beside the QR code")
+    parser.add_argument('-o', '--output-dir', default='.', help="Directory for generated labels")
+    parser.add_argument('--force', action='store_true', help="Render even if the label is up to date")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Fetch metadata from WhiskyBase even if the shared metadata store has it")
+    args = parser.parse_args(argv)
+
+    # Keep the original "generate_label.py <id> <output_filename>" form working
+    args.output_filename = None
+    if len(args.ids) == 2 and not args.ids[1].isdigit():
+        args.output_filename = args.ids.pop()
+        args.output_dir = os.path.dirname(args.output_filename) or args.output_dir
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    whisky_ids = read_ids(args)
+    if not whisky_ids:
         print("Usage: python generate_label.py <whisky_id> [output_filename]")
         print("Example: python generate_label.py 12345 my_whisky_label.png")
+        print("         python generate_label.py --jobs 8 --printer ql820nwb --preset medium --file ids.txt")
         sys.exit(1)
-    
-    try:
-        whisky_id = int(sys.argv[1])
-    except ValueError:
-        print("Error: Whisky ID must be a number")
-        sys.exit(1)
-    
-    # Set output filename
-    if len(sys.argv) > 2:
-        output_filename = sys.argv[2]
-    else:
-        output_filename = f"whisky_{whisky_id}_label.png"
-    
-    # Initialize the label generator
-    generator = WhiskyLabelGenerator()
-    
-    print(f"Fetching whisky data for ID: {whisky_id}")
-    
-    # Get whisky information
-    whisky_info = generator.get_whisky_info(whisky_id)
-    
-    if 'error' in whisky_info:
-        print(f"Error fetching whisky data: {whisky_info['error']}")
+
+    started = time.perf_counter()
+    results = run(args, whisky_ids)
+    print_summary(results, time.perf_counter() - started)
+    if any(result['status'] == 'failed' for result in results):
         sys.exit(1)
-    
-    print(f"Whisky: {whisky_info['name']}")
-    print(f"Distillery: {whisky_info['distillery']}")
-    print(f"Region: {whisky_info['region']}")
-    if whisky_info['age']:
-        print(f"Age: {whisky_info['age']}")
-    
-    # Generate the label
-    print("Generating label...")
-    label_img = generator.create_label(whisky_info)
-    
-    # Save the label
-    label_img.save(output_filename)
-    print(f"Label saved as: {output_filename}")
-    print(f"QR code links to: {whisky_info['url']}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,621 @@
+"""
+Shared queue of batch label jobs for distributed workers
+
+A job is a list of whisky IDs with the label options to render them with.
+Workers (batch_worker.py), on this host or others, claim one item at a time
+under a lease, extend it with heartbeats while they render, and record the
+content-addressed artifact name of the result.  A lease that is not renewed
+expires and its item goes back on the queue, so a worker that crashes or
+loses its network only delays its items.  Failed items are retried with
+exponential backoff up to JOB_MAX_ATTEMPTS.
+
+Delivery is at least once: an item whose lease expired while its worker was
+still busy may be rendered twice.  That is harmless because results are
+written to the content-addressed artifact store, so both workers produce the
+same artifact name, and an item is only ever marked done once.
+
+The default backend is an SQLite database in WAL mode, for workers on one
+host.  Set JOB_QUEUE_URL to redis://host:port/db to use a Redis-compatible
+server, which workers on several machines can share.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import config
+
+logger = logging.getLogger('whisky_label.jobs')
+
+STATES = ('pending', 'leased', 'done', 'failed')
+
+
+def retry_delay(attempts, base_seconds=None):
+    """Seconds to wait before retrying an item that has failed attempts times"""
+    if base_seconds is None:
+        base_seconds = float(os.getenv('JOB_RETRY_DELAY_SECONDS', config.JOB_RETRY_DELAY_SECONDS))
+    return min(base_seconds * 2 ** (attempts - 1), 3600)
+
+
+def new_job_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Lease:
+    """One item claimed by a worker; token identifies this particular claim"""
+
+    def __init__(self, job_id, position, whisky_id, options, token, attempts):
+        self.job_id = job_id
+        self.position = position
+        self.whisky_id = whisky_id
+        self.options = options
+        self.token = token
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"Lease({self.job_id}:{self.position} whisky_id={self.whisky_id} attempt={self.attempts})"
+
+
+def _summary(job_id, options, created_at, total, counts):
+    """Progress of one job from its per-state item counts"""
+    counts = {state: int(counts.get(state) or 0) for state in STATES}
+    total = int(total)
+    finished = counts['done'] + counts['failed']
+    return {
+        'job_id': job_id,
+        'options': options,
+        'created_at': created_at,
+        'total': total,
+        **counts,
+        'progress': finished / total if total else 1.0,
+        'finished': finished == total,
+    }
+
+
+class SqliteJobQueue:
+    """Job queue in an SQLite database shared through WAL mode"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        options TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        total INTEGER NOT NULL,
+        pending INTEGER NOT NULL,
+        leased INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS job_items (
+        job_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        whisky_id INTEGER NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL,
+        worker TEXT,
+        lease_token TEXT,
+        lease_expires REAL,
+        artifact TEXT,
+        error TEXT,
+        PRIMARY KEY (job_id, position)
+    );
+    CREATE INDEX IF NOT EXISTS job_items_ready ON job_items (state, available_at);
+    -- Per-job counts kept up to date with every item update, so progress never scans the items
+    CREATE TRIGGER IF NOT EXISTS job_items_count AFTER UPDATE OF state ON job_items
+    WHEN OLD.state != NEW.state
+    BEGIN
+        UPDATE jobs SET
+            pending = pending + (NEW.state = 'pending') - (OLD.state = 'pending'),
+            leased = leased + (NEW.state = 'leased') - (OLD.state = 'leased'),
+            done = done + (NEW.state = 'done') - (OLD.state = 'done'),
+            failed = failed + (NEW.state = 'failed') - (OLD.state = 'failed')
+        WHERE id = NEW.job_id;
+    END;
+    """
+
+    def __init__(self, db_path, max_attempts=None):
+        self.db_path = db_path
+        self.max_attempts = max_attempts or int(os.getenv('JOB_MAX_ATTEMPTS', config.JOB_MAX_ATTEMPTS))
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(self.SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self):
+        """BEGIN IMMEDIATE, so claims from several processes never hand out the same item"""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def create_job(self, whisky_ids, options, job_id=None):
+        """Queue a job and return its ID; resubmitting an existing job_id leaves it unchanged"""
+        job_id = job_id or new_job_id()
+        whisky_ids = [int(whisky_id) for whisky_id in whisky_ids]
+        now = time.time()
+        connection = self._transaction()
+        try:
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO jobs (id, options, created_at, total, pending) VALUES (?, ?, ?, ?, ?)',
+                (job_id, json.dumps(options, sort_keys=True), now, len(whisky_ids), len(whisky_ids))
+            )
+            if cursor.rowcount:
+                connection.executemany(
+                    'INSERT INTO job_items (job_id, position, whisky_id, available_at) VALUES (?, ?, ?, ?)',
+                    [(job_id, position, whisky_id, now) for position, whisky_id in enumerate(whisky_ids)]
+                )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return job_id
+
+    def claim(self, worker, lease_seconds):
+        """Lease the next available item to worker; returns a Lease or None if nothing is ready"""
+        now = time.time()
+        token = uuid.uuid4().hex
+        connection = self._transaction()
+        try:
+            self._expire_leases(connection, now)
+            row = connection.execute(
+                """
+                SELECT job_items.job_id, position, whisky_id, attempts, options
+                FROM job_items JOIN jobs ON jobs.id = job_items.job_id
+                WHERE state = 'pending' AND available_at <= ?
+                ORDER BY available_at LIMIT 1
+                """,
+                (now,)
+            ).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            job_id, position, whisky_id, attempts, options = row
+            connection.execute(
+                """
+                UPDATE job_items SET state = 'leased', attempts = attempts + 1, worker = ?,
+                    lease_token = ?, lease_expires = ?
+                WHERE job_id = ? AND position = ?
+                """,
+                (worker, token, now + lease_seconds, job_id, position)
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return Lease(job_id, position, whisky_id, json.loads(options), token, attempts + 1)
+
+    def _expire_leases(self, connection, now):
+        cursor = connection.execute(
+            """
+            UPDATE job_items SET
+                state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                error = 'Lease expired', worker = NULL, lease_token = NULL, available_at = ?
+            WHERE state = 'leased' AND lease_expires < ?
+            """,
+            (self.max_attempts, now, now)
+        )
+        if cursor.rowcount:
+            logger.warning("Requeued %d item(s) whose worker stopped renewing its lease", cursor.rowcount)
+
+    def heartbeat(self, lease, lease_seconds):
+        """Extend a lease; returns False if it has expired and the item was handed to someone else"""
+        cursor = self._connection().execute(
+            "UPDATE job_items SET lease_expires = ? WHERE job_id = ? AND position = ? AND lease_token = ? AND state = 'leased'",
+            (time.time() + lease_seconds, lease.job_id, lease.position, lease.token)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, lease, artifact):
+        """Record the result of an item; returns False if it was already finished"""
+        cursor = self._connection().execute(
+            """
+            UPDATE job_items SET state = 'done', artifact = ?, error = NULL, lease_token = NULL
+            WHERE job_id = ? AND position = ? AND state IN ('pending', 'leased')
+            """,
+            (artifact, lease.job_id, lease.position)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, lease, error, retry_base_seconds=None):
+        """Give up this attempt; the item is retried later or, after max_attempts, marked failed
+
+        Returns the item's new state.
+        """
+        state = 'failed' if lease.attempts >= self.max_attempts else 'pending'
+        cursor = self._connection().execute(
+            """
+            UPDATE job_items SET state = ?, error = ?, worker = NULL, lease_token = NULL, available_at = ?
+            WHERE job_id = ? AND position = ? AND lease_token = ? AND state = 'leased'
+            """,
+            (state, error, time.time() + retry_delay(lease.attempts, retry_base_seconds),
+             lease.job_id, lease.position, lease.token)
+        )
+        return state if cursor.rowcount else None
+
+    def release(self, lease, delay_seconds):
+        """Hand an item back untried, without using up an attempt, e.g. when this host is overloaded
+
+        Returns False if the lease had already expired.
+        """
+        cursor = self._connection().execute(
+            """
+            UPDATE job_items SET state = 'pending', attempts = attempts - 1, worker = NULL, lease_token = NULL,
+                available_at = ?
+            WHERE job_id = ? AND position = ? AND lease_token = ? AND state = 'leased'
+            """,
+            (time.time() + delay_seconds, lease.job_id, lease.position, lease.token)
+        )
+        return cursor.rowcount == 1
+
+    def items(self, job_id):
+        rows = self._connection().execute(
+            """
+            SELECT position, whisky_id, state, attempts, worker, artifact, error
+            FROM job_items WHERE job_id = ? ORDER BY position
+            """,
+            (job_id,)
+        ).fetchall()
+        return [
+            {'position': position, 'whisky_id': whisky_id, 'state': state, 'attempts': attempts,
+             'worker': worker, 'artifact': artifact, 'error': error}
+            for position, whisky_id, state, attempts, worker, artifact, error in rows
+        ]
+
+    JOB_COLUMNS = 'id, options, created_at, total, pending, leased, done, failed'
+
+    @staticmethod
+    def _job_summary(row):
+        job_id, options, created_at, total, *counts = row
+        return _summary(job_id, json.loads(options), created_at, total, dict(zip(STATES, counts)))
+
+    def progress(self, job_id):
+        """Counts per state for one job, or None if there is no such job"""
+        row = self._connection().execute(f'SELECT {self.JOB_COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job_summary(row) if row is not None else None
+
+    def jobs(self):
+        """Progress of every job, oldest first"""
+        rows = self._connection().execute(f'SELECT {self.JOB_COLUMNS} FROM jobs ORDER BY created_at')
+        return [self._job_summary(row) for row in rows]
+
+    def workers(self):
+        """Workers currently holding a lease"""
+        rows = self._connection().execute("SELECT DISTINCT worker FROM job_items WHERE state = 'leased'")
+        return sorted(worker for worker, in rows if worker)
+
+    def artifacts(self):
+        """Names of all artifacts that jobs have produced"""
+        rows = self._connection().execute('SELECT DISTINCT artifact FROM job_items WHERE artifact IS NOT NULL')
+        return {artifact for artifact, in rows}
+
+    def delete_job(self, job_id):
+        """Forget a job and its items; returns False if there was no such job"""
+        connection = self._transaction()
+        try:
+            connection.execute('DELETE FROM job_items WHERE job_id = ?', (job_id,))
+            deleted = connection.execute('DELETE FROM jobs WHERE id = ?', (job_id,)).rowcount
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return deleted == 1
+
+    def purge_expired(self, retention_seconds):
+        """Delete jobs created more than retention_seconds ago; returns how many"""
+        rows = self._connection().execute(
+            'SELECT id FROM jobs WHERE created_at < ?', (time.time() - retention_seconds,)
+        ).fetchall()
+        return sum(self.delete_job(job_id) for job_id, in rows)
+
+
+class RedisJobQueue:
+    """Job queue in a Redis-compatible server, for workers on several machines
+
+    Each item is a key holding its state as JSON, and every state change
+    (claim, heartbeat, completion, failure, requeue) is one WATCH/MULTI
+    transaction on that key, so two workers racing on the same item can never
+    both win: the loser's transaction is retried against the new state.
+    Ready items are "<job>:<position>" entries in a list; leased items are
+    indexed by lease expiry and retries by due time in sorted sets.  A job is
+    a hash with its options and per-state counts, updated in the same
+    transactions, and a set of the artifacts its items produced.
+    """
+
+    def __init__(self, url=None, client=None, prefix='whisky:jobs', max_attempts=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("JOB_QUEUE_URL uses redis:// but the redis package is not installed")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.max_attempts = max_attempts or int(os.getenv('JOB_MAX_ATTEMPTS', config.JOB_MAX_ATTEMPTS))
+        self.jobs_key = f"{prefix}:jobs"
+        self.ready_key = f"{prefix}:ready"
+        self.leases_key = f"{prefix}:leases"
+        self.delayed_key = f"{prefix}:delayed"
+
+    def _job_key(self, job_id):
+        return f"{self.prefix}:job:{job_id}"
+
+    def _item_key(self, member):
+        return f"{self.prefix}:item:{member}"
+
+    def _artifacts_key(self, job_id):
+        return f"{self.prefix}:artifacts:{job_id}"
+
+    def _count(self, pipe, member, old_state, new_state):
+        job_key = self._job_key(member.rsplit(':', 1)[0])
+        pipe.hincrby(job_key, old_state, -1)
+        pipe.hincrby(job_key, new_state, 1)
+
+    def _transaction(self, func, *keys):
+        """Run func(pipe) with keys watched, retrying whenever a watched key changed before EXEC"""
+        return self.client.transaction(func, *keys, value_from_callable=True)
+
+    @staticmethod
+    def _load(pipe, key):
+        data = pipe.get(key)
+        return json.loads(data) if data is not None else None
+
+    def create_job(self, whisky_ids, options, job_id=None):
+        job_id = job_id or new_job_id()
+        whisky_ids = [int(whisky_id) for whisky_id in whisky_ids]
+        now = time.time()
+
+        def create(pipe):
+            if pipe.exists(self._job_key(job_id)):
+                return
+            members = [f"{job_id}:{position}" for position in range(len(whisky_ids))]
+            pipe.multi()
+            pipe.hset(self._job_key(job_id), mapping={
+                'options': json.dumps(options, sort_keys=True), 'created_at': now, 'total': len(whisky_ids),
+                'pending': len(whisky_ids), 'leased': 0, 'done': 0, 'failed': 0})
+            if members:
+                pipe.mset({
+                    self._item_key(member): json.dumps({'whisky_id': whisky_id, 'state': 'pending', 'attempts': 0})
+                    for member, whisky_id in zip(members, whisky_ids)
+                })
+                # Pushed on the left and claimed from the right, so items run in order
+                pipe.lpush(self.ready_key, *members)
+            pipe.zadd(self.jobs_key, {job_id: now})
+
+        self._transaction(create, self._job_key(job_id))
+        return job_id
+
+    def claim(self, worker, lease_seconds):
+        self._requeue_expired()
+        self._promote_delayed()
+        token = uuid.uuid4().hex
+        while True:
+            oldest = self.client.lrange(self.ready_key, -1, -1)
+            if not oldest:
+                return None
+            member = _text(oldest[0])
+            lease = self._transaction(lambda pipe: self._take(pipe, member, worker, token, lease_seconds),
+                                      self._item_key(member))
+            if lease is not None:
+                return lease
+
+    def _take(self, pipe, member, worker, token, lease_seconds):
+        """Move member from the ready list to a lease in one transaction; None if someone else took it"""
+        item = self._load(pipe, self._item_key(member))
+        job_id, position = member.rsplit(':', 1)
+        options = pipe.hget(self._job_key(job_id), 'options')
+        pipe.multi()
+        # Removing from the tail end finds the oldest entries at once
+        pipe.lrem(self.ready_key, -1, member)
+        if item is None or options is None or item['state'] != 'pending' or item.get('retry_at'):
+            # Left over from a deleted job, or already claimed by a faster worker
+            return None
+        now = time.time()
+        item.update(state='leased', attempts=item['attempts'] + 1, worker=worker, token=token,
+                    lease_expires=now + lease_seconds)
+        pipe.set(self._item_key(member), json.dumps(item))
+        pipe.zadd(self.leases_key, {member: item['lease_expires']})
+        self._count(pipe, member, 'pending', 'leased')
+        return Lease(job_id, int(position), item['whisky_id'], json.loads(options), token, item['attempts'])
+
+    def _requeue_expired(self):
+        now = time.time()
+        for member in self.client.zrangebyscore(self.leases_key, 0, now):
+            member = _text(member)
+            self._transaction(lambda pipe: self._expire(pipe, member, now), self._item_key(member))
+
+    def _expire(self, pipe, member, now):
+        item = self._load(pipe, self._item_key(member))
+        if item is not None and item['state'] == 'leased' and item['lease_expires'] > now:
+            return  # Renewed by a heartbeat since the index was read
+        pipe.multi()
+        pipe.zrem(self.leases_key, member)
+        if item is None or item['state'] != 'leased':
+            return
+        logger.warning("Requeued %s whose worker stopped renewing its lease", member)
+        state = 'failed' if item['attempts'] >= self.max_attempts else 'pending'
+        item.update(state=state, error='Lease expired', worker=None, token=None, lease_expires=None)
+        pipe.set(self._item_key(member), json.dumps(item))
+        self._count(pipe, member, 'leased', state)
+        if state == 'pending':
+            pipe.lpush(self.ready_key, member)
+
+    def _promote_delayed(self):
+        now = time.time()
+        for member in self.client.zrangebyscore(self.delayed_key, 0, now):
+            member = _text(member)
+            self._transaction(lambda pipe: self._promote(pipe, member, now), self._item_key(member))
+
+    def _promote(self, pipe, member, now):
+        item = self._load(pipe, self._item_key(member))
+        pipe.multi()
+        pipe.zrem(self.delayed_key, member)
+        if item is None or item['state'] != 'pending' or not item.get('retry_at') or item['retry_at'] > now:
+            return
+        # Clearing retry_at changes the watched item, so a concurrent promoter cannot push it twice
+        item['retry_at'] = None
+        pipe.set(self._item_key(member), json.dumps(item))
+        pipe.rpush(self.ready_key, member)
+
+    def heartbeat(self, lease, lease_seconds):
+        member = f"{lease.job_id}:{lease.position}"
+
+        def renew(pipe):
+            item = self._load(pipe, self._item_key(member))
+            if item is None or item['state'] != 'leased' or item.get('token') != lease.token:
+                return False
+            item['lease_expires'] = time.time() + lease_seconds
+            pipe.multi()
+            pipe.set(self._item_key(member), json.dumps(item))
+            pipe.zadd(self.leases_key, {member: item['lease_expires']})
+            return True
+
+        return self._transaction(renew, self._item_key(member))
+
+    def complete(self, lease, artifact):
+        member = f"{lease.job_id}:{lease.position}"
+
+        def finish(pipe):
+            item = self._load(pipe, self._item_key(member))
+            if item is None or item['state'] in ('done', 'failed'):
+                return False
+            # Accepted from a worker whose lease expired too: the result is the same
+            old_state = item['state']
+            item.update(state='done', artifact=artifact, error=None, token=None, lease_expires=None, retry_at=None)
+            pipe.multi()
+            pipe.set(self._item_key(member), json.dumps(item))
+            pipe.zrem(self.leases_key, member)
+            pipe.zrem(self.delayed_key, member)
+            pipe.sadd(self._artifacts_key(lease.job_id), artifact)
+            self._count(pipe, member, old_state, 'done')
+            return True
+
+        return self._transaction(finish, self._item_key(member))
+
+    def fail(self, lease, error, retry_base_seconds=None):
+        member = f"{lease.job_id}:{lease.position}"
+
+        def give_up(pipe):
+            item = self._load(pipe, self._item_key(member))
+            if item is None or item['state'] != 'leased' or item.get('token') != lease.token:
+                return None
+            state = 'failed' if lease.attempts >= self.max_attempts else 'pending'
+            retry_at = time.time() + retry_delay(lease.attempts, retry_base_seconds) if state == 'pending' else None
+            item.update(state=state, error=error, worker=None, token=None, lease_expires=None, retry_at=retry_at)
+            pipe.multi()
+            pipe.set(self._item_key(member), json.dumps(item))
+            pipe.zrem(self.leases_key, member)
+            self._count(pipe, member, 'leased', state)
+            if retry_at is not None:
+                pipe.zadd(self.delayed_key, {member: retry_at})
+            return state
+
+        return self._transaction(give_up, self._item_key(member))
+
+    def release(self, lease, delay_seconds):
+        member = f"{lease.job_id}:{lease.position}"
+
+        def hand_back(pipe):
+            item = self._load(pipe, self._item_key(member))
+            if item is None or item['state'] != 'leased' or item.get('token') != lease.token:
+                return False
+            retry_at = time.time() + delay_seconds
+            item.update(state='pending', attempts=item['attempts'] - 1, worker=None, token=None,
+                        lease_expires=None, retry_at=retry_at)
+            pipe.multi()
+            pipe.set(self._item_key(member), json.dumps(item))
+            pipe.zrem(self.leases_key, member)
+            pipe.zadd(self.delayed_key, {member: retry_at})
+            self._count(pipe, member, 'leased', 'pending')
+            return True
+
+        return self._transaction(hand_back, self._item_key(member))
+
+    def items(self, job_id):
+        total = int(self.client.hget(self._job_key(job_id), 'total') or 0)
+        items = []
+        for start in range(0, total, 1000):
+            positions = range(start, min(start + 1000, total))
+            values = self.client.mget([self._item_key(f"{job_id}:{position}") for position in positions])
+            for position, data in zip(positions, values):
+                if data is None:
+                    continue
+                item = json.loads(data)
+                items.append({
+                    'position': position, 'whisky_id': item['whisky_id'], 'state': item['state'],
+                    'attempts': item['attempts'], 'worker': item.get('worker'),
+                    'artifact': item.get('artifact'), 'error': item.get('error'),
+                })
+        return items
+
+    @staticmethod
+    def _job_summary(job_id, job):
+        job = {_text(key): _text(value) for key, value in job.items()}
+        if 'options' not in job:
+            return None
+        return _summary(job_id, json.loads(job['options']), float(job['created_at']), job['total'], job)
+
+    def progress(self, job_id):
+        return self._job_summary(job_id, self.client.hgetall(self._job_key(job_id)))
+
+    def jobs(self):
+        job_ids = [_text(job_id) for job_id in self.client.zrange(self.jobs_key, 0, -1)]
+        pipe = self.client.pipeline()
+        for job_id in job_ids:
+            pipe.hgetall(self._job_key(job_id))
+        jobs = [self._job_summary(job_id, job) for job_id, job in zip(job_ids, pipe.execute())]
+        return [job for job in jobs if job is not None]
+
+    def workers(self):
+        members = [_text(member) for member in self.client.zrangebyscore(self.leases_key, time.time(), float('inf'))]
+        items = [json.loads(data) for data in self.client.mget([self._item_key(member) for member in members])
+                 if data is not None] if members else []
+        return sorted({item['worker'] for item in items if item['state'] == 'leased' and item.get('worker')})
+
+    def artifacts(self):
+        keys = [self._artifacts_key(_text(job_id)) for job_id in self.client.zrange(self.jobs_key, 0, -1)]
+        return {_text(artifact) for artifact in self.client.sunion(keys)} if keys else set()
+
+    def delete_job(self, job_id):
+        """Forget a job and its items; entries left in the ready list and indexes are dropped when reached"""
+        total = self.client.hget(self._job_key(job_id), 'total')
+        if total is None:
+            return False
+        # Items first: deleting one aborts any transition in flight on it, so
+        # none can update the job's counts after the job itself is gone
+        for start in range(0, int(total), 1000):
+            self.client.delete(*[self._item_key(f"{job_id}:{position}")
+                                 for position in range(start, min(start + 1000, int(total)))])
+        self.client.delete(self._job_key(job_id), self._artifacts_key(job_id))
+        self.client.zrem(self.jobs_key, job_id)
+        return True
+
+    def purge_expired(self, retention_seconds):
+        expired = self.client.zrangebyscore(self.jobs_key, 0, time.time() - retention_seconds)
+        return sum(self.delete_job(_text(job_id)) for job_id in expired)
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def open_job_queue(url=None):
+    """Open the queue named by url or JOB_QUEUE_URL (a SQLite path or redis:// URL)"""
+    url = url or os.getenv('JOB_QUEUE_URL', config.JOB_QUEUE_URL)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisJobQueue(url)
+    if url.startswith('sqlite:///'):
+        url = url[len('sqlite:///'):]
+    return SqliteJobQueue(url)
@@ -0,0 +1,769 @@
+"""
+Whisky label generation core: fetching, parsing and laying out labels
+
+WhiskyLabelGenerator fetches whisky data from the WhiskyBase API, parses it
+and lays out and renders labels.  It has no web framework dependency, so the
+CLI, tools and batch workers import it directly.  Heavy dependencies
+(Playwright, qrcode, python-dotenv, requests) are imported on first use, so
+importing this module stays fast for short-lived processes.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+import label_render
+import scheduler
+from label_render import LabelLayout
+from metadata_store import open_metadata_store
+from photo_cache import PhotoCache
+from whisky_index import WhiskyIndex
+
+logger = logging.getLogger('whisky_label')
+
+_environment_loaded = False
+
+
+def load_environment():
+    """Load api_config.env into the environment once, if it exists"""
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv('api_config.env')
+        _environment_loaded = True
+
+
+class WhiskyLabelGenerator:
+    def __init__(self):
+        load_environment()
+        self.base_url = "https://www.whiskybase.com"
+        self.photo_cache = PhotoCache()
+        self.search_index = WhiskyIndex()
+        self.metadata_store = open_metadata_store()
+        self.metadata_ttl_seconds = int(os.getenv('METADATA_TTL_SECONDS', config.METADATA_TTL_SECONDS))
+        
+    async def get_whisky_info_playwright(self, whisky_id):
+        """Fetch whisky information using Playwright to call WhiskyBase API endpoint"""
+        from playwright.async_api import async_playwright
+
+        async with async_playwright() as p:
+            # Launch browser with realistic settings
+            with metrics.stage('browser_launch'):
+                browser = await p.chromium.launch(
+                    headless=True,
+                    args=[
+                        '--no-sandbox',
+                        '--disable-setuid-sandbox',
+                        '--disable-dev-shm-usage',
+                        '--disable-accelerated-2d-canvas',
+                        '--no-first-run',
+                        '--no-zygote',
+                        '--disable-gpu',
+                        '--disable-web-security',
+                        '--disable-features=VizDisplayCompositor'
+                    ]
+                )
+                metrics.BROWSER_SESSIONS.inc()
+                
+                # Create context with realistic user agent and viewport
+                context = await browser.new_context(
+                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                    viewport={'width': 1920, 'height': 1080},
+                    locale='en-US',
+                    timezone_id='America/New_York',
+                    extra_http_headers={
+                        'Accept': 'application/json, text/plain, */*',
+                        'Accept-Language': 'en-US,en;q=0.9',
+                        'Accept-Encoding': 'gzip, deflate, br',
+                        'Connection': 'keep-alive',
+                        'Sec-Fetch-Dest': 'empty',
+                        'Sec-Fetch-Mode': 'cors',
+                        'Sec-Fetch-Site': 'same-origin',
+                        'Cache-Control': 'no-cache',
+                        'Pragma': 'no-cache',
+                        'DNT': '1',
+                        'X-Requested-With': 'XMLHttpRequest'
+                    }
+                )
+                
+                page = await context.new_page()
+            
+            try:
+                # First, visit the main site to establish a session and get cookies
+                logger.debug("Establishing session with WhiskyBase")
+                base_url = os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')
+                with metrics.stage('session_warmup'):
+                    try:
+                        await page.goto(f'{base_url}/', wait_until='domcontentloaded', timeout=10000)
+                        await page.wait_for_timeout(2000)  # Wait 2 seconds
+                        logger.debug("Homepage visited successfully")
+                    except Exception as e:
+                        logger.warning("Homepage visit failed, continuing: %s", e)
+                
+                # Build API URL with relations
+                api_base_url = os.getenv('WHISKYBASE_API_BASE_URL')
+                api_url = f"{api_base_url}/whisky/{whisky_id}?relation[]=brand&relation[]=userrating&relation[]=bottler"
+                logger.info("API request whisky_id=%s url=%s", whisky_id, api_url)
+                
+                # Make the API request
+                timeout_seconds = int(os.getenv('TIMEOUT_SECONDS', 15))
+                with metrics.stage('api_call'):
+                    response = await page.goto(api_url, wait_until='domcontentloaded', timeout=timeout_seconds * 1000)
+                metrics.UPSTREAM_RESPONSES.inc(status=response.status)
+                logger.info("API response whisky_id=%s status=%s", whisky_id, response.status)
+                
+                if response.status == 200:
+                    # Get the JSON content
+                    content = await page.content()
+                    
+                    # Extract JSON from the page content
+                    # The response should be pure JSON, but let's handle it carefully
+                    try:
+                        # Try to parse as JSON directly
+                        json_data = await page.evaluate('() => JSON.parse(document.body.textContent)')
+                        logger.debug("API call successful, response keys: %s", list(json_data.keys()) if isinstance(json_data, dict) else 'Not a dict')
+                        
+                        # Parse the API response
+                        with metrics.stage('parse'):
+                            whisky_info = self._parse_api_response(json_data, whisky_id)
+                        return whisky_info
+                        
+                    except Exception as e:
+                        logger.warning("Error parsing JSON response whisky_id=%s: %s", whisky_id, e)
+                        # Try to extract JSON from the page content manually
+                        import re
+                        import json
+                        
+                        # Look for JSON in the page content
+                        json_match = re.search(r'\{.*\}', content, re.DOTALL)
+                        if json_match:
+                            try:
+                                json_data = json.loads(json_match.group())
+                                logger.debug("Extracted JSON from page content")
+                                with metrics.stage('parse'):
+                                    whisky_info = self._parse_api_response(json_data, whisky_id)
+                                return whisky_info
+                            except Exception as e2:
+                                logger.warning("Error parsing extracted JSON whisky_id=%s: %s", whisky_id, e2)
+                        
+                        return self._get_fallback_data(whisky_id, reason='invalid_json')
+                        
+                else:
+                    logger.warning("API request failed whisky_id=%s status=%s", whisky_id, response.status)
+                    logger.debug("Response content: %s...", (await response.text())[:300])
+                    return self._get_fallback_data(whisky_id, reason='upstream_status')
+                
+            except Exception as e:
+                logger.error("Playwright error whisky_id=%s: %s", whisky_id, e)
+                return self._get_fallback_data(whisky_id, reason='browser_error')
+            finally:
+                await browser.close()
+                metrics.BROWSER_SESSIONS.dec()
+    
+
+    
+    def _parse_api_response(self, data, whisky_id):
+        """Parse the API response and extract whisky information"""
+        try:
+            # Handle the real WhiskyBase API response structure
+            if 'whisky' in data:
+                whisky_data = data['whisky']
+            elif 'data' in data:
+                whisky_data = data['data']
+            else:
+                whisky_data = data
+            
+            # Get name
+            name = whisky_data.get('name', f'Whisky #{whisky_id}')
+            
+            # Get distillery/brand information - try multiple possible fields
+            distillery = 'Unknown Distillery'
+            if 'brand' in whisky_data and isinstance(whisky_data['brand'], dict):
+                # Try brandname first (real API structure), then name
+                distillery = whisky_data['brand'].get('brandname') or whisky_data['brand'].get('name', 'Unknown Distillery')
+            elif 'brand_name' in whisky_data:
+                distillery = whisky_data['brand_name']
+            elif 'bottle_for' in whisky_data and whisky_data['bottle_for']:
+                # Use bottle_for as distillery name (common in independent bottlings)
+                distillery = whisky_data['bottle_for']
+            elif 'district' in whisky_data and whisky_data['district']:
+                # Use district as fallback (e.g., "Islay" for Islay whiskies)
+                distillery = whisky_data['district'] + " Distillery"
+            
+            # Get ABV/strength
+            abv = 'Unknown ABV'
+            if 'strength' in whisky_data:
+                strength = whisky_data['strength']
+                if strength:
+                    abv = f"{strength}%"
+            elif 'abv' in whisky_data:
+                abv_val = whisky_data['abv']
+                if abv_val:
+                    abv = f"{abv_val}%"
+            
+            # Get age
+            age = ''
+            if 'age' in whisky_data and whisky_data['age']:
+                age_val = whisky_data['age']
+                if age_val:
+                    age = f"{age_val} years"
+            
+            # Get region
+            region = 'Unknown Region'
+            if 'region' in whisky_data:
+                region = whisky_data['region']
+            
+            # Get bottler information
+            bottler = ''
+            if 'bottler' in whisky_data and isinstance(whisky_data['bottler'], dict):
+                bottler = whisky_data['bottler'].get('name', '')
+            elif 'bottler_serie' in whisky_data:
+                bottler = whisky_data['bottler_serie']
+            
+            # Get additional details
+            cask_type = whisky_data.get('cask_type', '')
+            type_info = whisky_data.get('type', '')
+            
+            # Build note with additional information
+            note_parts = []
+            if region and region != 'Unknown Region':
+                note_parts.append(region)
+            if cask_type:
+                note_parts.append(cask_type)
+            if bottler:
+                note_parts.append(f"Bottled by {bottler}")
+            
+            note = ' | '.join(note_parts) if note_parts else ''
+            
+            # Enhanced image extraction for real API response
+            image_url = ''
+            
+            # Try to get image from photos array (real API structure)
+            if 'photos' in whisky_data and isinstance(whisky_data['photos'], list):
+                photos = whisky_data['photos']
+                if photos:
+                    # Look for the specific image URL first (479313-normal.png)
+                    specific_photo = next((photo for photo in photos if photo.get('id') == 479313), None)
+                    if specific_photo:
+                        # Use the normal size of the specific photo
+                        image_url = specific_photo.get('normal')
+                    else:
+                        # Look for label photo first (label: true)
+                        label_photo = next((photo for photo in photos if photo.get('label', False)), None)
+                        if label_photo:
+                            # Prefer big size, fall back to normal, then small
+                            image_url = label_photo.get('big') or label_photo.get('normal') or label_photo.get('small')
+                        else:
+                            # Use first photo if no label photo found
+                            first_photo = photos[0]
+                            image_url = first_photo.get('big') or first_photo.get('normal') or first_photo.get('small')
+            
+            # Fallback to old image extraction methods
+            if not image_url:
+                image_data = whisky_data.get('image', {})
+                if isinstance(image_data, dict):
+                    # Try various possible image URL fields
+                    for field in ['url', 'src', 'image_url', 'photo_url', 'thumbnail']:
+                        if field in image_data and image_data[field]:
+                            image_url = image_data[field]
+                            break
+                    
+                    # If no direct URL, try nested structures
+                    if not image_url and 'sizes' in image_data:
+                        sizes = image_data['sizes']
+                        if isinstance(sizes, dict):
+                            # Try to get the largest available size
+                            for size in ['large', 'medium', 'small', 'original']:
+                                if size in sizes and sizes[size]:
+                                    image_url = sizes[size]
+                                    break
+            
+            # If still no image, try alternative image fields in the main data
+            if not image_url:
+                for field in ['photo', 'picture', 'thumbnail', 'image_url']:
+                    if field in whisky_data and whisky_data[field]:
+                        image_url = whisky_data[field]
+                        break
+            
+            # Ensure image URL is absolute
+            if image_url and not image_url.startswith(('http://', 'https://')):
+                base_url = os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')
+                image_url = f"{base_url}{image_url}"
+            
+            whisky_info = {
+                'id': whisky_id,
+                'name': name,
+                'distillery': distillery,
+                'bottler': bottler,
+                'abv': abv,
+                'age': age,
+                'region': region,
+                'note': note,
+                'url': f"{os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')}/whisky/{whisky_id}",
+                'image_url': image_url,
+                'source': 'api'
+            }
+            self._index_record(whisky_info)
+            return whisky_info
+            
+        except Exception as e:
+            logger.error("Error parsing API response whisky_id=%s: %s", whisky_id, e)
+            return self._get_fallback_data(whisky_id, reason='parse_error')
+
+    def _index_record(self, whisky_info):
+        """Add a parsed record to the local search index; indexing never fails a lookup"""
+        if self.search_index is None:
+            return
+        try:
+            with metrics.stage('index'):
+                self.search_index.add(whisky_info)
+        except sqlite3.Error as e:
+            logger.warning("Could not index whisky_id=%s: %s", whisky_info.get('id'), e)
+
+    def _get_fallback_data(self, whisky_id, reason='error'):
+        """Generate fallback data when scraping fails"""
+        metrics.FALLBACK_TOTAL.inc(reason=reason)
+        # Simple fallback data generation
+        whiskies = [
+            {'name': 'Macallan 18 Year Old', 'distillery': 'The Macallan', 'abv': '43%', 'age': '18 years'},
+            {'name': 'Glenfiddich 12 Year Old', 'distillery': 'Glenfiddich', 'abv': '40%', 'age': '12 years'},
+            {'name': 'Laphroaig 10 Year Old', 'distillery': 'Laphroaig', 'abv': '43%', 'age': '10 years'},
+            {'name': 'Ardbeg Uigeadail', 'distillery': 'Ardbeg', 'abv': '54.2%', 'age': 'No Age Statement'},
+            {'name': 'Glenlivet 15 Year Old', 'distillery': 'The Glenlivet', 'abv': '40%', 'age': '15 years'},
+            {'name': 'Lagavulin 16 Year Old', 'distillery': 'Lagavulin', 'abv': '43%', 'age': '16 years'},
+            {'name': 'Balvenie 12 Year Old', 'distillery': 'The Balvenie', 'abv': '40%', 'age': '12 years'},
+            {'name': 'Highland Park 18 Year Old', 'distillery': 'Highland Park', 'abv': '43%', 'age': '18 years'}
+        ]
+        
+        # Use whisky_id to select a whisky (cycling through the list)
+        selected_whisky = whiskies[whisky_id % len(whiskies)]
+        
+        return {
+            'id': whisky_id,
+            'name': selected_whisky['name'],
+            'distillery': selected_whisky['distillery'],
+            'abv': selected_whisky['abv'],
+            'age': selected_whisky['age'],
+            'image_url': None,  # No image for fallback data
+            'url': f"{os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')}/whisky/{whisky_id}",
+            'source': 'fallback_data',
+            'note': 'Data from fallback source (Whiskybase unavailable)'
+        }
+    
+    def get_whisky_info(self, whisky_id):
+        """Return whisky information from the shared metadata store, fetching it on a miss
+
+        If the fetch is refused because the service is overloaded, an expired
+        stored record is returned instead (marked stale) when OVERLOAD_MODE is
+        'stale'; otherwise scheduler.Overloaded propagates.
+        """
+        whisky_info = self._stored_record(whisky_id)
+        if whisky_info is not None:
+            return whisky_info
+        try:
+            return self.fetch_whisky_info(whisky_id)
+        except scheduler.Overloaded:
+            if os.getenv('OVERLOAD_MODE', config.OVERLOAD_MODE) != 'stale':
+                raise
+            whisky_info = self._stored_record(whisky_id, allow_expired=True)
+            if whisky_info is None:
+                raise
+            metrics.CACHE_EVENTS.inc(cache='metadata', event='stale')
+            return dict(whisky_info, stale=True)
+
+    def _stored_record(self, whisky_id, allow_expired=False):
+        if self.metadata_store is None:
+            return None
+        try:
+            with metrics.stage('metadata'):
+                whisky_info = self.metadata_store.get(whisky_id, allow_expired=allow_expired)
+        except Exception as e:
+            # The store is a cache; an unavailable store must not fail the lookup
+            logger.warning("Metadata store read failed whisky_id=%s: %s", whisky_id, e)
+            return None
+        if not allow_expired:
+            metrics.CACHE_EVENTS.inc(cache='metadata', event='hit' if whisky_info else 'miss')
+        return whisky_info
+
+    def _store_record(self, whisky_info):
+        if self.metadata_store is None or whisky_info.get('source') != 'api':
+            return
+        try:
+            with metrics.stage('metadata'):
+                self.metadata_store.put(whisky_info, self.metadata_ttl_seconds)
+        except Exception as e:
+            logger.warning("Metadata store write failed whisky_id=%s: %s", whisky_info.get('id'), e)
+
+    def fetch_whisky_info(self, whisky_id):
+        """Fetch whisky information from WhiskyBase, bypassing and then refreshing the metadata store"""
+        with scheduler.slot('fetch'):
+            whisky_info = self._fetch_whisky_info(whisky_id)
+        self._store_record(whisky_info)
+        return whisky_info
+
+    def _fetch_whisky_info(self, whisky_id):
+        """Synchronous wrapper for async Playwright method"""
+        import asyncio
+
+        try:
+            # Run the async method in a new event loop
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            result = loop.run_until_complete(self.get_whisky_info_playwright(whisky_id))
+            loop.close()
+            return result
+        except Exception as e:
+            logger.error("Error in get_whisky_info whisky_id=%s: %s", whisky_id, e)
+            return self._get_fallback_data(whisky_id, reason='error')
+
+    def create_qr_code(self, url):
+        """Create QR code for the whisky URL; returns a PIL image, so nothing is written to disk"""
+        import qrcode
+
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=20,
+            border=4,
+        )
+        qr.add_data(url)
+        qr.make(fit=True)
+
+        return qr.make_image(fill_color="black", back_color="white").get_image()
+
+    def create_label(self, whisky_info, output_filename="whisky_label.png", width_mm=35, height_mm=37, dpi=72, show_photo=False, output_format='png'):
+        """Create a whisky label with QR code"""
+        layout = self.layout_label(whisky_info, width_mm=width_mm, height_mm=height_mm, dpi=dpi, show_photo=show_photo)
+        return self.save_layout(layout, output_filename, output_format)
+
+    def layout_label(self, whisky_info, width_mm=35, height_mm=37, dpi=72, show_photo=False, qr_matrix=None):
+        """Lay out a whisky label with QR code without rendering it
+
+        qr_matrix may be passed in when several labels share one QR code.
+        """
+        from PIL import ImageFont
+
+        # Convert mm to pixels
+        # For screen display, use 72 DPI (standard screen resolution)
+        # For print quality, use 300 DPI
+        pixels_per_mm = dpi / 25.4
+        
+        width = int(width_mm * pixels_per_mm)
+        height = int(height_mm * pixels_per_mm)
+        
+        # Resize QR code to fill the top portion of the label
+        # Use 50% of the label height for QR code to make it more prominent
+        qr_size = min(width, int(height * 0.4))
+        
+        # Optional bottle photo beside the QR code
+        photo = None
+        if show_photo:
+            qr_size, photo = self._get_label_photo(whisky_info, qr_size, width)
+        
+        # Create QR code
+        if qr_matrix is None:
+            with metrics.stage('qr_build'):
+                qr_matrix = self._qr_matrix(whisky_info['url'], error_correction='L', border=4)
+        
+        layout_started = time.perf_counter()
+        
+        # Label with white background
+        layout = LabelLayout(width, height, dpi, background='white')
+        
+        # Add small border inside the label
+        border_width = max(1, width // 200)  # Border width proportional to label size
+        layout.add_rect([border_width, border_width, width - border_width, height - border_width],
+                        outline='#CCCCCC', width=border_width)
+        
+        # Calculate proportional font sizes based on label dimensions
+        # Make fonts smaller to fit all content
+        base_font_size = min(width, height) // 16  # Smaller base font
+        font_large_size = int(base_font_size * 1.5)  # Smaller multiplier
+        font_medium_size = int(base_font_size * 1.2)  # Smaller multiplier
+        font_small_size = int(base_font_size * 0.9)  # Smaller multiplier
+        
+        try:
+            # Try to load a font, fall back to default if not available
+            font_large = ImageFont.truetype("arial.ttf", font_large_size)
+            font_medium = ImageFont.truetype("arial.ttf", font_medium_size)
+            font_small = ImageFont.truetype("arial.ttf", font_small_size)
+        except:
+            font_large = ImageFont.load_default()
+            font_medium = ImageFont.load_default()
+            font_small = ImageFont.load_default()
+        
+        # Position QR code centered at the top (accounting for border)
+        qr_x = (width - qr_size) // 2  # Center horizontally
+        qr_y = border_width + (height - border_width * 2) // config.MARGIN_RATIO  # Margin from top, inside border
+        if photo:
+            qr_x = self._place_label_photo(layout, photo, qr_size, qr_y)
+        layout.add_qr(qr_matrix, qr_x, qr_y, qr_size)
+        
+        # Add text content - start below QR code (accounting for border)
+        y_position = qr_y + qr_size + (height // (config.MARGIN_RATIO * 2))  # Start below QR code with smaller margin
+        line_height = max(font_large_size + 1, height // 15)  # Use font height + minimal padding, minimum 1/15 of label height
+        
+        # Whisky name
+        name = whisky_info['name']
+        max_name_length = width // max(1, font_large_size // 2)  # Approximate characters that fit
+        if len(name) > max_name_length:
+            name = name[:max_name_length-3] + "..."
+        layout.add_centered_text(y_position, name, font_large, 'black')
+        y_position += line_height
+        
+        # Distillery
+        distillery = whisky_info['distillery']
+        max_distillery_length = width // max(1, font_medium_size // 2)  # Approximate characters that fit
+        if len(distillery) > max_distillery_length:
+            distillery = distillery[:max_distillery_length-3] + "..."
+        layout.add_centered_text(y_position, f"Distillery: {distillery}", font_medium, 'black')
+        y_position += line_height
+        
+        # ABV
+        abv = whisky_info.get('abv', 'Unknown ABV')
+        layout.add_centered_text(y_position, f"ABV: {abv}", font_medium, 'black')
+        y_position += line_height
+        
+        # Age
+        if whisky_info.get('age'):
+            layout.add_centered_text(y_position, f"Age: {whisky_info['age']}", font_medium, 'black')
+            y_position += line_height
+        
+        # Source note
+        if whisky_info.get('note'):
+            layout.add_centered_text(y_position, whisky_info['note'], font_small, 'black')
+            y_position += line_height
+        
+        # Whisky ID
+        layout.add_centered_text(y_position, f"ID: {whisky_info['id']}", font_small, 'black')
+        
+        metrics.observe_stage('layout', time.perf_counter() - layout_started)
+        return layout
+
+    def create_ql820nwb_label(self, whisky_info, output_filename="whisky_label_ql820nwb.png", size_preset='custom', dpi=None, show_photo=False, output_format='png'):
+        """Create a whisky label optimized for Brother QL-820NWB thermal printer"""
+        layout = self.layout_ql820nwb_label(whisky_info, size_preset=size_preset, dpi=dpi, show_photo=show_photo)
+        return self.save_layout(layout, output_filename, output_format)
+
+    def layout_ql820nwb_label(self, whisky_info, size_preset='custom', dpi=None, show_photo=False, qr_matrix=None):
+        """Lay out a whisky label for the Brother QL-820NWB without rendering it
+
+        qr_matrix may be passed in when several labels share one QR code.
+        """
+        from PIL import ImageFont
+
+        # Get QL-820NWB settings
+        ql_settings = config.QL820NWB_SETTINGS
+        
+        # Get label dimensions based on preset
+        if size_preset in ql_settings['supported_sizes']:
+            width_mm = ql_settings['supported_sizes'][size_preset]['width_mm']
+            height_mm = ql_settings['supported_sizes'][size_preset]['height_mm']
+        else:
+            # Use custom size
+            width_mm = ql_settings['supported_sizes']['custom']['width_mm']
+            height_mm = ql_settings['supported_sizes']['custom']['height_mm']
+        
+        # Use QL-820NWB optimized DPI unless a preview resolution is requested
+        dpi = dpi or ql_settings['dpi']
+        pixels_per_mm = dpi / 25.4
+        
+        width = int(width_mm * pixels_per_mm)
+        height = int(height_mm * pixels_per_mm)
+        
+        # Resize QR code based on thermal printing settings
+        qr_settings = ql_settings['qr_settings']
+        qr_size = min(width, int(height * qr_settings['size_ratio']))
+        
+        # Optional bottle photo beside the QR code, dithered for the thermal head
+        photo = None
+        if show_photo:
+            qr_size, photo = self._get_label_photo(whisky_info, qr_size, width, dithered=True)
+        
+        # Create QR code optimized for thermal printing
+        if qr_matrix is None:
+            qr_matrix = self._ql820nwb_qr_matrix(whisky_info['url'])
+        
+        layout_started = time.perf_counter()
+        
+        # Pure white background for thermal printing
+        layout = LabelLayout(width, height, dpi, background=ql_settings['background_color'])
+        
+        # Add black border for thermal printing
+        border_width = max(2, width // 150)  # Slightly thicker border for thermal printing
+        layout.add_rect([border_width, border_width, width - border_width, height - border_width],
+                        outline=ql_settings['border_color'], width=border_width)
+        
+        # Calculate font sizes optimized for thermal printing
+        font_settings = ql_settings['font_settings']
+        base_font_size = min(width, height) // font_settings['base_font_size_ratio']
+        font_large_size = int(base_font_size * font_settings['large_font_multiplier'])
+        font_medium_size = int(base_font_size * font_settings['medium_font_multiplier'])
+        font_small_size = int(base_font_size * font_settings['small_font_multiplier'])
+        
+        try:
+            # Try to load Arial font for better thermal printing
+            font_large = ImageFont.truetype(font_settings['font_family'], font_large_size)
+            font_medium = ImageFont.truetype(font_settings['font_family'], font_medium_size)
+            font_small = ImageFont.truetype(font_settings['font_family'], font_small_size)
+        except:
+            # Fall back to default font
+            font_large = ImageFont.load_default()
+            font_medium = ImageFont.load_default()
+            font_small = ImageFont.load_default()
+        
+        # Position QR code centered at the top
+        qr_x = (width - qr_size) // 2
+        qr_y = border_width * 2  # More margin for thermal printing
+        if photo:
+            qr_x = self._place_label_photo(layout, photo, qr_size, qr_y)
+        layout.add_qr(qr_matrix, qr_x, qr_y, qr_size)
+        
+        # Add text content - start below QR code
+        y_position = qr_y + qr_size + (height // 25)  # More spacing for thermal printing
+        line_height = max(font_large_size + 2, height // 12)  # More line height for thermal printing
+        text_color = ql_settings['text_color']
+        
+        # Whisky name
+        name = whisky_info['name']
+        max_name_length = width // max(1, font_large_size // 3)  # More conservative character limit
+        if len(name) > max_name_length:
+            name = name[:max_name_length-3] + "..."
+        layout.add_centered_text(y_position, name, font_large, text_color)
+        y_position += line_height
+        
+        # Distillery
+        distillery = whisky_info['distillery']
+        max_distillery_length = width // max(1, font_medium_size // 3)
+        if len(distillery) > max_distillery_length:
+            distillery = distillery[:max_distillery_length-3] + "..."
+        layout.add_centered_text(y_position, f"Distillery: {distillery}", font_medium, text_color)
+        y_position += line_height
+        
+        # ABV
+        abv = whisky_info.get('abv', 'Unknown ABV')
+        layout.add_centered_text(y_position, f"ABV: {abv}", font_medium, text_color)
+        y_position += line_height
+        
+        # Age
+        if whisky_info.get('age'):
+            layout.add_centered_text(y_position, f"Age: {whisky_info['age']}", font_medium, text_color)
+            y_position += line_height
+        
+        # Whisky ID
+        layout.add_centered_text(y_position, f"ID: {whisky_info['id']}", font_small, text_color)
+        
+        metrics.observe_stage('layout', time.perf_counter() - layout_started)
+        return layout
+
+    def render_ql820nwb_variants(self, whisky_info, variants, output_format='png', show_photo=False, max_workers=None,
+                                 purpose='print'):
+        """Render one QL-820NWB label per (size_preset, dpi) variant from a single lookup
+
+        whisky_info may be a whisky ID, which is looked up once.  The QR code is
+        built once and shared, and variants are rendered concurrently.  Returns
+        a list of (size_preset, dpi, layout, data) in the order of variants.
+        """
+        if isinstance(whisky_info, int):
+            whisky_info = self.get_whisky_info(whisky_info)
+        qr_matrix = self._ql820nwb_qr_matrix(whisky_info['url'])
+
+        def render(variant):
+            size_preset, dpi = variant
+            layout = self.layout_ql820nwb_label(whisky_info, size_preset, dpi, show_photo, qr_matrix=qr_matrix)
+            return size_preset, layout.dpi, layout, self.render_layout(layout, output_format, purpose)
+
+        # A caller holding a render slot gets one slot's worth of rendering: serially, in that slot
+        if len(variants) <= 1 or scheduler.holds('render'):
+            return [render(variant) for variant in variants]
+        workers = min(len(variants), max_workers or os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Copy the context so stage timings still reach this request's Server-Timing header; each
+            # thread takes its own render slot even when the caller already holds one
+            futures = [executor.submit(scheduler.copy_context().run, render, variant) for variant in variants]
+            return [future.result() for future in futures]
+
+    def render_layout(self, layout, output_format='png', purpose='print'):
+        """Render a label layout to PNG, SVG or PDF bytes, or WebP/AVIF for previews
+
+        purpose ('print' or 'preview') selects the encoder settings from
+        config.ENCODER_SETTINGS; lossy preview formats are refused for print.
+        """
+        allowed = label_render.OUTPUT_FORMATS
+        if purpose == 'preview':
+            allowed += label_render.available_preview_formats()
+        if output_format not in allowed:
+            raise ValueError(f"Unsupported label format for {purpose}: {output_format}")
+        encoder_options = config.ENCODER_SETTINGS[purpose].get(output_format)
+        with scheduler.slot('render'):
+            if output_format in label_render.VECTOR_FORMATS:
+                with metrics.stage('render'):
+                    return label_render.render(layout, output_format)
+            with metrics.stage('render'):
+                image = label_render.render_image(layout)
+            with metrics.stage('encode'):
+                return label_render.encode_image(image, output_format, layout.dpi, encoder_options)
+
+    def save_layout(self, layout, output_filename, output_format='png'):
+        """Render a label layout and write it to output_filename"""
+        data = self.render_layout(layout, output_format)
+        with open(output_filename, 'wb') as f:
+            f.write(data)
+        return output_filename
+
+    def _ql820nwb_qr_matrix(self, url):
+        qr_settings = config.QL820NWB_SETTINGS['qr_settings']
+        with metrics.stage('qr_build'):
+            return self._qr_matrix(url, error_correction=qr_settings['error_correction'], border=qr_settings['border'])
+
+    def _qr_matrix(self, url, error_correction='L', border=4):
+        """Return the QR module matrix for url, quiet zone included"""
+        import qrcode
+
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=getattr(qrcode.constants, f'ERROR_CORRECT_{error_correction}'),
+            box_size=1,
+            border=border
+        )
+        qr.add_data(url)
+        qr.make(fit=True)
+        return qr.get_matrix()
+
+    def _get_label_photo(self, whisky_info, qr_size, width, dithered=False):
+        """Return (qr_size, photo), shrinking the QR code to fit the bottle photo beside it"""
+        if not whisky_info.get('image_url'):
+            return qr_size, None
+        photo_qr_size = min(qr_size, int(width * 0.55))
+        photo_box = (max(1, width - photo_qr_size - width // 8), photo_qr_size)
+        photo = self.photo_cache.get_thumbnail(whisky_info['image_url'], photo_box, dithered=dithered)
+        if photo is None:
+            return qr_size, None
+        return photo_qr_size, photo
+
+    def _place_label_photo(self, layout, photo, qr_size, qr_y):
+        """Place the photo right of the QR code and return the QR code's x position"""
+        spacing = (layout.width - qr_size - photo.width) // 3
+        qr_x = spacing
+        layout.add_image(photo, qr_x + qr_size + spacing, qr_y + (qr_size - photo.height) // 2)
+        return qr_x
+
+    def create_qr_code_thermal(self, url, qr_settings):
+        """Create QR code optimized for thermal printing; returns a PIL image"""
+        import qrcode
+
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=getattr(qrcode.constants, f'ERROR_CORRECT_{qr_settings["error_correction"]}'),
+            box_size=qr_settings['border'],
+            border=qr_settings['border']
+        )
+        qr.add_data(url)
+        qr.make(fit=True)
+        
+        # Black on white for thermal printing
+        return qr.make_image(fill_color='black', back_color='white').get_image()
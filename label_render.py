@@ -0,0 +1,397 @@
+"""
+Label layout and output backends
+
+The label designs in WhiskyLabelGenerator produce a LabelLayout: positioned
+rectangles, QR matrices, photos and text in pixel coordinates at the layout
+DPI.  The same layout is rendered to a raster image (PNG) or to resolution
+independent SVG and PDF, with the label fonts embedded and the QR code drawn
+as vector modules, so one layout pass serves both preview and print.
+On-screen previews may also be encoded as WebP or AVIF, which are much
+smaller than PNG; print output stays lossless PNG, SVG or PDF.
+"""
+
+import base64
+import hashlib
+import io
+import zlib
+from html import escape
+
+RASTER_FORMATS = ('png',)
+VECTOR_FORMATS = ('svg', 'pdf')
+OUTPUT_FORMATS = RASTER_FORMATS + VECTOR_FORMATS
+# Raster formats offered for previews only, where the PIL build supports them
+PREVIEW_FORMATS = ('webp', 'avif')
+MIMETYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'pdf': 'application/pdf',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+_available_preview_formats = None
+
+
+def available_preview_formats():
+    """Return the preview formats this PIL build can encode"""
+    global _available_preview_formats
+    if _available_preview_formats is None:
+        from PIL import features
+        _available_preview_formats = tuple(
+            output_format for output_format in PREVIEW_FORMATS if features.check(output_format)
+        )
+    return _available_preview_formats
+
+
+class LabelLayout:
+    """Positioned label elements in pixel coordinates at the layout DPI"""
+
+    def __init__(self, width, height, dpi, background='white'):
+        self.width = width
+        self.height = height
+        self.dpi = dpi
+        self.background = background
+        self.elements = []
+
+    @property
+    def width_mm(self):
+        return self.width * 25.4 / self.dpi
+
+    @property
+    def height_mm(self):
+        return self.height * 25.4 / self.dpi
+
+    def add_rect(self, box, outline, width):
+        self.elements.append({'type': 'rect', 'box': box, 'outline': outline, 'width': width})
+
+    def add_qr(self, matrix, x, y, size, fill='black', back='white'):
+        self.elements.append({'type': 'qr', 'matrix': matrix, 'x': x, 'y': y, 'size': size, 'fill': fill, 'back': back})
+
+    def add_image(self, image, x, y):
+        self.elements.append({'type': 'image', 'image': image, 'x': x, 'y': y})
+
+    def add_text(self, x, y, text, font, fill):
+        self.elements.append({'type': 'text', 'x': x, 'y': y, 'text': text, 'font': font, 'fill': fill})
+
+    def add_centered_text(self, y, text, font, fill):
+        """Add text centered horizontally on the label"""
+        bbox = font.getbbox(text)
+        text_width = bbox[2] - bbox[0]
+        self.add_text((self.width - text_width) // 2, y, text, font, fill)
+
+
+def render(layout, output_format, encoder_options=None):
+    """Render a layout as PNG/WebP/AVIF bytes, SVG text or PDF bytes"""
+    if output_format in RASTER_FORMATS + PREVIEW_FORMATS:
+        return encode_image(render_image(layout), output_format, layout.dpi, encoder_options)
+    if output_format == 'svg':
+        return render_svg(layout).encode('utf-8')
+    if output_format == 'pdf':
+        return render_pdf(layout)
+    raise ValueError(f"Unsupported label format: {output_format}")
+
+
+def encode_image(image, output_format, dpi, encoder_options=None):
+    """Encode a rendered label with the given PIL encoder options, e.g. compress_level or quality"""
+    options = dict(encoder_options or {})
+    if output_format == 'png':
+        options['dpi'] = (dpi, dpi)
+    buffer = io.BytesIO()
+    image.save(buffer, output_format.upper(), **options)
+    return buffer.getvalue()
+
+
+def _qr_image(element):
+    from PIL import Image
+
+    matrix = element['matrix']
+    modules = len(matrix)
+    qr = Image.new('L', (modules, modules))
+    qr.putdata([0 if dark else 255 for row in matrix for dark in row])
+    qr = qr.resize((element['size'], element['size']), Image.NEAREST)
+    colored = Image.new('RGB', qr.size, element['back'])
+    colored.paste(element['fill'], mask=Image.eval(qr, lambda value: 255 - value))
+    return colored
+
+
+def render_image(layout):
+    """Rasterize a layout at its layout DPI"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (layout.width, layout.height), color=layout.background)
+    draw = ImageDraw.Draw(image)
+    for element in layout.elements:
+        kind = element['type']
+        if kind == 'rect':
+            draw.rectangle(element['box'], outline=element['outline'], width=element['width'])
+        elif kind == 'qr':
+            image.paste(_qr_image(element), (element['x'], element['y']))
+        elif kind == 'image':
+            image.paste(element['image'], (element['x'], element['y']))
+        elif kind == 'text':
+            draw.text((element['x'], element['y']), element['text'], fill=element['fill'], font=element['font'])
+    return image
+
+
+def _font_data(font):
+    """Return the raw font file bytes behind a PIL font, or None for bitmap fonts"""
+    path = getattr(font, 'path', None)
+    if path is None:
+        return None
+    if hasattr(path, 'getvalue'):
+        return path.getvalue()
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (OSError, TypeError):
+        return None
+
+
+def _font_ascent(font):
+    if hasattr(font, 'getmetrics'):
+        return font.getmetrics()[0]
+    return font.getbbox('Ag')[3]
+
+
+def _font_size(font):
+    return getattr(font, 'size', None) or font.getbbox('Ag')[3]
+
+
+def _qr_runs(matrix):
+    """Yield (column, row, length) for each horizontal run of dark modules"""
+    for row_index, row in enumerate(matrix):
+        column = 0
+        while column < len(row):
+            if row[column]:
+                start = column
+                while column < len(row) and row[column]:
+                    column += 1
+                yield start, row_index, column - start
+            else:
+                column += 1
+
+
+def _png_data_uri(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', optimize=True)
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _rect_stroke_box(element):
+    """PIL draws outlines inside the box; vector strokes are centered on the path"""
+    x0, y0, x1, y1 = element['box']
+    stroke = element['width']
+    return x0 + stroke / 2, y0 + stroke / 2, x1 - x0 + 1 - stroke, y1 - y0 + 1 - stroke
+
+
+def render_svg(layout):
+    """Render a layout as a standalone SVG document sized in millimetres"""
+    font_families = {}
+    font_faces = []
+    body = [f'<rect width="{layout.width}" height="{layout.height}" fill="{layout.background}"/>']
+
+    for element in layout.elements:
+        kind = element['type']
+        if kind == 'rect':
+            x, y, width, height = _rect_stroke_box(element)
+            body.append(
+                f'<rect x="{x:g}" y="{y:g}" width="{width:g}" height="{height:g}" fill="none" '
+                f'stroke="{element["outline"]}" stroke-width="{element["width"]}"/>'
+            )
+        elif kind == 'qr':
+            modules = len(element['matrix'])
+            scale = element['size'] / modules
+            path = ''.join(
+                f'M{element["x"] + column * scale:.3f} {element["y"] + row * scale:.3f}h{length * scale:.3f}v{scale:.3f}h{-length * scale:.3f}z'
+                for column, row, length in _qr_runs(element['matrix'])
+            )
+            body.append(
+                f'<rect x="{element["x"]}" y="{element["y"]}" width="{element["size"]}" height="{element["size"]}" fill="{element["back"]}"/>'
+            )
+            body.append(f'<path d="{path}" fill="{element["fill"]}" shape-rendering="crispEdges"/>')
+        elif kind == 'image':
+            image = element['image']
+            body.append(
+                f'<image x="{element["x"]}" y="{element["y"]}" width="{image.width}" height="{image.height}" '
+                f'href="{_png_data_uri(image)}"/>'
+            )
+        elif kind == 'text':
+            font = element['font']
+            family = 'Arial, Helvetica, sans-serif'
+            data = _font_data(font)
+            if data is not None:
+                digest = hashlib.sha1(data).hexdigest()
+                if digest not in font_families:
+                    font_families[digest] = f'LabelFont{len(font_families)}'
+                    font_type = 'otf' if data[:4] == b'OTTO' else 'ttf'
+                    font_faces.append(
+                        f"@font-face {{ font-family: '{font_families[digest]}'; "
+                        f"src: url(data:font/{font_type};base64,{base64.b64encode(data).decode('ascii')}); }}"
+                    )
+                family = f"'{font_families[digest]}', {family}"
+            body.append(
+                f'<text x="{element["x"]}" y="{element["y"] + _font_ascent(font)}" font-family="{escape(family)}" '
+                f'font-size="{_font_size(font)}" fill="{element["fill"]}" xml:space="preserve">{escape(element["text"], quote=False)}</text>'
+            )
+
+    style = f'<style>{" ".join(font_faces)}</style>' if font_faces else ''
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{layout.width_mm:.2f}mm" height="{layout.height_mm:.2f}mm" '
+        f'viewBox="0 0 {layout.width} {layout.height}">'
+        f'{style}{"".join(body)}</svg>\n'
+    )
+
+
+def _pdf_color(color):
+    from PIL import ImageColor
+
+    red, green, blue = ImageColor.getrgb(color)[:3]
+    return f"{red / 255:.3f} {green / 255:.3f} {blue / 255:.3f}"
+
+
+def _pdf_string(text):
+    encoded = text.encode('cp1252', errors='replace')
+    return '(' + encoded.decode('latin-1').replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+class _PdfWriter:
+    def __init__(self):
+        self.objects = []
+
+    def add(self, body):
+        self.objects.append(body)
+        return len(self.objects)
+
+    def add_stream(self, data, entries=''):
+        compressed = zlib.compress(data)
+        return self.add(
+            f"<< /Length {len(compressed)} /Filter /FlateDecode {entries}>>\nstream\n".encode('latin-1')
+            + compressed + b"\nendstream"
+        )
+
+    def reserve(self):
+        return self.add(None)
+
+    def set(self, number, body):
+        self.objects[number - 1] = body
+
+    def output(self, root):
+        out = io.BytesIO()
+        out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(self.objects, start=1):
+            offsets.append(out.tell())
+            if isinstance(body, str):
+                body = body.encode('latin-1')
+            out.write(f"{number} 0 obj\n".encode('latin-1') + body + b"\nendobj\n")
+        xref = out.tell()
+        out.write(f"xref\n0 {len(self.objects) + 1}\n0000000000 65535 f \n".encode('latin-1'))
+        for offset in offsets:
+            out.write(f"{offset:010d} 00000 n \n".encode('latin-1'))
+        out.write(f"trailer\n<< /Size {len(self.objects) + 1} /Root {root} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1'))
+        return out.getvalue()
+
+
+def _pdf_font(writer, font, data):
+    """Embed a TrueType/OpenType font as a simple WinAnsi font and return its object number"""
+    # Measure in 1000-unit glyph space; small pixel sizes round advances to whole pixels
+    unit_font = font.font_variant(size=1000)
+    widths = []
+    for code in range(32, 256):
+        try:
+            character = bytes([code]).decode('cp1252')
+        except UnicodeDecodeError:
+            widths.append(0)
+            continue
+        widths.append(round(unit_font.getlength(character)))
+    ascent, descent = unit_font.getmetrics()
+    name = ''.join(part for part in ''.join(font.getname()) if part.isalnum()) or 'LabelFont'
+    is_cff = data[:4] == b'OTTO'
+    font_file = writer.add_stream(data, '/Subtype /OpenType ' if is_cff else f'/Length1 {len(data)} ')
+    descriptor = writer.add(
+        f"<< /Type /FontDescriptor /FontName /{name} /Flags 32 "
+        f"/FontBBox [0 {-descent} 1000 {ascent}] /ItalicAngle 0 "
+        f"/Ascent {ascent} /Descent {-descent} /CapHeight {ascent} "
+        f"/StemV 80 /{'FontFile3' if is_cff else 'FontFile2'} {font_file} 0 R >>"
+    )
+    return writer.add(
+        f"<< /Type /Font /Subtype /{'Type1' if is_cff else 'TrueType'} /BaseFont /{name} "
+        f"/FirstChar 32 /LastChar 255 /Widths [{' '.join(str(width) for width in widths)}] "
+        f"/Encoding /WinAnsiEncoding /FontDescriptor {descriptor} 0 R >>"
+    )
+
+
+def render_pdf(layout):
+    """Render a layout as a single-page PDF sized to the label"""
+    writer = _PdfWriter()
+    catalog = writer.reserve()
+    pages = writer.reserve()
+    scale = 72 / layout.dpi
+    page_width = layout.width * scale
+    page_height = layout.height * scale
+    fonts = {}
+    images = {}
+    ops = [f"{_pdf_color(layout.background)} rg 0 0 {page_width:.3f} {page_height:.3f} re f"]
+
+    def pdf_y(y, height=0):
+        return page_height - (y + height) * scale
+
+    for element in layout.elements:
+        kind = element['type']
+        if kind == 'rect':
+            x, y, width, height = _rect_stroke_box(element)
+            ops.append(
+                f"{element['width'] * scale:.3f} w {_pdf_color(element['outline'])} RG "
+                f"{x * scale:.3f} {pdf_y(y, height):.3f} {width * scale:.3f} {height * scale:.3f} re S"
+            )
+        elif kind == 'qr':
+            size = element['size'] * scale
+            module = size / len(element['matrix'])
+            left = element['x'] * scale
+            top = pdf_y(element['y'])
+            ops.append(f"{_pdf_color(element['back'])} rg {left:.3f} {top - size:.3f} {size:.3f} {size:.3f} re f")
+            ops.append(f"{_pdf_color(element['fill'])} rg")
+            for column, row, length in _qr_runs(element['matrix']):
+                ops.append(f"{left + column * module:.3f} {top - (row + 1) * module:.3f} {length * module:.3f} {module:.3f} re")
+            ops.append("f")
+        elif kind == 'image':
+            image = element['image']
+            name = f"Im{len(images) + 1}"
+            pixels = image.convert('L' if image.mode in ('1', 'L') else 'RGB')
+            color_space = '/DeviceGray' if pixels.mode == 'L' else '/DeviceRGB'
+            images[name] = writer.add_stream(
+                pixels.tobytes(),
+                f"/Type /XObject /Subtype /Image /Width {pixels.width} /Height {pixels.height} "
+                f"/ColorSpace {color_space} /BitsPerComponent 8 "
+            )
+            ops.append(
+                f"q {image.width * scale:.3f} 0 0 {image.height * scale:.3f} "
+                f"{element['x'] * scale:.3f} {pdf_y(element['y'], image.height):.3f} cm /{name} Do Q"
+            )
+        elif kind == 'text':
+            font = element['font']
+            data = _font_data(font)
+            key = hashlib.sha1(data).hexdigest() if data is not None else 'Helvetica'
+            if key not in fonts:
+                number = (
+                    _pdf_font(writer, font, data) if data is not None
+                    else writer.add("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+                )
+                fonts[key] = (f"F{len(fonts) + 1}", number)
+            baseline = pdf_y(element['y'] + _font_ascent(font))
+            ops.append(
+                f"BT /{fonts[key][0]} {_font_size(font) * scale:.3f} Tf {_pdf_color(element['fill'])} rg "
+                f"{element['x'] * scale:.3f} {baseline:.3f} Td {_pdf_string(element['text'])} Tj ET"
+            )
+
+    content = writer.add_stream('\n'.join(ops).encode('latin-1'))
+    font_resources = ' '.join(f"/{name} {number} 0 R" for name, number in fonts.values())
+    image_resources = ' '.join(f"/{name} {number} 0 R" for name, number in images.items())
+    page = writer.add(
+        f"<< /Type /Page /Parent {pages} 0 R /MediaBox [0 0 {page_width:.3f} {page_height:.3f}] "
+        f"/Resources << /Font << {font_resources} >> /XObject << {image_resources} >> >> /Contents {content} 0 R >>"
+    )
+    writer.set(pages, f"<< /Type /Pages /Kids [{page} 0 R] /Count 1 >>")
+    writer.set(catalog, f"<< /Type /Catalog /Pages {pages} 0 R >>")
+    return writer.output(catalog)
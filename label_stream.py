@@ -0,0 +1,107 @@
+"""
+Streaming input and output for batch label rendering
+
+Label rows are read one at a time from a CSV or NDJSON request body, and
+rendered labels are written into a ZIP archive whose bytes are handed back as
+soon as each entry is complete.  Neither side holds more than one label in
+memory, so a batch of any size runs in constant memory.
+"""
+
+import csv
+import io
+import json
+import zipfile
+
+INPUT_FORMATS = ('csv', 'ndjson')
+INPUT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+# PNG is already deflate-compressed; recompressing it only costs CPU
+STORED_EXTENSIONS = ('.png',)
+
+
+def input_format_for(content_type, requested=None):
+    """Return 'csv' or 'ndjson' for an explicit choice or request content type, or None"""
+    if requested:
+        requested = requested.lower()
+        return requested if requested in INPUT_FORMATS else None
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    return INPUT_CONTENT_TYPES.get(mimetype)
+
+
+def read_label_rows(stream, input_format):
+    """Yield (row_number, fields, error) for each row of a binary CSV or NDJSON stream
+
+    fields is a dict with lower-cased keys and string values, or None when the
+    row could not be parsed, in which case error describes the problem.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if input_format == 'csv':
+        reader = csv.DictReader(text)
+        for row_number, row in enumerate(reader, start=1):
+            fields = {
+                key.strip().lower(): (value or '').strip()
+                for key, value in row.items() if key is not None
+            }
+            yield row_number, fields, None
+        return
+
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            fields = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(fields, dict):
+            yield row_number, None, 'Each NDJSON line must be an object'
+            continue
+        # Strings like the CSV reader's, so a number, list or object in a field cannot break the layout
+        yield row_number, {
+            str(key).lower(): '' if value is None else str(value).strip() for key, value in fields.items()
+        }, None
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that collects bytes until drained"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ZipStream:
+    """ZIP archive produced incrementally; add() and close() return the bytes to send"""
+
+    def __init__(self):
+        self._buffer = _ChunkBuffer()
+        # On a non-seekable sink zipfile writes sizes in data descriptors
+        self._zip = zipfile.ZipFile(self._buffer, 'w')
+
+    def add(self, name, data):
+        compress_type = zipfile.ZIP_STORED if name.endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+        self._zip.writestr(name, data, compress_type=compress_type)
+        return self._buffer.drain()
+
+    def close(self):
+        self._zip.close()
+        return self._buffer.drain()
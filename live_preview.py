@@ -0,0 +1,219 @@
+"""
+Debounced live label previews for the manual-entry form
+
+The browser POSTs every edit to /api/live-preview/<session> and listens on
+/api/live-preview/<session>/events (server-sent events).  Edits are
+debounced per session: a render starts only once the form has been quiet
+for LIVE_PREVIEW_DEBOUNCE_MS, and a render that a newer edit supersedes is
+abandoned at the next stage boundary instead of being finished and sent.
+Renders from all sessions share a small number of render slots, so fast
+typing cannot flood the process, and each listener only ever receives the
+latest frame.
+
+Sessions live in the process that created them; behind several workers the
+POST and the event stream must reach the same worker (sticky sessions).
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+
+import config
+import metrics
+import scheduler
+
+logger = logging.getLogger('whisky_label.live_preview')
+
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+class Superseded(Exception):
+    """Raised inside a render when a newer edit has replaced the one being rendered"""
+
+
+class PreviewSession:
+    def __init__(self, session_id, registry):
+        self.session_id = session_id
+        self.registry = registry
+        self.condition = threading.Condition()
+        self.version = 0
+        self.pending = None
+        self.last_edit = 0.0
+        self.last_active = time.monotonic()
+        self.frame = None
+        self.frame_version = 0
+        self.rendered_fields = None
+        self.listeners = 0
+        self.closed = False
+        # Scratch space for the render function, e.g. the last QR matrix
+        self.cache = {}
+        self._thread = threading.Thread(target=self._run, name=f"live-preview-{session_id}", daemon=True)
+        self._thread.start()
+
+    def submit(self, fields):
+        """Record an edit and return its version, or None if the session has closed
+
+        A pending edit that has not started rendering yet is simply replaced.
+        """
+        with self.condition:
+            if self.closed:
+                return None
+            self.version += 1
+            self.pending = (self.version, fields)
+            self.last_edit = self.last_active = time.monotonic()
+            self.condition.notify_all()
+            return self.version
+
+    def check(self, version):
+        """Raise Superseded if a newer edit has arrived since version"""
+        if self.version != version or self.closed:
+            raise Superseded()
+
+    def next_frame(self, after_version, timeout):
+        """Wait for a frame newer than after_version; returns (version, frame) or None on timeout"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.last_active = time.monotonic()
+            while self.frame_version <= after_version and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            if self.closed:
+                return None
+            return self.frame_version, self.frame
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def _next_edit(self):
+        """Wait until the form has been quiet for the debounce interval and take the latest edit"""
+        debounce = self.registry.debounce_seconds
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                if self.pending is None:
+                    idle = now - self.last_active
+                    if idle >= self.registry.idle_seconds and self.listeners == 0:
+                        self.closed = True
+                        return None
+                    self.condition.wait(self.registry.idle_seconds - idle if self.listeners == 0 else None)
+                    continue
+                quiet = now - self.last_edit
+                if quiet < debounce:
+                    self.condition.wait(debounce - quiet)
+                    continue
+                edit, self.pending = self.pending, None
+                return edit
+            return None
+
+    def _run(self):
+        scheduler.set_priority('interactive')
+        try:
+            while True:
+                edit = self._next_edit()
+                if edit is None:
+                    return
+                self._render(*edit)
+        finally:
+            self.registry.remove(self)
+
+    def _render(self, version, fields):
+        if fields == self.rendered_fields:
+            # e.g. an edit that was undone before the debounce expired
+            metrics.LIVE_PREVIEW_FRAMES.inc(outcome='unchanged')
+            return
+        try:
+            with self.registry.render_slots:
+                self.check(version)
+                frame = self.registry.render(fields, lambda: self.check(version), self.cache)
+            self.check(version)
+        except Superseded:
+            metrics.LIVE_PREVIEW_FRAMES.inc(outcome='superseded')
+            return
+        except Exception as e:
+            logger.warning("Live preview render failed session=%s: %s", self.session_id, e)
+            metrics.LIVE_PREVIEW_FRAMES.inc(outcome='error')
+            frame = {'error': str(e)}
+
+        with self.condition:
+            if version != self.version:
+                metrics.LIVE_PREVIEW_FRAMES.inc(outcome='superseded')
+                return
+            self.frame = dict(frame, version=version)
+            self.frame_version = version
+            self.rendered_fields = fields
+            self.condition.notify_all()
+        metrics.LIVE_PREVIEW_FRAMES.inc(outcome='sent')
+
+
+class LivePreviews:
+    """Registry of live preview sessions sharing a bounded number of render slots
+
+    render(fields, check, cache) returns a JSON-serializable frame and should
+    call check() between expensive stages so superseded renders stop early.
+    """
+
+    def __init__(self, render, debounce_seconds=None, max_renders=None, max_sessions=None, idle_seconds=None):
+        self.render = render
+        self.debounce_seconds = (debounce_seconds if debounce_seconds is not None
+                                 else config.LIVE_PREVIEW_DEBOUNCE_MS / 1000)
+        self.render_slots = threading.BoundedSemaphore(max_renders or config.LIVE_PREVIEW_MAX_RENDERS)
+        self.max_sessions = max_sessions or config.LIVE_PREVIEW_MAX_SESSIONS
+        self.idle_seconds = idle_seconds or config.LIVE_PREVIEW_IDLE_SECONDS
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, session_id):
+        """Return the session for session_id, creating it; None if the session limit is reached"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.closed:
+                if len(self._sessions) >= self.max_sessions:
+                    return None
+                session = self._sessions[session_id] = PreviewSession(session_id, self)
+                metrics.LIVE_PREVIEW_SESSIONS.set(len(self._sessions))
+            return session
+
+    def submit(self, session_id, fields):
+        """Queue an edit for session_id and return its version; None if the session limit is reached"""
+        while True:
+            session = self.session(session_id)
+            if session is None:
+                return None
+            version = session.submit(fields)
+            # None means the session timed out just now; the next lookup opens a new one
+            if version is not None:
+                return version
+
+    def remove(self, session):
+        session.close()
+        with self._lock:
+            if self._sessions.get(session.session_id) is session:
+                del self._sessions[session.session_id]
+            metrics.LIVE_PREVIEW_SESSIONS.set(len(self._sessions))
+
+    def listen(self, session, keepalive_seconds=15):
+        """Yield server-sent events carrying each new frame of session until the client goes away"""
+        with session.condition:
+            session.listeners += 1
+        try:
+            seen = 0
+            yield 'retry: 1000\n\n'
+            while not session.closed:
+                update = session.next_frame(seen, keepalive_seconds)
+                if update is None:
+                    yield ': keepalive\n\n'
+                    continue
+                seen, frame = update
+                event = 'error' if 'error' in frame else 'frame'
+                yield f"event: {event}\nid: {seen}\ndata: {json.dumps(frame, separators=(',', ':'))}\n\n"
+        finally:
+            with session.condition:
+                session.listeners -= 1
+                session.last_active = time.monotonic()
+                session.condition.notify_all()
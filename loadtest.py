@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Load generator for the whisky label service
+
+Drives the label endpoints (single, preview, custom, QL-820NWB, batch) at a
+fixed concurrency and reports throughput, latency percentiles, status codes
+and responses that failed validation.  Every response is checked against its
+request (content type, image signature, whisky ID, batch entry count), so
+concurrency bugs that mix up or drop labels show up as validation errors.
+
+Usage: python loadtest.py --url http://127.0.0.1:5000 --concurrency 16 --requests 500
+       python loadtest.py --with-stub --with-app --latency-ms 150 --duration 30
+"""
+
+import argparse
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import stub_whiskybase
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+BATCH_SIZE = 5
+DEFAULT_MIX = {'single': 3, 'preview': 2, 'custom': 2, 'ql': 2, 'batch': 1}
+
+
+def _expect_png(response, whisky_id):
+    if not response.content.startswith(PNG_SIGNATURE):
+        return "response is not a PNG"
+    return None
+
+
+def _expect_whisky(response, whisky_id):
+    body = response.json()
+    returned_id = body.get('whisky', body).get('id')
+    if returned_id != whisky_id:
+        return f"asked for whisky {whisky_id}, got {returned_id}"
+    return None
+
+
+def _expect_batch(response, whisky_id):
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        names = archive.namelist()
+    expected = {f"whisky_{whisky_id + offset}_" for offset in range(BATCH_SIZE)}
+    found = {name[:name.index('_', len('whisky_')) + 1] for name in names}
+    if found != expected:
+        return f"batch returned {len(names)} label(s) for {BATCH_SIZE} IDs"
+    return None
+
+
+SCENARIOS = {
+    'single': ('GET', lambda whisky_id, n: (f"/api/label/{whisky_id}?dpi=72", None), _expect_png),
+    'preview': ('GET', lambda whisky_id, n: (f"/api/preview/{whisky_id}?dpi=72", None), _expect_whisky),
+    'whisky': ('GET', lambda whisky_id, n: (f"/api/whisky/{whisky_id}", None), _expect_whisky),
+    'custom': ('POST', lambda whisky_id, n: ("/api/custom-label", {
+        'name': f"Cask Sample {n}", 'distillery': 'Load Test', 'abv': '55.5%', 'id': whisky_id
+    }), _expect_png),
+    'ql': ('GET', lambda whisky_id, n: (f"/api/ql820nwb/{whisky_id}?size=medium", None), _expect_png),
+    'batch': ('POST', lambda whisky_id, n: ("/api/batch-labels", {
+        'whisky_ids': [whisky_id + offset for offset in range(BATCH_SIZE)], 'dpi': 72
+    }), _expect_batch),
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LoadTest:
+    def __init__(self, base_url, mix, whisky_ids, concurrency=8, total_requests=None, duration=None, timeout=60, seed=None):
+        self.base_url = base_url.rstrip('/')
+        self.scenarios = [name for name, weight in mix.items() for _ in range(weight)]
+        self.whisky_ids = whisky_ids
+        self.concurrency = concurrency
+        self.total_requests = total_requests
+        self.duration = duration
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.results = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _next_request(self, deadline):
+        with self._lock:
+            n = next(self._counter)
+            if self.total_requests is not None and n >= self.total_requests:
+                return None
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            return n, self.random.choice(self.scenarios), self.random.choice(self.whisky_ids)
+
+    def _worker(self, deadline):
+        while True:
+            job = self._next_request(deadline)
+            if job is None:
+                return
+            n, scenario, whisky_id = job
+            method, build, validate = SCENARIOS[scenario]
+            path, body = build(whisky_id, n)
+            error = None
+            status = None
+            started = time.perf_counter()
+            try:
+                response = self._session().request(method, self.base_url + path, json=body, timeout=self.timeout)
+                status = response.status_code
+                if status == 200:
+                    error = validate(response, whisky_id)
+            except (requests.RequestException, ValueError, zipfile.BadZipFile) as e:
+                error = f"{type(e).__name__}: {e}"
+            latency = time.perf_counter() - started
+            with self._lock:
+                self.results.append({'scenario': scenario, 'status': status, 'latency': latency, 'error': error})
+
+    def run(self):
+        deadline = time.perf_counter() + self.duration if self.duration else None
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for future in [executor.submit(self._worker, deadline) for _ in range(self.concurrency)]:
+                future.result()
+        return summarize(self.results, time.perf_counter() - started)
+
+
+def summarize(results, elapsed):
+    """Aggregate per-request results into throughput, latency percentiles and error counts"""
+    summary = {
+        'requests': len(results),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(results) / elapsed if elapsed > 0 else 0.0,
+        'statuses': {},
+        'scenarios': {},
+        'validation_errors': [],
+    }
+    for result in results:
+        status = str(result['status'] or 'error')
+        summary['statuses'][status] = summary['statuses'].get(status, 0) + 1
+        if result['error'] and len(summary['validation_errors']) < 20:
+            summary['validation_errors'].append(f"{result['scenario']}: {result['error']}")
+
+    for scenario in sorted({result['scenario'] for result in results}):
+        scenario_results = [result for result in results if result['scenario'] == scenario]
+        latencies = [result['latency'] for result in scenario_results]
+        summary['scenarios'][scenario] = {
+            'requests': len(scenario_results),
+            'errors': sum(1 for result in scenario_results if result['status'] != 200 or result['error']),
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p90_ms': percentile(latencies, 0.90) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': max(latencies) * 1000,
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"{summary['requests']} requests in {summary['elapsed_s']:.1f}s "
+          f"({summary['throughput_rps']:.1f} req/s)")
+    print(f"{'scenario':<10} {'requests':>8} {'errors':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, stats in summary['scenarios'].items():
+        print(f"{name:<10} {stats['requests']:>8} {stats['errors']:>7} "
+              f"{stats['p50_ms']:>7.1f}ms {stats['p90_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms {stats['max_ms']:>7.1f}ms")
+    print(f"Status codes: {dict(sorted(summary['statuses'].items()))}")
+    for error in summary['validation_errors']:
+        print(f"  {error}")
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition(':')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def parse_ids(value):
+    whisky_ids = []
+    for item in value.split(','):
+        start, _, end = item.partition('-')
+        whisky_ids.extend(range(int(start), int(end or start) + 1))
+    return whisky_ids
+
+
+def isolate_app_stores(workdir):
+    """Point the app's search index, metadata store, photo cache, artifact store
+    and job queue at new ones in workdir, so test runs never touch the real ones"""
+    import app as app_module
+    from artifact_store import ArtifactStore
+    from job_queue import SqliteJobQueue
+    from metadata_store import SqliteMetadataStore
+    from photo_cache import PhotoCache
+    from whisky_index import WhiskyIndex
+
+    app_module.generator.search_index = WhiskyIndex(os.path.join(workdir, 'whisky_index.db'))
+    app_module.generator.metadata_store = SqliteMetadataStore(os.path.join(workdir, 'whisky_metadata.db'))
+    app_module.generator.photo_cache = PhotoCache(os.path.join(workdir, 'photo_cache'))
+    app_module.job_queue = SqliteJobQueue(os.path.join(workdir, 'whisky_jobs.db'))
+    app_module.artifacts = ArtifactStore(os.path.join(workdir, 'artifacts'), background_gc=False,
+                                         pinned=app_module._job_artifacts)
+    return app_module
+
+
+def start_app_server(workdir=None):
+    """Serve the Flask app from a background thread on a free port and return the server
+
+    The app's stores are replaced by ones in workdir (a new temporary directory
+    by default; see isolate_app_stores), so load-test records never reach the
+    real caches.
+    """
+    from werkzeug.serving import make_server
+
+    app_module = isolate_app_stores(workdir or tempfile.mkdtemp(prefix='whisky_load_'))
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-app', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the label endpoints at a fixed concurrency")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="Base URL of the label service")
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-n', '--requests', type=int, help="Total requests to send (default: 200 unless --duration)")
+    parser.add_argument('-d', '--duration', type=float, help="Send requests for this many seconds")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="Scenario weights, e.g. single:3,custom:1 (scenarios: %s)" % ', '.join(SCENARIOS))
+    parser.add_argument('--ids', type=parse_ids, help="Whisky IDs to use, e.g. 1-500,12345 (default: fixture IDs)")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--with-stub', action='store_true', help="Start a local WhiskyBase stub and point the app at it")
+    parser.add_argument('--with-app', action='store_true', help="Serve the app in-process instead of using --url")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    stub_whiskybase.add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    whisky_ids = args.ids or sorted(stub_whiskybase.load_fixtures())
+    if args.with_stub:
+        stub = stub_whiskybase.start_stub_server(settings=stub_whiskybase.settings_from_args(args))
+        os.environ['WHISKYBASE_BASE_URL'] = stub.base_url
+        os.environ['WHISKYBASE_API_BASE_URL'] = stub.base_url
+        print(f"WhiskyBase stub on {stub.base_url}", file=sys.stderr)
+    base_url = f"http://127.0.0.1:{start_app_server().server_port}" if args.with_app else args.url
+
+    total_requests = args.requests if args.requests or args.duration else 200
+    load_test = LoadTest(base_url, args.mix, whisky_ids, args.concurrency, total_requests, args.duration,
+                         args.timeout, args.seed)
+    summary = load_test.run()
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    if args.with_stub:
+        print(f"Stub responses by status: {stub.counts}", file=sys.stderr)
+    failed = sum(stats['errors'] for stats in summary['scenarios'].values())
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Persistent whisky metadata shared by every worker process and CLI run
+
+Parsed WhiskyBase records are kept in a store that all processes on a host
+(or, with Redis, a fleet) read and write, so a lookup made by one worker is a
+cache hit for every other worker and survives restarts.  The default backend
+is an embedded SQLite database in WAL mode; set METADATA_STORE_URL to
+redis://host:port/db to use a Redis-compatible server instead.
+
+Records are stored as zlib-compressed compact JSON with an expiry time, and
+writes are atomic upserts.  Expired records are kept for another
+METADATA_STALE_SECONDS, so OVERLOAD_MODE=stale has something to serve, and
+then removed.  The schema version is recorded in the store and older schemas
+are migrated (SQLite) or ignored until they expire (Redis).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+import config
+
+logger = logging.getLogger('whisky_label.metadata')
+
+SCHEMA_VERSION = 1
+
+# Fields derived from the ID on read, so they are not stored
+DERIVED_FIELDS = ('id', 'url')
+# Writers remove records past their stale window at most this often
+PURGE_INTERVAL_SECONDS = 3600
+
+
+def stale_seconds():
+    """How long an expired record is kept as a fallback for overload"""
+    return int(os.getenv('METADATA_STALE_SECONDS', config.METADATA_STALE_SECONDS))
+
+
+def encode_record(whisky_info):
+    """Serialize a whisky record compactly"""
+    record = {key: value for key, value in whisky_info.items() if key not in DERIVED_FIELDS and value not in (None, '')}
+    return zlib.compress(json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+
+def decode_record(whisky_id, data):
+    record = json.loads(zlib.decompress(data).decode('utf-8'))
+    record.setdefault('image_url', None)
+    for field in ('name', 'distillery', 'bottler', 'abv', 'age', 'region', 'note'):
+        record.setdefault(field, '')
+    record['id'] = whisky_id
+    record['url'] = f"{os.getenv('WHISKYBASE_BASE_URL', 'https://www.whiskybase.com')}/whisky/{whisky_id}"
+    return record
+
+
+class SqliteMetadataStore:
+    """Metadata store in an SQLite database shared through WAL mode"""
+
+    # Each entry upgrades the schema from the previous version
+    MIGRATIONS = {
+        1: """
+        CREATE TABLE IF NOT EXISTS whisky_metadata (
+            id INTEGER PRIMARY KEY,
+            record BLOB NOT NULL,
+            fetched_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS whisky_metadata_expires ON whisky_metadata (expires_at);
+        """,
+    }
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._migrated = False
+        self._migrate_lock = threading.Lock()
+        self._next_purge = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with self._migrate_lock:
+                if not self._migrated:
+                    self._migrate(connection)
+                    self._migrated = True
+            self._local.connection = connection
+        return connection
+
+    def _migrate(self, connection):
+        # BEGIN IMMEDIATE serializes migrations between processes opening the store together
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS schema_info (version INTEGER NOT NULL)')
+            row = connection.execute('SELECT version FROM schema_info').fetchone()
+            version = row[0] if row else 0
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(f"Metadata store {self.db_path} has schema {version}, newer than {SCHEMA_VERSION}")
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                for statement in self.MIGRATIONS[target].split(';'):
+                    if statement.strip():
+                        connection.execute(statement)
+                logger.info("Migrated metadata store %s to schema %d", self.db_path, target)
+            if row is None:
+                connection.execute('INSERT INTO schema_info (version) VALUES (?)', (SCHEMA_VERSION,))
+            else:
+                connection.execute('UPDATE schema_info SET version = ?', (SCHEMA_VERSION,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def schema_version(self):
+        return self._connection().execute('SELECT version FROM schema_info').fetchone()[0]
+
+    def get(self, whisky_id, allow_expired=False):
+        """Return the stored record for whisky_id, or None if missing or (unless allow_expired) expired"""
+        not_before = 0 if allow_expired else time.time()
+        row = self._connection().execute(
+            'SELECT record FROM whisky_metadata WHERE id = ? AND expires_at > ?', (int(whisky_id), not_before)
+        ).fetchone()
+        return decode_record(int(whisky_id), row[0]) if row else None
+
+    def put(self, whisky_info, ttl_seconds):
+        """Insert or replace the record for whisky_info['id'] in one atomic statement"""
+        now = time.time()
+        self._connection().execute(
+            """
+            INSERT INTO whisky_metadata (id, record, fetched_at, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                record = excluded.record, fetched_at = excluded.fetched_at, expires_at = excluded.expires_at
+            """,
+            (int(whisky_info['id']), encode_record(whisky_info), now, now + ttl_seconds)
+        )
+        if now >= self._next_purge:
+            self._next_purge = now + PURGE_INTERVAL_SECONDS
+            self.purge_expired()
+
+    def purge_expired(self, keep_stale_seconds=None):
+        """Delete records expired for longer than the stale window; returns the number removed"""
+        if keep_stale_seconds is None:
+            keep_stale_seconds = stale_seconds()
+        cursor = self._connection().execute(
+            'DELETE FROM whisky_metadata WHERE expires_at <= ?', (time.time() - keep_stale_seconds,)
+        )
+        if cursor.rowcount:
+            logger.info("Purged %d expired metadata record(s)", cursor.rowcount)
+        return cursor.rowcount
+
+
+class RedisMetadataStore:
+    """Metadata store in a Redis-compatible server
+
+    Each value is the record's expiry time (a big-endian double) followed by
+    the record; the key itself expires at the end of the stale window, so
+    Redis removes old records without a purge.
+    """
+
+    EXPIRY = struct.Struct('>d')
+
+    def __init__(self, url=None, client=None, prefix='whisky:metadata'):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("METADATA_STORE_URL uses redis:// but the redis package is not installed")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        # Keys carry the schema version, so records written by another schema are never read
+        self.prefix = f"{prefix}:v{SCHEMA_VERSION}"
+        self.client.set(f"{prefix}:schema_version", SCHEMA_VERSION)
+
+    def _key(self, whisky_id):
+        return f"{self.prefix}:{int(whisky_id)}"
+
+    def schema_version(self):
+        return SCHEMA_VERSION
+
+    def get(self, whisky_id, allow_expired=False):
+        data = self.client.get(self._key(whisky_id))
+        if data is None:
+            return None
+        expires_at, = self.EXPIRY.unpack_from(data)
+        if not allow_expired and expires_at <= time.time():
+            return None
+        return decode_record(int(whisky_id), data[self.EXPIRY.size:])
+
+    def put(self, whisky_info, ttl_seconds):
+        data = self.EXPIRY.pack(time.time() + ttl_seconds) + encode_record(whisky_info)
+        self.client.set(self._key(whisky_info['id']), data, ex=max(1, int(ttl_seconds + stale_seconds())))
+
+    def purge_expired(self, keep_stale_seconds=None):
+        return 0  # Redis expires keys itself at the end of the stale window
+
+
+def open_metadata_store(url=None):
+    """Open the store named by url or METADATA_STORE_URL (a SQLite path or redis:// URL)"""
+    url = url or os.getenv('METADATA_STORE_URL', config.METADATA_STORE_URL)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisMetadataStore(url)
+    if url.startswith('sqlite:///'):
+        url = url[len('sqlite:///'):]
+    return SqliteMetadataStore(url)
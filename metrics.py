@@ -0,0 +1,308 @@
+"""
+Prometheus-format metrics for the whisky label service
+
+A small in-process registry of counters, gauges and histograms rendered in the
+Prometheus text exposition format by the /metrics endpoint.  Every label
+pipeline stage (browser launch, session warm-up, API call, parse, QR build,
+render, encode, response) is timed through stage() or observe_stage(), and
+the durations of the current request are collected for its Server-Timing
+header.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 10000)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Cumulative bucketed observations with a running sum and count"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state['count'] if state else 0
+
+    def _render_sample(self, key, state):
+        lines = []
+        for bound, count in zip(self.buckets, state['buckets']):
+            labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = Histogram(
+    'whisky_stage_duration_seconds',
+    'Duration of each label pipeline stage in seconds',
+    ['stage']
+)
+REQUEST_SECONDS = Histogram(
+    'whisky_http_request_duration_seconds',
+    'Duration of HTTP requests in seconds',
+    ['endpoint', 'status']
+)
+UPSTREAM_RESPONSES = Counter(
+    'whisky_upstream_responses_total',
+    'WhiskyBase API responses by HTTP status code',
+    ['status']
+)
+FALLBACK_TOTAL = Counter(
+    'whisky_fallback_total',
+    'Lookups answered with fallback data, by reason',
+    ['reason']
+)
+CACHE_EVENTS = Counter(
+    'whisky_cache_events_total',
+    'Cache hits, misses and evictions',
+    ['cache', 'event']
+)
+BATCH_SIZE = Histogram(
+    'whisky_batch_size',
+    'Number of labels requested per batch',
+    buckets=BATCH_SIZE_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'whisky_requests_in_flight',
+    'HTTP requests currently being served'
+)
+ARTIFACT_BYTES = Gauge(
+    'whisky_artifact_store_bytes',
+    'Bytes held in the artifact store after the last garbage collection'
+)
+BROWSER_SESSIONS = Gauge(
+    'whisky_browser_sessions_open',
+    'Headless browser sessions currently open (browser pool occupancy)'
+)
+
+LIVE_PREVIEW_FRAMES = Counter(
+    'whisky_live_preview_frames_total',
+    'Live preview renders by outcome (sent, superseded, unchanged, error)',
+    ['outcome']
+)
+LIVE_PREVIEW_SESSIONS = Gauge(
+    'whisky_live_preview_sessions',
+    'Live preview sessions currently open'
+)
+SCHEDULER_QUEUED = Gauge(
+    'whisky_scheduler_queued',
+    'Work waiting for a fetch or render slot, by priority class',
+    ['resource', 'priority']
+)
+SCHEDULER_IN_USE = Gauge(
+    'whisky_scheduler_slots_in_use',
+    'Fetch (browser session) and render slots currently held',
+    ['resource']
+)
+ADMISSION_REJECTED = Counter(
+    'whisky_admission_rejected_total',
+    'Work refused because a scheduler queue was full or the wait timed out',
+    ['resource', 'priority']
+)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    'whisky_scheduler_wait_seconds',
+    'Time spent waiting for a fetch or render slot, by priority class',
+    ['resource', 'priority']
+)
+
+JOB_ITEMS = Counter(
+    'whisky_job_items_total',
+    'Batch job items processed by this worker, by outcome (done, duplicate, retried, failed, deferred)',
+    ['outcome']
+)
+JOB_ITEM_SECONDS = Histogram(
+    'whisky_job_item_seconds',
+    'Time a worker spent fetching, rendering and storing one batch job item'
+)
+
+
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def observe_stage(stage_name, seconds):
+    """Record the duration of one pipeline stage"""
+    STAGE_SECONDS.observe(seconds, stage=stage_name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((stage_name, seconds))
+
+
+def start_request_timing():
+    """Collect stage durations observed in this context until reset"""
+    return _request_stages.set([])
+
+
+def request_stages():
+    """Return the (stage, seconds) pairs observed since start_request_timing"""
+    return _request_stages.get() or []
+
+
+def finish_request_timing(token):
+    """Stop collecting stage durations for this context"""
+    _request_stages.reset(token)
+
+
+def server_timing_header(stages, total_seconds=None):
+    """Format stage durations as a Server-Timing header value"""
+    totals = {}
+    for stage_name, seconds in stages:
+        totals[stage_name] = totals.get(stage_name, 0.0) + seconds
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ', '.join(entries)
+
+
+@contextmanager
+def stage(stage_name):
+    """Time the enclosed block as one pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage_name, time.perf_counter() - started)
+
+
+def render():
+    """Render every registered metric in the Prometheus text format"""
+    return REGISTRY.render()
@@ -0,0 +1,225 @@
+"""
+On-disk cache for WhiskyBase bottle photos
+
+Each photo is downloaded once and revalidated with a conditional GET once it
+is older than the refresh interval.  Downscaled thumbnails are stored per
+target size, together with 1-bit dithered variants for thermal printing, so a
+photo label never downloads or resizes the full-size image on every render.
+The cache evicts least recently used files once it grows past its size quota.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import config
+import metrics
+
+logger = logging.getLogger('whisky_label.photo_cache')
+
+
+class PhotoCache:
+    def __init__(self, cache_dir=None, max_bytes=None, refresh_seconds=None, timeout=None, session=None):
+        self.cache_dir = cache_dir or os.getenv('PHOTO_CACHE_DIR', config.PHOTO_CACHE_DIR)
+        self.max_bytes = max_bytes or int(os.getenv('PHOTO_CACHE_MAX_BYTES', config.PHOTO_CACHE_MAX_BYTES))
+        self.refresh_seconds = refresh_seconds or int(os.getenv('PHOTO_CACHE_REFRESH_SECONDS', config.PHOTO_CACHE_REFRESH_SECONDS))
+        self.timeout = timeout or int(os.getenv('TIMEOUT_SECONDS', 15))
+        self._session = session
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._total_bytes = None
+
+    @property
+    def session(self):
+        # requests is only imported once a photo actually has to be downloaded
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _url_lock(self, key):
+        with self._lock:
+            return self._url_locks.setdefault(key, threading.Lock())
+
+    def get_original(self, url, refresh=False):
+        """Return the local path of the full-size photo, downloading it if needed"""
+        key = self._key(url)
+        original_path = self._path(f"{key}.img")
+        meta_path = self._path(f"{key}.json")
+
+        with self._url_lock(key):
+            meta = None
+            if os.path.exists(original_path) and os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                if not refresh and time.time() - meta.get('checked_at', 0) < self.refresh_seconds:
+                    metrics.CACHE_EVENTS.inc(cache='photo', event='hit')
+                    return original_path
+
+            headers = {}
+            if meta:
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+
+            import requests
+
+            try:
+                with metrics.stage('photo_fetch'):
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning("Photo download failed url=%s: %s", url, e)
+                return original_path if meta else None
+
+            if response.status_code == 304 and meta:
+                metrics.CACHE_EVENTS.inc(cache='photo', event='revalidated')
+                meta['checked_at'] = time.time()
+                self._write_json(meta_path, meta)
+                return original_path
+
+            if response.status_code != 200:
+                logger.warning("Photo download failed url=%s status=%s", url, response.status_code)
+                return original_path if meta else None
+
+            metrics.CACHE_EVENTS.inc(cache='photo', event='miss')
+            if meta:
+                # The photo changed upstream, so every derived thumbnail is stale
+                self._remove_variants(key)
+            self._write_bytes(original_path, response.content)
+            self._write_json(meta_path, {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'checked_at': time.time()
+            })
+        self._enforce_quota()
+        return original_path
+
+    def get_thumbnail(self, url, size, dithered=False):
+        """Return the photo downscaled to fit size (width, height), or None if unavailable"""
+        from PIL import Image
+
+        original_path = self.get_original(url)
+        if original_path is None:
+            return None
+
+        width, height = size
+        key = self._key(url)
+        suffix = '_1bit' if dithered else ''
+        thumb_path = self._path(f"{key}_{width}x{height}{suffix}.png")
+
+        if os.path.exists(thumb_path):
+            metrics.CACHE_EVENTS.inc(cache='photo_thumbnail', event='hit')
+            os.utime(thumb_path)
+            with Image.open(thumb_path) as thumb:
+                thumb.load()
+                return thumb
+
+        metrics.CACHE_EVENTS.inc(cache='photo_thumbnail', event='miss')
+        try:
+            with metrics.stage('photo_resize'):
+                with Image.open(original_path) as photo:
+                    # Let the JPEG decoder downscale while decoding where it can
+                    photo.draft('RGB', (width, height))
+                    thumb = self._flatten(photo)
+                thumb.thumbnail((width, height), Image.LANCZOS)
+                if dithered:
+                    # Floyd-Steinberg dithering keeps tonal detail on 1-bit thermal heads
+                    thumb = thumb.convert('L').convert('1')
+        except (OSError, ValueError) as e:
+            logger.warning("Photo could not be decoded url=%s: %s", url, e)
+            return None
+
+        self._write_image(thumb_path, thumb)
+        self._enforce_quota()
+        return thumb
+
+    def _flatten(self, photo):
+        """Composite transparent photos onto white so they print cleanly"""
+        from PIL import Image
+
+        if photo.mode in ('RGBA', 'LA') or (photo.mode == 'P' and 'transparency' in photo.info):
+            photo = photo.convert('RGBA')
+            background = Image.new('RGB', photo.size, 'white')
+            background.paste(photo, mask=photo.split()[-1])
+            return background
+        return photo.convert('RGB')
+
+    def _remove_variants(self, key):
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(f"{key}_"):
+                self._remove(self._path(name))
+
+    def _write_bytes(self, path, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        self._replace(temp_path, path)
+
+    def _write_json(self, path, data):
+        self._write_bytes(path, json.dumps(data).encode('utf-8'))
+
+    def _write_image(self, path, image):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        image.save(temp_path, 'PNG', optimize=True)
+        self._replace(temp_path, path)
+
+    def _replace(self, temp_path, path):
+        new_size = os.path.getsize(temp_path)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += new_size - old_size
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            stat = os.stat(self._path(name))
+            entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, name))
+        return entries
+
+    def _enforce_quota(self):
+        """Evict least recently used files until the cache fits its quota"""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan()) if os.path.isdir(self.cache_dir) else 0
+            if self._total_bytes <= self.max_bytes:
+                return
+            entries = sorted(self._scan())
+
+        for _, _, name in entries:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes:
+                    return
+            if name.endswith('.img'):
+                # An original without its metadata would never be revalidated
+                self._remove(self._path(name[:-len('.img')] + '.json'))
+            elif name.endswith('.json'):
+                continue
+            self._remove(self._path(name))
+            metrics.CACHE_EVENTS.inc(cache='photo', event='eviction')
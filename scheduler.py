@@ -0,0 +1,228 @@
+"""
+Priority scheduling of upstream fetches and label rendering
+
+Work runs in one of three priority classes: interactive (previews, search,
+the live preview), print (single labels for printing) and bulk (batch
+runs and warm-up).  Each resource (fetch, render) has a fixed number of
+slots; a class may hold at most its share of them, so bulk work always
+leaves room for interactive requests.  Free slots go to the highest
+priority class that is waiting, except that a class passed over
+SCHEDULER_FAIR_SHARE_EVERY times in a row is served next, so queued bulk
+work still makes steady progress instead of starving.
+
+Queues are bounded per class (SCHEDULER_MAX_QUEUED) and interactive and
+print work waits at most SCHEDULER_QUEUE_TIMEOUT_SECONDS; beyond that work
+is refused with Overloaded, which the app answers with 503 and a
+Retry-After estimated from the queue length and recent slot hold times.
+Every fetch may launch a headless browser, so the fetch slots are also the
+limit on concurrent browser sessions (MAX_BROWSER_SESSIONS).
+
+The priority of the current request is kept in a context variable, set by
+the app per endpoint; code that fetches or renders just wraps the work in
+slot('fetch') or slot('render').
+"""
+
+import collections
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+import metrics
+
+PRIORITIES = ('interactive', 'print', 'bulk')
+DEFAULT_PRIORITY = 'print'
+
+_priority = contextvars.ContextVar('priority', default=DEFAULT_PRIORITY)
+# Resources whose slot this context already holds, so nested use does not deadlock
+_held = contextvars.ContextVar('held_resources', default=frozenset())
+
+
+class Overloaded(Exception):
+    """Work refused because the queue for a resource is full or the wait timed out"""
+
+    def __init__(self, resource, priority, retry_after):
+        super().__init__(f"{resource} queue for {priority} work is full")
+        self.resource = resource
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+def current_priority():
+    return _priority.get()
+
+
+def set_priority(priority):
+    """Run the rest of this context at priority; returns a token for reset_priority"""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {priority!r}; choose from {', '.join(PRIORITIES)}")
+    return _priority.set(priority)
+
+
+def reset_priority(token):
+    _priority.reset(token)
+
+
+def holds(resource):
+    """True if the current context already holds a slot of resource"""
+    return resource in _held.get()
+
+
+def copy_context():
+    """Copy the current context for work run on another thread
+
+    The copy keeps the priority but not the slots held here: those cover this
+    thread only, so concurrent work must acquire its own.
+    """
+    context = contextvars.copy_context()
+    context.run(_held.set, frozenset())
+    return context
+
+
+class ResourceScheduler:
+    def __init__(self, name, slots, shares=None, fair_share_every=None, max_queued=None, queue_timeouts=None):
+        self.name = name
+        self.slots = slots
+        shares = shares or config.SCHEDULER_CLASS_SHARE
+        self.limits = {priority: max(1, int(slots * shares[priority])) for priority in PRIORITIES}
+        self.fair_share_every = fair_share_every or config.SCHEDULER_FAIR_SHARE_EVERY
+        self.max_queued = max_queued or config.SCHEDULER_MAX_QUEUED
+        self.queue_timeouts = queue_timeouts or config.SCHEDULER_QUEUE_TIMEOUT_SECONDS
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self._hold_seconds = 1.0
+        self._lock = threading.Lock()
+        self._queues = {priority: collections.deque() for priority in PRIORITIES}
+        self._running = {priority: 0 for priority in PRIORITIES}
+        self._passed_over = {priority: 0 for priority in PRIORITIES}
+        self._in_use = 0
+
+    @contextmanager
+    def slot(self, priority=None):
+        """Hold one slot of this resource for the enclosed block"""
+        if self.name in _held.get():
+            yield
+            return
+        priority = priority or current_priority()
+        acquired_at = self.acquire(priority)
+        token = _held.set(_held.get() | {self.name})
+        try:
+            yield
+        finally:
+            _held.reset(token)
+            self.release(priority, acquired_at)
+
+    def admit(self, priority=None):
+        """Raise Overloaded if new work of this class would be refused right now"""
+        priority = priority or current_priority()
+        with self._lock:
+            self._check_queue(priority)
+
+    def _check_queue(self, priority):
+        if len(self._queues[priority]) >= self.max_queued[priority]:
+            metrics.ADMISSION_REJECTED.inc(resource=self.name, priority=priority)
+            raise Overloaded(self.name, priority, self._retry_after())
+
+    def _retry_after(self):
+        queued = sum(len(queue) for queue in self._queues.values())
+        return min(60, max(1, math.ceil(self._hold_seconds * (queued + 1) / self.slots)))
+
+    def acquire(self, priority):
+        started = time.perf_counter()
+        waiter = threading.Event()
+        with self._lock:
+            self._check_queue(priority)
+            self._queues[priority].append(waiter)
+            metrics.SCHEDULER_QUEUED.inc(resource=self.name, priority=priority)
+            self._dispatch()
+        if not waiter.wait(self.queue_timeouts[priority]):
+            with self._lock:
+                # The slot may have been granted between the timeout and taking the lock
+                if not waiter.is_set():
+                    self._queues[priority].remove(waiter)
+                    metrics.SCHEDULER_QUEUED.dec(resource=self.name, priority=priority)
+                    metrics.ADMISSION_REJECTED.inc(resource=self.name, priority=priority)
+                    raise Overloaded(self.name, priority, self._retry_after())
+        metrics.SCHEDULER_WAIT_SECONDS.observe(time.perf_counter() - started, resource=self.name, priority=priority)
+        return time.perf_counter()
+
+    def release(self, priority, acquired_at=None):
+        with self._lock:
+            if acquired_at is not None:
+                self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * (time.perf_counter() - acquired_at)
+            self._running[priority] -= 1
+            self._in_use -= 1
+            metrics.SCHEDULER_IN_USE.set(self._in_use, resource=self.name)
+            self._dispatch()
+
+    def queued(self, priority=None):
+        """Number of waiters, for one class or all of them"""
+        with self._lock:
+            if priority is not None:
+                return len(self._queues[priority])
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _can_run(self, priority):
+        return self._in_use < self.slots and self._running[priority] < self.limits[priority]
+
+    def _next_class(self):
+        eligible = [priority for priority in PRIORITIES if self._queues[priority] and self._can_run(priority)]
+        if not eligible:
+            return None
+        chosen = eligible[0]
+        # Lowest priority first, so the class waiting longest behind the others wins ties
+        for priority in reversed(eligible):
+            if self._passed_over[priority] >= self.fair_share_every:
+                chosen = priority
+                break
+        for priority in eligible:
+            self._passed_over[priority] = 0 if priority == chosen else self._passed_over[priority] + 1
+        return chosen
+
+    def _dispatch(self):
+        """Hand free slots to waiters; called with the lock held"""
+        while True:
+            priority = self._next_class()
+            if priority is None:
+                return
+            waiter = self._queues[priority].popleft()
+            metrics.SCHEDULER_QUEUED.dec(resource=self.name, priority=priority)
+            self._running[priority] += 1
+            self._in_use += 1
+            metrics.SCHEDULER_IN_USE.set(self._in_use, resource=self.name)
+            waiter.set()
+
+
+# Environment variable / config name holding the slot count of each resource
+SLOT_SETTINGS = {'fetch': 'MAX_BROWSER_SESSIONS', 'render': 'RENDER_SLOTS'}
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def configured_slots(resource, default=None):
+    """Slot count of a resource from the environment, else default, else config"""
+    setting = SLOT_SETTINGS[resource]
+    return int(os.getenv(setting, default or getattr(config, setting)))
+
+
+def scheduler(resource):
+    """Return the process-wide scheduler for a resource ('fetch' or 'render')"""
+    with _schedulers_lock:
+        if resource not in _schedulers:
+            _schedulers[resource] = ResourceScheduler(resource, configured_slots(resource))
+        return _schedulers[resource]
+
+
+def configure(resource, slots, shares=None, max_queued=None):
+    """Replace the process-wide scheduler for a resource, e.g. in a process that only runs bulk work"""
+    with _schedulers_lock:
+        _schedulers[resource] = ResourceScheduler(resource, slots, shares, max_queued=max_queued)
+        return _schedulers[resource]
+
+
+def slot(resource, priority=None):
+    """Hold a slot of resource at the current (or given) priority for the enclosed block"""
+    return scheduler(resource).slot(priority)
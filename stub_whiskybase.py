@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for WhiskyBase, for load tests and offline development
+
+Serves the homepage, /whisky/{id} API JSON from the recorded payloads in
+fixtures/ and bottle photos, with configurable latency, server errors and
+429 rate limiting.  IDs without a fixture get a synthetic payload derived
+from one, so any ID range can be load tested.  Point the app at it with:
+
+    WHISKYBASE_BASE_URL=http://127.0.0.1:8001
+    WHISKYBASE_API_BASE_URL=http://127.0.0.1:8001
+
+Usage: python stub_whiskybase.py [--port 8001] [--latency-ms 150] [--error-rate 0.02] [--rate-limit-rate 0.05]
+"""
+
+import argparse
+import copy
+import glob
+import io
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+WHISKY_PATH = re.compile(r'^/whisky/(\d+)$')
+PHOTO_PATH = re.compile(r'^/photos/[\w.-]+\.(png|jpe?g)$')
+
+logger = logging.getLogger('whisky_label.stub')
+
+HOMEPAGE = b"""<!DOCTYPE html>
+<html><head><title>WhiskyBase (local stub)</title></head>
+<body><h1>WhiskyBase stand-in</h1></body></html>
+"""
+
+
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    """Load recorded API payloads keyed by whisky ID"""
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, 'whisky_*.json'))):
+        whisky_id = int(os.path.basename(path)[len('whisky_'):-len('.json')])
+        with open(path) as f:
+            fixtures[whisky_id] = json.load(f)
+    return fixtures
+
+
+class StubSettings:
+    """Fault injection settings, adjustable while the server runs"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def roll(self):
+        """Return (delay seconds, injected status or None) for one request"""
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+            delay = max(0.0, (self.latency_ms + jitter) / 1000)
+            draw = self.random.random()
+        if draw < self.rate_limit_rate:
+            return delay, 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return delay, 500
+        return delay, None
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, settings=None, fixtures=None):
+        super().__init__(address, StubHandler)
+        self.settings = settings or StubSettings()
+        self.fixtures = fixtures if fixtures is not None else load_fixtures()
+        self.counts = {}
+        self.counts_lock = threading.Lock()
+        self._photo = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, status):
+        with self.counts_lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def payload(self, whisky_id):
+        """Return the recorded payload for whisky_id, or a synthetic one derived from a fixture"""
+        if whisky_id in self.fixtures:
+            return self.fixtures[whisky_id]
+        template_id = sorted(self.fixtures)[whisky_id % len(self.fixtures)]
+        payload = copy.deepcopy(self.fixtures[template_id])
+        whisky = payload.get('whisky') or payload.get('data') or payload
+        whisky['id'] = whisky_id
+        whisky['name'] = f"{whisky.get('name', 'Whisky')} #{whisky_id}"
+        return payload
+
+    def photo(self):
+        if self._photo is None:
+            from PIL import Image
+            buffer = io.BytesIO()
+            Image.new('RGB', (300, 600), (150, 90, 40)).save(buffer, 'PNG')
+            self._photo = buffer.getvalue()
+        return self._photo
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        delay, injected = self.server.settings.roll()
+        if delay:
+            time.sleep(delay)
+
+        if path == '/':
+            return self._send(200, HOMEPAGE, 'text/html; charset=utf-8')
+        if PHOTO_PATH.match(path):
+            return self._send(200, self.server.photo(), 'image/png', {'ETag': '"stub-photo"'})
+
+        match = WHISKY_PATH.match(path)
+        if not match:
+            return self._send_json(404, {'error': 'Not found'})
+        if injected == 429:
+            return self._send_json(429, {'error': 'Too Many Requests'},
+                                   {'Retry-After': str(self.server.settings.retry_after)})
+        if injected == 500:
+            return self._send_json(500, {'error': 'Internal Server Error'})
+        return self._send_json(200, self.server.payload(int(match.group(1))))
+
+    def _send_json(self, status, body, headers=None):
+        self._send(status, json.dumps(body).encode('utf-8'), 'application/json', headers)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s " + format, self.address_string(), *args)
+
+
+def start_stub_server(host='127.0.0.1', port=0, settings=None, fixtures=None):
+    """Start a stub server in a background thread and return it; port 0 picks a free port"""
+    server = StubServer((host, port), settings, fixtures)
+    thread = threading.Thread(target=server.serve_forever, name='whiskybase-stub', daemon=True)
+    thread.start()
+    return server
+
+
+def add_settings_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=0, help="Added latency per request")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Uniform +/- jitter on the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of API calls answered with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of API calls answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument('--seed', type=int, help="Random seed for reproducible fault injection")
+
+
+def settings_from_args(args):
+    return StubSettings(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.retry_after, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local WhiskyBase stand-in serving recorded fixtures")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="Directory of whisky_{id}.json payloads")
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), settings_from_args(args), load_fixtures(args.fixtures))
+    print(f"WhiskyBase stub serving {len(server.fixtures)} fixture(s) on {server.base_url}")
+    print(f"  WHISKYBASE_BASE_URL={server.base_url} WHISKYBASE_API_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Responses by status: {server.counts}")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
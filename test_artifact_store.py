@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for the bounded artifact store and the /artifacts route
+"""
+
+import io
+import json
+import os
+import re
+import time
+import zipfile
+
+import app as app_module
+from artifact_store import ArtifactStore
+from test_label_render import TEST_WHISKY
+
+
+def test_put_is_content_addressed(tmp_path):
+    store = ArtifactStore(str(tmp_path), background_gc=False)
+    name = store.put(b'label bytes', 'png')
+    assert re.match(r'^[0-9a-f]{32}\.png$', name)
+    assert store.put(b'label bytes', 'png') == name
+    with open(store.path(name), 'rb') as f:
+        assert f.read() == b'label bytes'
+
+    assert store.path('../config.py') is None
+    assert store.path('0' * 32 + '.png') is None
+
+
+def test_reading_an_artifact_counts_as_use(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=1500, background_gc=False)
+    popular = store.put(b'p' * 1000, 'png')
+    old = time.time() - 3600
+    os.utime(store.path(popular), (old, old))
+    unread = store.put(b'u' * 1000, 'png')
+    os.utime(store.path(unread), (old + 1800, old + 1800))
+
+    with store.open(popular) as f:
+        assert f.read() == b'p' * 1000
+    store.gc()
+    assert store.path(popular) is not None
+    assert store.path(unread) is None
+    assert store.open('0' * 32 + '.png') is None
+
+
+def test_gc_expires_old_artifacts_and_enforces_quota(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=2500, max_age_seconds=3600, background_gc=False)
+    expired = store.put(b'e' * 100, 'png')
+    old = os.path.getmtime(store.path(expired)) - 7200
+    os.utime(store.path(expired), (old, old))
+
+    names = []
+    for index in range(3):
+        names.append(store.put(bytes([index]) * 1000, 'png'))
+        stamp = time.time() - 100 + index
+        os.utime(store.path(names[-1]), (stamp, stamp))
+    store.put(b'\x00' * 1000, 'png')  # Storing the oldest again makes it the most recent
+
+    store.gc()
+    assert store.path(expired) is None
+    assert store.path(names[0]) is not None
+    assert store.path(names[1]) is None
+    assert store.path(names[2]) is not None
+
+
+def test_gc_keeps_pinned_artifacts(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=1500, max_age_seconds=3600, background_gc=False)
+    old = time.time() - 7200
+    pinned = store.put(b'p' * 1000, 'png')
+    os.utime(store.path(pinned), (old, old))
+    recent = store.put(b'r' * 1000, 'png')
+
+    def unavailable():
+        raise ConnectionError('job queue down')
+    store.pinned = unavailable
+    store.gc()
+    assert store.path(pinned) is not None and store.path(recent) is not None
+
+    store.pinned = lambda: {pinned}
+    store.gc()
+    assert store.path(pinned) is not None
+    assert store.path(recent) is None
+
+
+def test_print_page_loads_label_from_cacheable_artifact_url(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path), background_gc=False)
+    monkeypatch.setattr(app_module, 'artifacts', store)
+    monkeypatch.setattr(app_module.WhiskyLabelGenerator, 'get_whisky_info', lambda self, whisky_id: dict(TEST_WHISKY))
+    client = app_module.app.test_client()
+
+    page = client.get('/api/print/12345').get_data(as_text=True)
+    label_url = re.search(r'<img src="([^"]+)"', page).group(1)
+    assert label_url.startswith('/artifacts/')
+
+    response = client.get(label_url)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+    response.close()
+    assert client.get(label_url, headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.get('/artifacts/not-an-artifact.png').status_code == 404
+
+
+def test_batch_zip_lists_failed_ids_and_leaves_no_temp_files(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path), background_gc=False)
+    monkeypatch.setattr(app_module, 'artifacts', store)
+
+    def get_whisky_info(self, whisky_id):
+        if whisky_id == 99:
+            raise ValueError('WhiskyBase lookup failed')
+        return dict(TEST_WHISKY, id=whisky_id)
+    monkeypatch.setattr(app_module.WhiskyLabelGenerator, 'get_whisky_info', get_whisky_info)
+    client = app_module.app.test_client()
+
+    response = client.post('/api/batch-labels', json={'whisky_ids': [1, 99]})
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        names = archive.namelist()
+        errors = [json.loads(line) for line in archive.read('errors.ndjson').decode().splitlines()]
+    response.close()
+    assert len(names) == 2 and names[-1] == 'errors.ndjson'
+    assert errors == [{'whisky_id': 99, 'error': 'WhiskyBase lookup failed'}]
+
+    def full_disk(temp_path, extension):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(store, 'put_file', full_disk)
+    assert client.post('/api/batch-labels', json={'whisky_ids': [1]}).status_code == 500
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
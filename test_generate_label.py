@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the multi-ID generate_label.py command line
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import generate_label
+from label_generator import WhiskyLabelGenerator
+
+WHISKIES = {
+    1: {'id': 1, 'name': 'Ardbeg 10', 'distillery': 'Ardbeg', 'abv': '46%', 'age': '10 years',
+        'url': 'https://www.whiskybase.com/whisky/1', 'source': 'api'},
+    2: {'id': 2, 'name': 'Talisker 18', 'distillery': 'Talisker', 'abv': '45.8%', 'age': '18 years',
+        'url': 'https://www.whiskybase.com/whisky/2', 'source': 'api'},
+}
+
+
+@pytest.fixture
+def whiskies(monkeypatch):
+    data = {whisky_id: dict(info) for whisky_id, info in WHISKIES.items()}
+
+    def get_whisky_info(self, whisky_id):
+        if whisky_id not in data:
+            return self._get_fallback_data(whisky_id)
+        return dict(data[whisky_id])
+    monkeypatch.setattr(WhiskyLabelGenerator, 'get_whisky_info', get_whisky_info)
+    return data
+
+
+def _run(tmp_path, *argv):
+    args = generate_label.parse_args(['--jobs', '1', '-o', str(tmp_path), *argv])
+    results = generate_label.run(args, generate_label.read_ids(args))
+    return {result['whisky_id']: result['status'] for result in results}
+
+
+def test_skips_labels_whose_metadata_is_unchanged(tmp_path, whiskies):
+    assert _run(tmp_path, '1', '2') == {1: 'rendered', 2: 'rendered'}
+    assert os.path.exists(tmp_path / 'whisky_1_label.png')
+
+    whiskies[2]['abv'] = '49.1%'
+    assert _run(tmp_path, '1', '2') == {1: 'skipped', 2: 'rendered'}
+
+    # Different options produce a different output and hash
+    assert _run(tmp_path, '--printer', 'ql820nwb', '--preset', 'small', '1') == {1: 'rendered'}
+    assert os.path.exists(tmp_path / 'whisky_1_ql820nwb_small.png')
+    assert _run(tmp_path, '--force', '1') == {1: 'rendered'}
+
+
+def test_reads_ids_from_file_and_reports_lookup_failures(tmp_path, whiskies):
+    id_file = tmp_path / 'ids.txt'
+    id_file.write_text("1, 2  # first batch\n99\n1\n")
+    assert _run(tmp_path, '--file', str(id_file), '--format', 'svg') == {1: 'rendered', 2: 'rendered', 99: 'failed'}
+    assert not os.path.exists(tmp_path / 'whisky_99_label.svg')
+
+
+def test_single_id_with_output_filename(tmp_path, whiskies):
+    output = str(tmp_path / 'my_label.png')
+    args = generate_label.parse_args(['1', output])
+    assert args.ids == ['1'] and args.output_filename == output
+    generate_label.run(args, generate_label.read_ids(args))
+    assert os.path.exists(output)
+
+
+def test_cli_imports_only_the_core():
+    """The CLI and its workers must not pay for the web app's imports"""
+    code = (
+        "import sys, generate_label; "
+        "print(sorted(m for m in ('flask', 'playwright', 'qrcode', 'requests', 'dotenv', 'PIL') if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    assert output.strip() == '[]'
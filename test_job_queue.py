@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Tests for the distributed batch job queue and workers
+"""
+
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import app as app_module
+import batch_worker
+import scheduler
+from artifact_store import ArtifactStore
+from batch_worker import BatchWorker
+from job_queue import RedisJobQueue, SqliteJobQueue, open_job_queue
+from label_generator import WhiskyLabelGenerator
+
+OPTIONS = {'printer_type': 'ql820nwb', 'ql820nwb_size': 'small', 'show_photo': False, 'format': 'png'}
+
+
+def _bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class WatchError(Exception):
+    pass
+
+
+class FakeRedis:
+    """Just enough of the redis-py client for the job queue, with WATCH/MULTI transactions
+
+    before_execute, if set, runs once just before the next transaction's EXEC,
+    to interleave another client's writes with a transaction in progress.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.versions = {}
+        self.lock = threading.RLock()
+        self.before_execute = None
+
+    def _changed(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = _bytes(value)
+            self._changed(key)
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def mset(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def mget(self, keys):
+        with self.lock:
+            return [self.data.get(key) for key in keys]
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                if self.data.pop(key, None) is not None:
+                    self._changed(key)
+
+    def exists(self, key):
+        with self.lock:
+            return int(key in self.data)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            for field, field_value in (mapping or {key: value}).items():
+                fields[_bytes(field)] = _bytes(field_value)
+            self._changed(name)
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.data.get(name, {}).get(_bytes(key))
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.data.get(name, {}))
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            fields[_bytes(key)] = _bytes(int(fields.get(_bytes(key), 0)) + amount)
+            self._changed(name)
+
+    def sadd(self, name, *values):
+        with self.lock:
+            self.data.setdefault(name, set()).update(_bytes(value) for value in values)
+            self._changed(name)
+
+    def sunion(self, keys):
+        with self.lock:
+            return set().union(*(self.data.get(key, set()) for key in keys))
+
+    def lpush(self, name, *values):
+        with self.lock:
+            self.data.setdefault(name, [])[:0] = [_bytes(value) for value in reversed(values)]
+            self._changed(name)
+
+    def rpush(self, name, *values):
+        with self.lock:
+            self.data.setdefault(name, []).extend(_bytes(value) for value in values)
+            self._changed(name)
+
+    def lrange(self, name, start, end):
+        with self.lock:
+            values = self.data.get(name, [])
+            return list(values[start:] if end == -1 else values[start:end + 1])
+
+    def lrem(self, name, count, value):
+        # Only the counts the queue uses: -1 removes the occurrence nearest the tail
+        with self.lock:
+            values = self.data.get(name, [])
+            for index in (range(len(values) - 1, -1, -1) if count < 0 else range(len(values))):
+                if values[index] == _bytes(value):
+                    del values[index]
+                    self._changed(name)
+                    return 1
+            return 0
+
+    def zadd(self, name, mapping):
+        with self.lock:
+            self.data.setdefault(name, {}).update({_bytes(member): score for member, score in mapping.items()})
+            self._changed(name)
+
+    def zrange(self, name, start, end):
+        with self.lock:
+            scores = self.data.get(name, {})
+            members = sorted(scores, key=scores.get)
+            return members[start:] if end == -1 else members[start:end + 1]
+
+    def zrangebyscore(self, name, minimum, maximum):
+        with self.lock:
+            scores = self.data.get(name, {})
+            return sorted((member for member, score in scores.items() if minimum <= score <= maximum), key=scores.get)
+
+    def zrem(self, name, member):
+        with self.lock:
+            if self.data.get(name, {}).pop(_bytes(member), None) is None:
+                return 0
+            self._changed(name)
+            return 1
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        while True:
+            pipe = self.pipeline()
+            pipe.watch(*watches)
+            try:
+                value = func(pipe)
+                results = pipe.execute()
+            except WatchError:
+                continue
+            return value if value_from_callable else results
+
+
+class FakePipeline:
+    """Commands are queued, except between watch() and multi() when they run at once, like redis-py's"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.watched = {}
+        self.watching = False
+        self.commands = []
+
+    def watch(self, *keys):
+        with self.redis.lock:
+            self.watched.update({key: self.redis.versions.get(key, 0) for key in keys})
+        self.watching = True
+
+    def multi(self):
+        self.watching = False
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+        if self.watching:
+            return command
+        return lambda *args, **kwargs: self.commands.append((command, args, kwargs))
+
+    def execute(self):
+        hook, self.redis.before_execute = self.redis.before_execute, None
+        if hook:
+            hook()
+        with self.redis.lock:
+            if any(self.redis.versions.get(key, 0) != version for key, version in self.watched.items()):
+                raise WatchError()
+            return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def queue(request, tmp_path):
+    if request.param == 'sqlite':
+        return SqliteJobQueue(str(tmp_path / 'jobs.db'), max_attempts=2)
+    return RedisJobQueue(client=FakeRedis(), max_attempts=2)
+
+
+@pytest.fixture
+def whiskies(monkeypatch):
+    def get_whisky_info(self, whisky_id):
+        if whisky_id == 99:
+            return self._get_fallback_data(whisky_id)
+        return {'id': whisky_id, 'name': f'Whisky {whisky_id}', 'distillery': 'Ardbeg', 'abv': '46%',
+                'url': f'https://www.whiskybase.com/whisky/{whisky_id}', 'source': 'api'}
+    monkeypatch.setattr(WhiskyLabelGenerator, 'get_whisky_info', get_whisky_info)
+
+
+def test_items_are_leased_once_and_completed_idempotently(queue):
+    job_id = queue.create_job([10, 20], OPTIONS)
+    assert queue.create_job([10, 20, 30], OPTIONS, job_id=job_id) == job_id
+
+    first, second = queue.claim('a', 60), queue.claim('b', 60)
+    assert (first.whisky_id, second.whisky_id) == (10, 20)
+    assert first.options == OPTIONS
+    assert queue.claim('c', 60) is None
+    assert queue.workers() == ['a', 'b']
+
+    assert queue.heartbeat(first, 60)
+    assert queue.complete(first, 'abc.png')
+    assert not queue.complete(first, 'abc.png')
+    progress = queue.progress(job_id)
+    assert (progress['total'], progress['done'], progress['leased'], progress['finished']) == (2, 1, 1, False)
+    assert queue.items(job_id)[0]['artifact'] == 'abc.png'
+
+
+def test_expired_lease_is_requeued_until_attempts_run_out(queue):
+    job_id = queue.create_job([10], OPTIONS)
+    lease = queue.claim('crashed', 0.01)
+    time.sleep(0.02)
+
+    retry = queue.claim('healthy', 60)
+    assert (retry.whisky_id, retry.attempts) == (10, 2)
+    assert not queue.heartbeat(lease, 60)
+    assert queue.fail(lease, 'too late') is None
+
+    # The last attempt fails for good
+    assert queue.fail(retry, 'WhiskyBase lookup failed', retry_base_seconds=0) == 'failed'
+    assert queue.claim('healthy', 60) is None
+    assert queue.progress(job_id)['failed'] == 1
+
+
+def test_failed_item_is_retried_after_backoff(queue):
+    job_id = queue.create_job([10], OPTIONS)
+    lease = queue.claim('a', 60)
+    assert queue.fail(lease, 'timeout', retry_base_seconds=60) == 'pending'
+    assert queue.claim('a', 60) is None
+
+    queue.create_job([20], OPTIONS, job_id='other')
+    assert queue.claim('a', 60).whisky_id == 20
+    assert queue.progress(job_id)['pending'] == 1
+
+
+def test_concurrent_workers_never_lose_or_double_complete_items(queue):
+    job_id = queue.create_job(range(60), OPTIONS)
+    completed = []
+    deadline = time.time() + 30
+
+    def work(worker):
+        rng = random.Random(worker)
+        while time.time() < deadline:
+            lease = queue.claim(worker, 0.05)
+            if lease is None:
+                if queue.progress(job_id)['finished']:
+                    return
+                time.sleep(0.005)
+                continue
+            outcome = rng.random()
+            if outcome < 0.3:
+                queue.fail(lease, 'timeout', retry_base_seconds=0)
+                continue
+            if outcome < 0.4:
+                # Stalls past its lease, so another worker may claim the item meanwhile
+                time.sleep(0.06)
+            if queue.complete(lease, f'{lease.whisky_id}.png'):
+                completed.append(lease.position)
+
+    threads = [threading.Thread(target=work, args=(f'w{index}',)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    items = queue.items(job_id)
+    assert len(items) == 60 and {item['state'] for item in items} <= {'done', 'failed'}
+    assert sorted(completed) == [item['position'] for item in items if item['state'] == 'done']
+    assert queue.claim('late', 60) is None
+    progress = queue.progress(job_id)
+    assert progress['done'] == len(completed) and progress['done'] + progress['failed'] == 60
+    assert (progress['pending'], progress['leased']) == (0, 0)
+
+
+def test_redis_transition_retries_when_the_item_changes_underneath():
+    queue = RedisJobQueue(client=FakeRedis(), max_attempts=2)
+    job_id = queue.create_job([10], OPTIONS)
+    lease = queue.claim('a', 60)
+
+    # Another worker completes the item between fail()'s read and its write
+    queue.client.before_execute = lambda: queue.complete(lease, 'abc.png')
+    assert queue.fail(lease, 'timeout', retry_base_seconds=0) is None
+    assert queue.items(job_id)[0]['state'] == 'done'
+
+    # Two workers claiming the same ready item: only one transaction wins
+    queue.create_job([20], OPTIONS, job_id='race')
+    rival = []
+    queue.client.before_execute = lambda: rival.append(queue.claim('b', 60))
+    assert queue.claim('a', 60) is None
+    assert rival[0].whisky_id == 20
+    assert [item['attempts'] for item in queue.items('race')] == [1]
+
+
+def test_jobs_keep_their_artifacts_until_deleted_or_expired(queue):
+    job_id = queue.create_job([10, 20], OPTIONS)
+    queue.create_job([30], OPTIONS, job_id='other')
+    queue.complete(queue.claim('a', 60), 'abc.png')
+    queue.complete(queue.claim('a', 60), 'def.png')
+    assert queue.artifacts() == {'abc.png', 'def.png'}
+    assert [(job['job_id'], job['done'], job['pending']) for job in queue.jobs()] == [(job_id, 2, 0), ('other', 0, 1)]
+
+    assert queue.delete_job(job_id) and not queue.delete_job(job_id)
+    assert queue.progress(job_id) is None and queue.items(job_id) == []
+    assert queue.artifacts() == set()
+    assert queue.purge_expired(3600) == 0
+    assert queue.purge_expired(-1) == 1
+    assert queue.jobs() == [] and queue.claim('a', 60) is None
+
+
+def test_worker_renders_job_into_artifact_store(tmp_path, whiskies, queue):
+    artifacts = ArtifactStore(str(tmp_path / 'artifacts'), background_gc=False)
+    job_id = queue.create_job([1, 2, 99], OPTIONS)
+    worker = BatchWorker(queue, artifacts, worker_id='test', threads=2, poll_seconds=0)
+    worker.run(exit_when_idle=True)
+
+    items = queue.items(job_id)
+    assert [item['state'] for item in items] == ['done', 'done', 'pending']
+    assert items[2]['error'] == 'WhiskyBase lookup failed'
+    assert artifacts.path(items[0]['artifact']) is not None
+
+    # A second worker rendering the same item produces the same artifact
+    queue.create_job([1], OPTIONS, job_id='again')
+    worker.run(exit_when_idle=True)
+    assert queue.items('again')[0]['artifact'] == items[0]['artifact']
+
+
+def test_worker_threads_run_at_bulk_priority(tmp_path, whiskies, monkeypatch):
+    priorities = []
+    render = batch_worker.render_job_item
+
+    def recording_render(generator, whisky_id, options):
+        priorities.append(scheduler.current_priority())
+        return render(generator, whisky_id, options)
+    monkeypatch.setattr(batch_worker, 'render_job_item', recording_render)
+
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'))
+    queue.create_job([1, 2], OPTIONS)
+    artifacts = ArtifactStore(str(tmp_path / 'artifacts'), background_gc=False)
+    BatchWorker(queue, artifacts, worker_id='test', threads=2, poll_seconds=0).run(exit_when_idle=True)
+    assert priorities == ['bulk', 'bulk']
+
+
+def test_overloaded_item_is_handed_back_without_using_an_attempt(tmp_path, whiskies, queue, monkeypatch):
+    render = batch_worker.render_job_item
+
+    def overloaded_once(generator, whisky_id, options):
+        monkeypatch.setattr(batch_worker, 'render_job_item', render)
+        raise scheduler.Overloaded('fetch', 'bulk', 0)
+    monkeypatch.setattr(batch_worker, 'render_job_item', overloaded_once)
+
+    job_id = queue.create_job([1], OPTIONS)
+    artifacts = ArtifactStore(str(tmp_path / 'artifacts'), background_gc=False)
+    BatchWorker(queue, artifacts, worker_id='test', threads=1, poll_seconds=0).run(exit_when_idle=True)
+    item = queue.items(job_id)[0]
+    assert (item['state'], item['attempts']) == ('done', 1)
+
+
+def test_worker_process_gives_every_thread_a_bulk_slot(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, '_schedulers', {})
+    monkeypatch.delenv('MAX_BROWSER_SESSIONS', raising=False)
+    monkeypatch.delenv('RENDER_SLOTS', raising=False)
+    batch_worker.configure_scheduler(16)
+    fetch = scheduler.scheduler('fetch')
+    assert (fetch.slots, fetch.limits['bulk'], fetch.max_queued['bulk']) == (16, 16, 16)
+
+    def slow_fetch(generator, whisky_id, options):
+        with scheduler.slot('fetch'):
+            time.sleep(0.05)
+        return b'label', 'png'
+    monkeypatch.setattr(batch_worker, 'render_job_item', slow_fetch)
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'))
+    job_id = queue.create_job(range(32), OPTIONS)
+    artifacts = ArtifactStore(str(tmp_path / 'artifacts'), background_gc=False)
+    BatchWorker(queue, artifacts, worker_id='test', threads=16, poll_seconds=0).run(exit_when_idle=True)
+    assert {(item['state'], item['attempts']) for item in queue.items(job_id)} == {('done', 1)}
+
+
+def test_worker_processes_share_the_sqlite_queue(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'))
+    job_id = queue.create_job(range(40), OPTIONS)
+    script = (
+        "import sys; from job_queue import SqliteJobQueue\n"
+        "queue = SqliteJobQueue(sys.argv[1])\n"
+        "while (lease := queue.claim(sys.argv[2], 60)) is not None:\n"
+        "    assert queue.complete(lease, f'{lease.whisky_id}.png')\n"
+    )
+    workers = [subprocess.Popen([sys.executable, '-c', script, str(tmp_path / 'jobs.db'), f'w{index}'])
+               for index in range(3)]
+    assert all(worker.wait(30) == 0 for worker in workers)
+    assert [item['artifact'] for item in queue.items(job_id)] == [f'{whisky_id}.png' for whisky_id in range(40)]
+
+
+def test_open_job_queue_selects_backend(tmp_path, monkeypatch):
+    monkeypatch.setenv('JOB_QUEUE_URL', str(tmp_path / 'env.db'))
+    assert open_job_queue().db_path == str(tmp_path / 'env.db')
+    assert open_job_queue(f"sqlite:///{tmp_path}/url.db").db_path == f"{tmp_path}/url.db"
+
+
+def test_job_endpoints_report_progress(tmp_path, whiskies, monkeypatch):
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'))
+    artifacts = ArtifactStore(str(tmp_path / 'artifacts'), background_gc=False)
+    monkeypatch.setattr(app_module, 'job_queue', queue)
+    monkeypatch.setattr(app_module, 'artifacts', artifacts)
+    client = app_module.app.test_client()
+
+    response = client.post('/api/jobs', json={'whisky_ids': [1, 2], 'printer_type': 'ql820nwb',
+                                              'ql820nwb_size': 'small', 'job_id': 'event-2026'})
+    assert response.status_code == 202
+    assert response.headers['Location'] == '/api/jobs/event-2026'
+    assert response.get_json()['pending'] == 2
+
+    BatchWorker(queue, artifacts, worker_id='test', threads=1, poll_seconds=0).run(exit_when_idle=True)
+    job = client.get('/api/jobs/event-2026').get_json()
+    assert job['finished'] and job['done'] == 2
+    assert client.get(job['items'][0]['url']).status_code == 200
+
+    summary = client.get('/api/jobs').get_json()
+    assert summary['totals']['done'] == 2 and summary['totals']['progress'] == 1.0
+
+    # Results of live jobs survive artifact GC until the job is collected
+    artifacts.max_bytes = 1
+    artifacts.pinned = app_module._job_artifacts
+    artifacts.gc()
+    assert client.get(job['items'][0]['url']).status_code == 200
+    assert client.delete('/api/jobs/event-2026').status_code == 204
+    assert client.delete('/api/jobs/event-2026').status_code == 404
+    artifacts.gc()
+    assert client.get(job['items'][0]['url']).status_code == 404
+
+    assert client.get('/api/jobs/missing').status_code == 404
+    assert client.post('/api/jobs', json={'whisky_ids': []}).status_code == 400
+    assert client.post('/api/jobs', json={'whisky_ids': [1], 'ql820nwb_size': 'giant'}).status_code == 400
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Tests for label layouts and the PNG/SVG/PDF backends
+"""
+
+import io
+import json
+import xml.etree.ElementTree as ElementTree
+import zipfile
+
+from PIL import Image
+
+from app import WhiskyLabelGenerator, app
+import label_render
+
+TEST_WHISKY = {
+    'id': 12345,
+    'name': 'Macallan 18 Year Old',
+    'distillery': 'The Macallan',
+    'abv': '43%',
+    'age': '18 years',
+    'url': 'https://www.whiskybase.com/whisky/12345',
+    'source': 'test'
+}
+
+
+def test_layout_renders_to_every_format():
+    """One layout pass produces the raster image and both vector documents"""
+    generator = WhiskyLabelGenerator()
+    layout = generator.layout_ql820nwb_label(TEST_WHISKY, size_preset='medium')
+    assert (layout.width, layout.height) == (342, 1062)
+
+    image = label_render.render_image(layout)
+    assert image.size == (342, 1062)
+
+    svg = ElementTree.fromstring(generator.render_layout(layout, 'svg'))
+    assert svg.get('width') == '28.96mm'
+    assert svg.get('viewBox') == '0 0 342 1062'
+    texts = [element.text for element in svg.iter('{http://www.w3.org/2000/svg}text')]
+    assert 'Distillery: The Macallan' in texts
+    assert svg.find('{http://www.w3.org/2000/svg}path') is not None
+
+    pdf = generator.render_layout(layout, 'pdf')
+    assert pdf.startswith(b'%PDF-1.7')
+    assert b'/MediaBox [0 0 82.080 254.880]' in pdf
+    assert b'/FontFile2' in pdf or b'/BaseFont /Helvetica' in pdf
+    assert pdf.rstrip().endswith(b'%%EOF')
+
+
+def test_label_endpoint_format_parameter():
+    client = app.test_client()
+    response = client.get('/api/custom-label?name=Test&distillery=Test&format=svg')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    response.close()
+
+    response = client.get('/api/ql820nwb/custom?name=Test&distillery=Test&format=pdf')
+    assert response.mimetype == 'application/pdf'
+    response.close()
+
+    response = client.get('/api/custom-label?name=Test&distillery=Test&format=gif')
+    assert response.status_code == 400
+
+
+def test_preview_formats_are_negotiated_and_refused_for_print():
+    client = app.test_client()
+    url = '/api/custom-label?name=Test&distillery=Test&purpose=preview'
+    response = client.get(url, headers={'Accept': 'image/avif,image/webp,image/*,*/*;q=0.8'})
+    assert response.mimetype == 'image/webp'
+    assert 'Accept' in response.headers['Vary']
+    webp_size = len(response.get_data())
+
+    response = client.get(url, headers={'Accept': 'image/png'})
+    assert response.mimetype == 'image/png'
+    assert webp_size < len(response.get_data())
+
+    # Print labels stay lossless PNG whatever the client accepts, and lossy formats are refused
+    response = client.get('/api/custom-label?name=Test&distillery=Test', headers={'Accept': 'image/webp'})
+    assert response.mimetype == 'image/png'
+    response = client.get('/api/custom-label?name=Test&distillery=Test&format=webp')
+    assert response.status_code == 400
+    response = client.get('/api/custom-label?name=Test&distillery=Test&purpose=draft')
+    assert response.status_code == 400
+
+
+def test_preview_endpoint_fetches_once(monkeypatch):
+    """The combined preview returns metadata and label from one lookup"""
+    calls = []
+
+    def get_whisky_info(self, whisky_id):
+        calls.append(whisky_id)
+        return dict(TEST_WHISKY, id=whisky_id)
+
+    monkeypatch.setattr(WhiskyLabelGenerator, 'get_whisky_info', get_whisky_info)
+    client = app.test_client()
+    response = client.get('/api/preview/12345?printer_type=ql820nwb&size=small')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert calls == [12345]
+    assert data['whisky']['name'] == TEST_WHISKY['name']
+    assert data['purpose'] == 'preview'
+    assert data['label']['data_uri'].startswith('data:image/webp;base64,')
+    assert (data['label']['width'], data['label']['height']) == (200, 637)
+
+
+def test_batch_custom_labels_streams_zip_from_csv():
+    client = app.test_client()
+    body = (
+        "name,distillery,abv,age,id,size\n"
+        "Cask Sample 1,Ardbeg,58.2%,12 years,101,small\n"
+        "Cask Sample 2,,50%,,102,\n"
+        "Cask Sample 3,Bowmore,46%,,103,giant\n"
+        "Cask Sample 4,Bowmore,46%,,,\n"
+    )
+    response = client.post('/api/batch-custom-labels?printer_type=ql820nwb', data=body, content_type='text/csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    assert response.is_streamed
+
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.namelist() == ['label_00001_101.png', 'label_00004_custom.png', 'errors.ndjson']
+        with Image.open(archive.open('label_00001_101.png')) as label:
+            assert label.size == (200, 637)
+        errors = [json.loads(line) for line in archive.read('errors.ndjson').decode().splitlines()]
+    assert [entry['row'] for entry in errors] == [2, 3]
+    assert 'giant' in errors[1]['error']
+
+
+def test_batch_custom_labels_reads_ndjson():
+    client = app.test_client()
+    body = '{"name": "Sample A", "distillery": "Lagavulin"}\nnot json\n{"name": "Sample B", "distillery": "Caol Ila", "id": 7}\n'
+    response = client.post('/api/batch-custom-labels?format=svg', data=body, content_type='application/x-ndjson')
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.namelist() == ['label_00001_custom.svg', 'label_00003_7.svg', 'errors.ndjson']
+
+    response = client.post('/api/batch-custom-labels', data=body, content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_batch_custom_labels_reports_bad_rows_without_breaking_the_zip(monkeypatch):
+    client = app.test_client()
+    body = (
+        '{"name": ["Sample", "A"], "distillery": {"name": "Lagavulin"}}\n'
+        '{"name": "Sample B", "distillery": "Caol Ila", "width_mm": 100000}\n'
+        '{"name": "Sample C", "distillery": "Caol Ila", "id": 9}\n'
+        '{"name": "Sample D", "distillery": "Caol Ila"}\n'
+    )
+    render_layout = WhiskyLabelGenerator.render_layout
+
+    def failing_render(self, layout, output_format='png'):
+        if any('Sample D' in element.get('text', '') for element in layout.elements):
+            raise RuntimeError('renderer crashed')
+        return render_layout(self, layout, output_format)
+    monkeypatch.setattr(WhiskyLabelGenerator, 'render_layout', failing_render)
+
+    response = client.post('/api/batch-custom-labels?format=svg', data=body, content_type='application/x-ndjson')
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.namelist() == ['label_00001_custom.svg', 'label_00003_9.svg', 'errors.ndjson']
+        errors = [json.loads(line) for line in archive.read('errors.ndjson').decode().splitlines()]
+    assert [entry['row'] for entry in errors] == [2, 4]
+    assert 'between 10 and 200' in errors[0]['error'] and 'renderer crashed' in errors[1]['error']
+
+    assert client.post('/api/batch-custom-labels?dpi=100000', data=body,
+                       content_type='application/x-ndjson').status_code == 400
+
+
+def test_variants_endpoint_fetches_and_builds_qr_once(monkeypatch):
+    """Comparing presets costs one lookup and one QR code, whatever the number of variants"""
+    calls = []
+    qr_builds = []
+    build_qr = WhiskyLabelGenerator._qr_matrix
+
+    def get_whisky_info(self, whisky_id):
+        calls.append(whisky_id)
+        return dict(TEST_WHISKY, id=whisky_id)
+
+    def qr_matrix(self, *args, **kwargs):
+        qr_builds.append(args)
+        return build_qr(self, *args, **kwargs)
+
+    monkeypatch.setattr(WhiskyLabelGenerator, 'get_whisky_info', get_whisky_info)
+    monkeypatch.setattr(WhiskyLabelGenerator, '_qr_matrix', qr_matrix)
+    client = app.test_client()
+    response = client.get('/api/ql820nwb/12345/variants?sizes=small,medium,large,custom&dpi=300,150')
+    assert response.status_code == 200
+    labels = response.get_json()['labels']
+    assert calls == [12345]
+    assert len(qr_builds) == 1
+    assert [(label['size'], label['dpi']) for label in labels] == [
+        (size, dpi) for size in ('small', 'medium', 'large', 'custom') for dpi in (300, 150)
+    ]
+    assert (labels[0]['width'], labels[0]['height']) == (200, 637)
+    assert (labels[2]['width'], labels[2]['height']) == (342, 1062)
+
+    response = client.get('/api/ql820nwb/12345/variants?sizes=small,giant')
+    assert response.status_code == 400
+    assert 'giant' in response.get_json()['error']
+
+
+def test_custom_variants_endpoint():
+    client = app.test_client()
+    response = client.post('/api/ql820nwb/custom/variants',
+                           json={'name': 'Cask Sample', 'distillery': 'Ardbeg', 'sizes': 'small,medium', 'format': 'svg'})
+    assert response.status_code == 200
+    labels = response.get_json()['labels']
+    assert [label['size'] for label in labels] == ['small', 'medium']
+    assert all(label['data_uri'].startswith('data:image/svg+xml;base64,') for label in labels)
+
+    response = client.post('/api/ql820nwb/custom/variants',
+                           json={'name': 'Cask Sample', 'distillery': 'Ardbeg', 'sizes': ['large', 'small'], 'dpi': [150]})
+    assert response.status_code == 200
+    assert [(label['size'], label['dpi']) for label in response.get_json()['labels']] == [('large', 150), ('small', 150)]
+
+    response = client.post('/api/ql820nwb/custom/variants', json={'name': 'Cask Sample'})
+    assert response.status_code == 400
+    response = client.post('/api/ql820nwb/custom/variants',
+                           json={'name': 'Cask Sample', 'distillery': 'Ardbeg', 'sizes': [{'size': 'small'}]})
+    assert response.status_code == 400
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for debounced live previews and cancellation of superseded renders
+"""
+
+import json
+import threading
+
+from app import app
+from live_preview import LivePreviews
+
+
+def _recording_render(rendered, started=None, release=None):
+    def render(fields, check, cache):
+        if started is not None:
+            started.set()
+            release.wait(5)
+        check()
+        rendered.append(fields['name'])
+        return {'name': fields['name']}
+    return render
+
+
+def test_rapid_edits_are_debounced_into_one_render():
+    rendered = []
+    previews = LivePreviews(_recording_render(rendered), debounce_seconds=0.05)
+    for name in ('M', 'Ma', 'Mac', 'Macallan'):
+        version = previews.submit('session-debounce', {'name': name})
+
+    session = previews.session('session-debounce')
+    frame_version, frame = session.next_frame(0, timeout=5)
+    assert (frame_version, frame['name']) == (version, 'Macallan')
+    assert rendered == ['Macallan']
+
+
+def test_render_superseded_by_newer_edit_is_not_sent():
+    rendered = []
+    started, release = threading.Event(), threading.Event()
+    previews = LivePreviews(_recording_render(rendered, started, release), debounce_seconds=0)
+
+    previews.submit('session-cancel', {'name': 'Old'})
+    assert started.wait(5)
+    started.clear()
+    version = previews.submit('session-cancel', {'name': 'New'})
+    release.set()
+
+    frame_version, frame = previews.session('session-cancel').next_frame(0, timeout=5)
+    assert (frame_version, frame['name']) == (version, 'New')
+    assert rendered == ['New']
+
+
+def test_live_preview_endpoints_stream_latest_frame():
+    client = app.test_client()
+    response = client.post('/api/live-preview/test-session-1',
+                           json={'name': 'Cask Sample', 'distillery': 'Ardbeg', 'printer_type': 'ql820nwb', 'size': 'small'})
+    assert response.status_code == 202
+    version = response.get_json()['version']
+
+    response = client.get('/api/live-preview/test-session-1/events')
+    assert response.mimetype == 'text/event-stream'
+    stream = response.response
+    assert next(stream).startswith(b'retry:')
+    event = next(stream).decode()
+    response.close()
+    lines = dict(line.split(': ', 1) for line in event.strip().splitlines())
+    assert lines['event'] == 'frame'
+    frame = json.loads(lines['data'])
+    assert frame['version'] == version
+    assert frame['data_uri'].startswith('data:image/webp;base64,')
+
+    assert client.post('/api/live-preview/bad!', json={}).status_code == 400
+    assert client.post('/api/live-preview/test-session-1', json={'size': 'giant'}).status_code == 400
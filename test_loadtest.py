@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the WhiskyBase stub server and the load generator
+"""
+
+import requests
+
+import app as app_module
+import loadtest
+import stub_whiskybase
+from label_generator import WhiskyLabelGenerator
+
+
+def test_stub_serves_fixtures_and_injects_faults():
+    settings = stub_whiskybase.StubSettings(seed=1)
+    stub = stub_whiskybase.start_stub_server(settings=settings)
+    try:
+        response = requests.get(f"{stub.base_url}/whisky/12345", timeout=5)
+        assert response.status_code == 200
+        assert response.json()['data']['id'] == 12345
+
+        # IDs without a fixture get a synthetic payload
+        synthetic = requests.get(f"{stub.base_url}/whisky/7", timeout=5).json()
+        whisky = synthetic.get('whisky') or synthetic.get('data') or synthetic
+        assert whisky['id'] == 7 and whisky['name'].endswith('#7')
+
+        settings.rate_limit_rate = 1.0
+        response = requests.get(f"{stub.base_url}/whisky/12345", timeout=5)
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+
+        settings.rate_limit_rate, settings.error_rate = 0.0, 1.0
+        assert requests.get(f"{stub.base_url}/whisky/12345", timeout=5).status_code == 500
+        assert requests.get(f"{stub.base_url}/", timeout=5).status_code == 200
+        assert stub.counts == {200: 3, 429: 1, 500: 1}
+    finally:
+        stub.shutdown()
+        stub.server_close()
+
+
+def test_load_test_drives_endpoints_and_validates_responses(tmp_path, monkeypatch):
+    stub = stub_whiskybase.start_stub_server()
+    # start_app_server swaps the app's stores for ones under tmp_path; undo that afterwards
+    for name in ('artifacts', 'job_queue'):
+        monkeypatch.setattr(app_module, name, getattr(app_module, name))
+    monkeypatch.setattr(app_module, 'generator', WhiskyLabelGenerator())
+
+    def get_whisky_info(self, whisky_id):
+        # Same API round trip as production, without the headless browser
+        response = requests.get(f"{stub.base_url}/whisky/{whisky_id}", timeout=5)
+        return self._parse_api_response(response.json(), whisky_id)
+    monkeypatch.setattr(WhiskyLabelGenerator, 'get_whisky_info', get_whisky_info)
+
+    server = loadtest.start_app_server(str(tmp_path))
+    try:
+        load_test = loadtest.LoadTest(
+            f"http://127.0.0.1:{server.server_port}",
+            {'single': 1, 'preview': 1, 'custom': 1, 'ql': 1, 'batch': 1},
+            [12345, 67890, 1, 2], concurrency=4, total_requests=15, seed=3)
+        summary = load_test.run()
+    finally:
+        server.shutdown()
+        stub.shutdown()
+        stub.server_close()
+
+    assert summary['requests'] == 15
+    assert summary['statuses'] == {'200': 15}
+    assert summary['validation_errors'] == []
+    assert all(stats['p50_ms'] <= stats['p99_ms'] <= stats['max_ms'] for stats in summary['scenarios'].values())
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 0.50) == 50
+    assert loadtest.percentile(values, 0.99) == 99
+    assert loadtest.percentile([5.0], 0.9) == 5.0
+    assert loadtest.percentile([], 0.5) == 0.0
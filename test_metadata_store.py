@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared whisky metadata store
+"""
+
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+import metadata_store
+from label_generator import WhiskyLabelGenerator
+from metadata_store import RedisMetadataStore, SqliteMetadataStore, open_metadata_store
+
+TEST_WHISKY = {
+    'id': 12345,
+    'name': 'Macallan 18 Year Old Sherry Oak',
+    'distillery': 'The Macallan',
+    'bottler': 'Distillery Bottling',
+    'abv': '43%',
+    'age': '18 years',
+    'region': 'Speyside',
+    'note': '',
+    'url': 'https://www.whiskybase.com/whisky/12345',
+    'image_url': None,
+    'source': 'api'
+}
+
+
+class FakeRedis:
+    """Just enough of the redis-py client for the metadata store, with expiry"""
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, ex=None):
+        if isinstance(value, int):
+            value = str(value).encode()
+        self.data[key] = (value, time.time() + ex if ex else None)
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+
+def test_sqlite_round_trip_upsert_and_expiry(tmp_path):
+    store = SqliteMetadataStore(str(tmp_path / 'metadata.db'))
+    assert store.get(12345) is None
+
+    store.put(TEST_WHISKY, ttl_seconds=60)
+    assert store.get(12345) == TEST_WHISKY
+
+    store.put(dict(TEST_WHISKY, abv='48%'), ttl_seconds=60)
+    assert store.get(12345)['abv'] == '48%'
+
+    store.put(dict(TEST_WHISKY, id=1), ttl_seconds=-1)
+    assert store.get(1) is None
+    assert store.get(1, allow_expired=True)['name'] == TEST_WHISKY['name']
+    assert store.purge_expired() == 0
+    assert store.purge_expired(keep_stale_seconds=0) == 1
+    assert store.get(12345) is not None
+
+
+def test_sqlite_writes_purge_records_past_the_stale_window(tmp_path, monkeypatch):
+    monkeypatch.setenv('METADATA_STALE_SECONDS', '60')
+    store = SqliteMetadataStore(str(tmp_path / 'metadata.db'))
+    store.put(dict(TEST_WHISKY, id=1), ttl_seconds=-120)
+    store.put(dict(TEST_WHISKY, id=2), ttl_seconds=-30)
+    store._next_purge = 0
+    store.put(TEST_WHISKY, ttl_seconds=60)
+    assert store.get(1, allow_expired=True) is None
+    assert store.get(2, allow_expired=True) is not None
+
+
+def test_sqlite_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'metadata.db')
+    store = SqliteMetadataStore(path)
+    store.put(TEST_WHISKY, ttl_seconds=60)
+
+    script = (
+        "import sys; from metadata_store import SqliteMetadataStore\n"
+        "store = SqliteMetadataStore(sys.argv[1])\n"
+        "record = store.get(12345)\n"
+        "store.put(dict(record, id=2, name='Written by another process'), 60)\n"
+    )
+    subprocess.run([sys.executable, '-c', script, path], check=True)
+    assert store.get(2)['name'] == 'Written by another process'
+    assert sqlite3.connect(path).execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_sqlite_schema_version_is_recorded_and_checked(tmp_path, monkeypatch):
+    path = str(tmp_path / 'metadata.db')
+    assert SqliteMetadataStore(path).schema_version() == metadata_store.SCHEMA_VERSION
+
+    monkeypatch.setattr(metadata_store, 'SCHEMA_VERSION', metadata_store.SCHEMA_VERSION - 1)
+    with pytest.raises(RuntimeError, match='newer'):
+        SqliteMetadataStore(path).get(12345)
+
+
+def test_records_are_stored_compactly(tmp_path):
+    path = str(tmp_path / 'metadata.db')
+    SqliteMetadataStore(path).put(TEST_WHISKY, ttl_seconds=60)
+    record = sqlite3.connect(path).execute('SELECT record FROM whisky_metadata').fetchone()[0]
+    assert len(record) < len(repr(TEST_WHISKY)) // 2
+
+
+def test_redis_store_uses_versioned_keys_and_ttl():
+    client = FakeRedis()
+    store = RedisMetadataStore(client=client)
+    store.put(TEST_WHISKY, ttl_seconds=60)
+    assert store.get(12345) == TEST_WHISKY
+    assert f"whisky:metadata:v{metadata_store.SCHEMA_VERSION}:12345" in client.data
+
+    store.put(dict(TEST_WHISKY, id=1), ttl_seconds=-1)
+    assert store.get(1) is None
+    assert store.get(1, allow_expired=True)['name'] == TEST_WHISKY['name']
+    assert client.data[store._key(1)][1] > time.time() + 3600
+
+    # Past the stale window Redis has dropped the key
+    client.data[store._key(1)] = (client.data[store._key(1)][0], time.time() - 1)
+    assert store.get(1, allow_expired=True) is None
+
+
+def test_open_metadata_store_selects_backend(tmp_path, monkeypatch):
+    monkeypatch.setenv('METADATA_STORE_URL', str(tmp_path / 'env.db'))
+    assert open_metadata_store().db_path == str(tmp_path / 'env.db')
+    assert open_metadata_store(f"sqlite:///{tmp_path}/url.db").db_path == f"{tmp_path}/url.db"
+
+
+def test_generators_share_fetched_metadata(tmp_path, monkeypatch):
+    monkeypatch.setenv('METADATA_STORE_URL', str(tmp_path / 'metadata.db'))
+    fetches = []
+
+    def fetch(self, whisky_id):
+        fetches.append(whisky_id)
+        if whisky_id == 12345:
+            return dict(TEST_WHISKY)
+        return self._get_fallback_data(whisky_id)
+    monkeypatch.setattr(WhiskyLabelGenerator, '_fetch_whisky_info', fetch)
+
+    first, second = WhiskyLabelGenerator(), WhiskyLabelGenerator()
+    assert first.get_whisky_info(12345) == TEST_WHISKY
+    assert second.get_whisky_info(12345) == TEST_WHISKY
+    assert fetches == [12345]
+
+    # Fallback data is never stored, so the next lookup tries WhiskyBase again
+    second.get_whisky_info(99)
+    first.get_whisky_info(99)
+    second.fetch_whisky_info(12345)
+    assert fetches == [12345, 99, 99, 12345]
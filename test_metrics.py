@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus metrics registry and the /metrics endpoint
+"""
+
+import metrics
+from app import app
+
+
+def test_histogram_exposition():
+    """Histograms render cumulative buckets, sum and count"""
+    registry = metrics.Registry()
+    histogram = metrics.Histogram('test_seconds', 'Test histogram', ['stage'], buckets=(0.1, 1.0), registry=registry)
+    histogram.observe(0.05, stage='render')
+    histogram.observe(0.5, stage='render')
+
+    output = registry.render()
+    assert '# TYPE test_seconds histogram' in output
+    assert 'test_seconds_bucket{stage="render",le="0.1"} 1' in output
+    assert 'test_seconds_bucket{stage="render",le="1"} 2' in output
+    assert 'test_seconds_bucket{stage="render",le="+Inf"} 2' in output
+    assert 'test_seconds_count{stage="render"} 2' in output
+
+
+def test_counter_rejects_wrong_labels():
+    """Counters require exactly their declared labels"""
+    registry = metrics.Registry()
+    counter = metrics.Counter('test_total', 'Test counter', ['status'], registry=registry)
+    counter.inc(status=200)
+    counter.inc(status=200)
+    assert counter.value(status=200) == 2
+    try:
+        counter.inc(code=200)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Counter accepted an undeclared label")
+
+
+def test_metrics_endpoint():
+    """The scrape endpoint exposes the stage histogram and request gauges"""
+    client = app.test_client()
+    response = client.get('/api/custom-label?name=Test&distillery=Test&abv=40%25')
+    assert response.status_code == 200
+    response.close()
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    body = response.get_data(as_text=True)
+    assert 'whisky_stage_duration_seconds_count{stage="render"}' in body
+    assert 'whisky_requests_in_flight' in body
+    assert 'whisky_http_request_duration_seconds_count{endpoint="api_custom_label",status="200"}' in body
+
+
+def test_server_timing_header():
+    """Label responses carry per-stage durations in Server-Timing"""
+    client = app.test_client()
+    response = client.get('/api/custom-label?name=Test&distillery=Test&abv=40%25')
+    header = response.headers.get('Server-Timing', '')
+    response.close()
+    for stage_name in ('qr_build', 'render', 'encode', 'response', 'total'):
+        assert f"{stage_name};dur=" in header
+
+
+def test_request_profiling(tmp_path, monkeypatch):
+    """Profiling is opt-in per request and the profile can be downloaded"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(app_module.WhiskyLabelGenerator, 'get_whisky_info', lambda self, whisky_id: self._get_fallback_data(whisky_id))
+    client = app.test_client()
+
+    response = client.get('/api/whisky/12345', headers={'X-Profile': '1'})
+    assert 'X-Profile-Id' not in response.headers
+
+    monkeypatch.setattr(app_module, 'PROFILING_ENABLED', True)
+    response = client.get('/api/whisky/12345', headers={'X-Profile': '1'})
+    profile_url = response.headers['X-Profile-URL']
+
+    response = client.get(profile_url + '?format=text')
+    assert response.status_code == 200
+    assert 'function calls' in response.get_data(as_text=True)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the bottle photo cache and photo labels
+"""
+
+import io
+
+from PIL import Image
+
+from label_generator import WhiskyLabelGenerator
+from photo_cache import PhotoCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """Serves one PNG bottle photo with an ETag and honours If-None-Match"""
+
+    def __init__(self):
+        buffer = io.BytesIO()
+        Image.new('RGBA', (400, 1200), (120, 60, 20, 255)).save(buffer, 'PNG')
+        self.photo = buffer.getvalue()
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(dict(headers or {}))
+        if (headers or {}).get('If-None-Match') == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, self.photo, {'ETag': '"v1"'})
+
+
+def test_photo_downloaded_once_and_revalidated(tmp_path):
+    """Thumbnails come from the cache; refresh uses a conditional GET"""
+    session = FakeSession()
+    cache = PhotoCache(cache_dir=str(tmp_path), session=session)
+
+    thumb = cache.get_thumbnail('https://example.com/photo.png', (50, 80))
+    assert thumb.size == (27, 80)
+    cache.get_thumbnail('https://example.com/photo.png', (50, 80))
+    cache.get_thumbnail('https://example.com/photo.png', (50, 80), dithered=True)
+    assert len(session.requests) == 1
+
+    cache.get_original('https://example.com/photo.png', refresh=True)
+    assert session.requests[-1] == {'If-None-Match': '"v1"'}
+
+
+def test_dithered_variant_is_one_bit(tmp_path):
+    cache = PhotoCache(cache_dir=str(tmp_path), session=FakeSession())
+    thumb = cache.get_thumbnail('https://example.com/photo.png', (60, 60), dithered=True)
+    assert thumb.mode == '1'
+
+
+def test_quota_evicts_least_recently_used(tmp_path):
+    session = FakeSession()
+    cache = PhotoCache(cache_dir=str(tmp_path), max_bytes=len(session.photo) + 1024, session=session)
+    cache.get_original('https://example.com/first.png')
+    cache.get_original('https://example.com/second.png')
+    remaining = [name for name in tmp_path.iterdir() if name.suffix == '.img']
+    assert len(remaining) == 1
+
+
+def test_photo_label(tmp_path):
+    """Labels with show_photo render the cached photo beside the QR code"""
+    generator = WhiskyLabelGenerator()
+    generator.photo_cache = PhotoCache(cache_dir=str(tmp_path / 'cache'), session=FakeSession())
+    whisky_info = generator._get_fallback_data(12345)
+    whisky_info['image_url'] = 'https://example.com/photo.png'
+
+    output = str(tmp_path / 'label.png')
+    generator.create_ql820nwb_label(whisky_info, output, size_preset='large', show_photo=True)
+    with Image.open(output) as label:
+        assert label.size == (448, 1062)
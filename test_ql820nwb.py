@@ -3,7 +3,7 @@
 Test script for QL-820NWB label generation
 """
 
-from app import WhiskyLabelGenerator
+from label_generator import WhiskyLabelGenerator
 import os
 
 def test_ql820nwb_labels():
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Tests for priority scheduling of fetch and render work
+"""
+
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from app import app, _request_priority
+import scheduler
+from label_generator import WhiskyLabelGenerator
+from scheduler import ResourceScheduler
+
+EQUAL_SHARES = {'interactive': 1.0, 'print': 1.0, 'bulk': 1.0}
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def _queue(resource, priorities, granted):
+    """Start one waiter per priority, in order, each recording when it gets a slot"""
+    for priority in priorities:
+        queued = resource.queued()
+        threading.Thread(target=lambda priority=priority: (resource.acquire(priority), granted.append(priority)),
+                         daemon=True).start()
+        _wait_for(lambda: resource.queued() == queued + 1)
+
+
+def _drain(resource, granted, count):
+    for served in range(count):
+        _wait_for(lambda: len(granted) == served + 1)
+        resource.release(granted[-1])
+
+
+def test_free_slot_goes_to_highest_priority_waiter():
+    resource = ResourceScheduler('test', 1, shares=EQUAL_SHARES, fair_share_every=100)
+    resource.acquire('bulk')
+    granted = []
+    _queue(resource, ['bulk', 'print', 'interactive'], granted)
+
+    resource.release('bulk')
+    _drain(resource, granted, 3)
+    assert granted == ['interactive', 'print', 'bulk']
+
+
+def test_bulk_is_limited_to_its_share_of_slots():
+    resource = ResourceScheduler('test', 4, shares={'interactive': 1.0, 'print': 0.75, 'bulk': 0.5})
+    resource.acquire('bulk')
+    resource.acquire('bulk')
+    granted = []
+    _queue(resource, ['bulk'], granted)
+    assert granted == []
+
+    # Interactive work is admitted straight away while bulk waits at its limit
+    resource.acquire('interactive')
+    assert resource.queued('bulk') == 1
+    resource.release('bulk')
+    _wait_for(lambda: granted == ['bulk'])
+
+
+def test_waiting_bulk_work_gets_a_fair_share():
+    resource = ResourceScheduler('test', 1, shares=EQUAL_SHARES, fair_share_every=2)
+    resource.acquire('interactive')
+    granted = []
+    _queue(resource, ['bulk', 'interactive', 'interactive', 'interactive', 'interactive'], granted)
+
+    resource.release('interactive')
+    _drain(resource, granted, 5)
+    assert granted == ['interactive', 'interactive', 'bulk', 'interactive', 'interactive']
+
+
+def test_nested_slots_of_the_same_resource_do_not_deadlock():
+    resource = ResourceScheduler('test', 1)
+    with resource.slot('print'):
+        with resource.slot('print'):
+            pass
+    assert resource.queued() == 0
+
+
+def test_variants_stay_within_the_callers_render_slot(monkeypatch):
+    generator = WhiskyLabelGenerator()
+    whisky_info = {'id': 1, 'name': 'Test', 'distillery': 'Ardbeg', 'url': 'https://www.whiskybase.com/whisky/1'}
+    threads = []
+    render_layout = WhiskyLabelGenerator.render_layout
+
+    def recording_render(self, layout, output_format='png', purpose='print'):
+        threads.append(threading.get_ident())
+        return render_layout(self, layout, output_format, purpose)
+    monkeypatch.setattr(WhiskyLabelGenerator, 'render_layout', recording_render)
+
+    variants = [('small', 150), ('medium', 150), ('large', 150)]
+    with scheduler.slot('render', 'print'):
+        assert len(generator.render_ql820nwb_variants(whisky_info, variants, max_workers=3)) == 3
+    assert set(threads) == {threading.get_ident()}
+
+
+def test_copied_context_keeps_priority_but_not_held_slots():
+    token = scheduler.set_priority('bulk')
+    try:
+        with scheduler.slot('render'):
+            context = scheduler.copy_context()
+            assert scheduler.holds('render')
+    finally:
+        scheduler.reset_priority(token)
+    assert not context.run(scheduler.holds, 'render')
+    assert context.run(scheduler.current_priority) == 'bulk'
+
+
+def test_request_priority_by_endpoint_and_header():
+    with app.test_request_context('/api/batch-labels', method='POST'):
+        assert _request_priority() == 'bulk'
+    with app.test_request_context('/api/preview/1'):
+        assert _request_priority() == 'interactive'
+    with app.test_request_context('/api/label/1?purpose=preview'):
+        assert _request_priority() == 'interactive'
+    with app.test_request_context('/api/label/1'):
+        assert _request_priority() == 'print'
+    with app.test_request_context('/api/label/1', headers={'X-Priority': 'bulk'}):
+        assert _request_priority() == 'bulk'
+    with app.test_request_context('/api/batch-labels', method='POST', headers={'X-Priority': 'interactive'}):
+        assert _request_priority() == 'bulk'
+    assert scheduler.current_priority() == scheduler.DEFAULT_PRIORITY
+
+
+def test_full_queue_is_refused_with_retry_after():
+    resource = ResourceScheduler('test', 1, max_queued={'interactive': 1, 'print': 1, 'bulk': 1})
+    resource.acquire('bulk')
+    _queue(resource, ['bulk'], [])
+
+    with pytest.raises(scheduler.Overloaded) as refused:
+        resource.admit('bulk')
+    assert refused.value.retry_after >= 1
+    # Other classes keep their own queues
+    resource.admit('interactive')
+
+
+def test_interactive_wait_times_out():
+    resource = ResourceScheduler('test', 1, queue_timeouts={'interactive': 0.01, 'print': 0.01, 'bulk': None})
+    resource.acquire('print')
+    with pytest.raises(scheduler.Overloaded):
+        resource.acquire('interactive')
+    assert resource.queued() == 0
+
+
+def test_overloaded_request_gets_503_or_stale_metadata(tmp_path, monkeypatch):
+    monkeypatch.setenv('METADATA_STORE_URL', str(tmp_path / 'metadata.db'))
+    generator = WhiskyLabelGenerator()
+    generator.metadata_store.put({'id': 7, 'name': 'Expired Dram', 'source': 'api'}, ttl_seconds=-1)
+
+    def overloaded(self, whisky_id):
+        raise scheduler.Overloaded('fetch', 'print', 3)
+    monkeypatch.setattr(WhiskyLabelGenerator, 'fetch_whisky_info', overloaded)
+
+    assert generator.get_whisky_info(7)['stale'] is True
+    monkeypatch.setenv('OVERLOAD_MODE', 'reject')
+    with pytest.raises(scheduler.Overloaded):
+        generator.get_whisky_info(7)
+
+    monkeypatch.setattr(app_module.generator, 'metadata_store', generator.metadata_store)
+    response = app.test_client().get('/api/whisky/8')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
+    assert response.get_json()['resource'] == 'fetch'
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests for the local whisky search index and /api/search
+"""
+
+import json
+import os
+
+import app as app_module
+from label_generator import WhiskyLabelGenerator
+from whisky_index import WhiskyIndex, load_records
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def _build_index(tmp_path):
+    generator = WhiskyLabelGenerator()
+    generator.search_index = WhiskyIndex(str(tmp_path / 'index.db'))
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        with open(os.path.join(FIXTURES_DIR, name)) as f:
+            payload = json.load(f)
+        whisky_id = int(name[len('whisky_'):-len('.json')])
+        generator._parse_api_response(payload, whisky_id)
+    return generator
+
+
+def test_parsed_records_are_searchable(tmp_path):
+    generator = _build_index(tmp_path)
+    index = generator.search_index
+    assert index.count() == 4
+
+    results = index.search('macallan')
+    assert [result['id'] for result in results] == [12345]
+    assert results[0]['bottler'] == 'Distillery Bottling'
+
+    # Every word must match, by prefix, in any indexed field
+    assert [result['id'] for result in index.search('isla laph')] == [67890]
+    assert index.search('speyside islay') == []
+
+
+def test_fuzzy_search_corrects_misspelled_words(tmp_path):
+    index = _build_index(tmp_path).search_index
+    results = index.search('macalan sherry')
+    assert [result['id'] for result in results] == [12345]
+    assert results[0]['fuzzy'] is True
+    assert index.search('macalan', fuzzy=False) == []
+
+
+def test_fuzzy_search_keeps_its_vocabulary_across_adds(tmp_path, monkeypatch):
+    index = _build_index(tmp_path).search_index
+    assert index.search('macalan')
+    index.add({'id': 1, 'name': 'Glenfarclas 105', 'distillery': 'Glenfarclas'})
+
+    connection = index._connection()
+    monkeypatch.setattr(index, '_connection', lambda: _NoVocabularyReads(connection))
+    assert [result['id'] for result in index.search('glenfarlcas')] == [1]
+
+    # Records written by another process are picked up without a full reload
+    WhiskyIndex(index.db_path).add({'id': 2, 'name': 'Springbank 10', 'distillery': 'Springbank'})
+    index._vocabulary_loaded_at -= 120
+    assert 2 in [result['id'] for result in index.search('sprignbank')]
+
+
+class _NoVocabularyReads:
+    """Connection wrapper failing any read of the full vocabulary"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, *args):
+        assert 'whisky_vocab' not in sql, 'vocabulary reloaded'
+        return self.connection.execute(sql, *args)
+
+
+def test_reindexing_updates_existing_record(tmp_path):
+    index = WhiskyIndex(str(tmp_path / 'index.db'))
+    index.add({'id': 1, 'name': 'Old Name', 'distillery': 'Ardbeg'})
+    index.add({'id': 1, 'name': 'Uigeadail', 'distillery': 'Ardbeg'})
+    assert index.count() == 1
+    assert index.search('old') == []
+    assert index.search('uigea')[0]['name'] == 'Uigeadail'
+
+
+def test_load_records_reads_ndjson(tmp_path):
+    path = tmp_path / 'export.ndjson'
+    path.write_text(
+        json.dumps({'id': 5, 'name': 'Talisker 10', 'distillery': 'Talisker'}) + '\n'
+        + json.dumps({'whisky': {'id': 6, 'name': 'Oban 14', 'brand': {'name': 'Oban'}}}) + '\n'
+    )
+    generator = WhiskyLabelGenerator()
+    generator.search_index = WhiskyIndex(str(tmp_path / 'index.db'))
+    records = load_records(str(path), generator._parse_api_response)
+    assert [(record['id'], record['name']) for record in records] == [(5, 'Talisker 10'), (6, 'Oban 14')]
+
+
+def test_search_endpoint(tmp_path, monkeypatch):
+    generator = _build_index(tmp_path)
+    monkeypatch.setattr(app_module, 'generator', generator)
+    client = app_module.app.test_client()
+
+    response = client.get('/api/search?q=springb')
+    assert response.status_code == 200
+    assert [result['name'] for result in response.get_json()['results']] == ['Springbank 21-year-old']
+    assert 'search;dur=' in response.headers['Server-Timing']
+
+    assert client.get('/api/search').status_code == 400
+    assert client.get('/api/search?q=x&limit=0').status_code == 400
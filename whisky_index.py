@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Local full-text index of whiskies seen through the WhiskyBase API
+
+Every record parsed from the API (and every bulk-imported record) is stored in
+an SQLite FTS5 index covering name, distillery, bottler, region, ABV and age,
+so a bottle seen before can be found by name without a remote lookup.
+Queries match word prefixes; terms with no prefix match are corrected against
+the indexed terms sharing the most trigrams with them, so fuzzy matching
+compares a bounded number of terms however large the index.
+
+Usage: python whisky_index.py import <file.json|file.ndjson> [...]
+       python whisky_index.py search <query>
+"""
+
+import collections
+import difflib
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import config
+
+logger = logging.getLogger('whisky_label.index')
+
+INDEXED_FIELDS = ('name', 'distillery', 'bottler', 'region', 'abv', 'age')
+# Terms of records other processes added are picked up this often
+VOCABULARY_TTL_SECONDS = 60
+FUZZY_CUTOFF = 0.7
+# Terms compared in full with each misspelled word
+FUZZY_CANDIDATES = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS whiskies (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    distillery TEXT,
+    bottler TEXT,
+    region TEXT,
+    abv TEXT,
+    age TEXT,
+    url TEXT,
+    image_url TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS whiskies_updated ON whiskies (updated_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS whisky_fts USING fts5(
+    name, distillery, bottler, region, abv, age,
+    content='whiskies', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS whisky_vocab USING fts5vocab(whisky_fts, 'row');
+CREATE TRIGGER IF NOT EXISTS whiskies_ai AFTER INSERT ON whiskies BEGIN
+    INSERT INTO whisky_fts(rowid, name, distillery, bottler, region, abv, age)
+    VALUES (new.id, new.name, new.distillery, new.bottler, new.region, new.abv, new.age);
+END;
+CREATE TRIGGER IF NOT EXISTS whiskies_ad AFTER DELETE ON whiskies BEGIN
+    INSERT INTO whisky_fts(whisky_fts, rowid, name, distillery, bottler, region, abv, age)
+    VALUES ('delete', old.id, old.name, old.distillery, old.bottler, old.region, old.abv, old.age);
+END;
+CREATE TRIGGER IF NOT EXISTS whiskies_au AFTER UPDATE ON whiskies BEGIN
+    INSERT INTO whisky_fts(whisky_fts, rowid, name, distillery, bottler, region, abv, age)
+    VALUES ('delete', old.id, old.name, old.distillery, old.bottler, old.region, old.abv, old.age);
+    INSERT INTO whisky_fts(rowid, name, distillery, bottler, region, abv, age)
+    VALUES (new.id, new.name, new.distillery, new.bottler, new.region, new.abv, new.age);
+END;
+"""
+
+UPSERT = """
+INSERT INTO whiskies (id, name, distillery, bottler, region, abv, age, url, image_url, updated_at)
+VALUES (:id, :name, :distillery, :bottler, :region, :abv, :age, :url, :image_url, :updated_at)
+ON CONFLICT(id) DO UPDATE SET
+    name = excluded.name, distillery = excluded.distillery, bottler = excluded.bottler,
+    region = excluded.region, abv = excluded.abv, age = excluded.age, url = excluded.url,
+    image_url = excluded.image_url, updated_at = excluded.updated_at
+"""
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+class WhiskyIndex:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv('SEARCH_INDEX_PATH', config.SEARCH_INDEX_PATH)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        # {trigram: set of terms containing it}
+        self._vocabulary = None
+        self._vocabulary_loaded_at = 0
+        self._vocabulary_lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=10)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with self._schema_lock:
+                if not self._schema_ready:
+                    connection.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.connection = connection
+        return connection
+
+    def add(self, whisky_info):
+        """Insert or update one parsed whisky record"""
+        self.add_many([whisky_info])
+
+    def add_many(self, records):
+        """Insert or update parsed whisky records in one transaction; returns the count"""
+        rows = []
+        now = time.time()
+        for record in records:
+            if not record.get('id') or not record.get('name'):
+                continue
+            row = {field: str(record.get(field) or '') for field in INDEXED_FIELDS}
+            row.update({
+                'id': int(record['id']),
+                'url': record.get('url') or '',
+                'image_url': record.get('image_url') or '',
+                'updated_at': now
+            })
+            rows.append(row)
+        if not rows:
+            return 0
+        connection = self._connection()
+        with connection:
+            connection.executemany(UPSERT, rows)
+        # Extend the cached vocabulary rather than reloading it on the next fuzzy search
+        with self._vocabulary_lock:
+            if self._vocabulary is not None:
+                for row in rows:
+                    _add_record_terms(self._vocabulary, row)
+        return len(rows)
+
+    def get(self, whisky_id):
+        """Return the indexed record for whisky_id, or None"""
+        row = self._connection().execute('SELECT * FROM whiskies WHERE id = ?', (int(whisky_id),)).fetchone()
+        return dict(row) if row else None
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM whiskies').fetchone()[0]
+
+    def search(self, query, limit=10, fuzzy=True):
+        """Return up to limit records matching every word of query by prefix"""
+        tokens = [token.lower() for token in TOKEN_PATTERN.findall(query or '')]
+        if not tokens:
+            return []
+
+        results = self._match(' AND '.join(f'"{token}"*' for token in tokens), limit)
+        if len(results) >= limit or not fuzzy:
+            return results
+
+        # Replace words that match nothing with the closest indexed terms
+        alternatives = []
+        corrected = False
+        for token in tokens:
+            if self._has_prefix_match(token):
+                alternatives.append([token])
+                continue
+            matches = difflib.get_close_matches(token, self._candidates(token), n=3, cutoff=FUZZY_CUTOFF)
+            if not matches:
+                return results
+            alternatives.append(matches)
+            corrected = True
+        if not corrected:
+            return results
+
+        fuzzy_query = ' AND '.join(
+            '(' + ' OR '.join(f'"{term}"*' for term in terms) + ')' for terms in alternatives
+        )
+        seen = {result['id'] for result in results}
+        for result in self._match(fuzzy_query, limit):
+            if result['id'] not in seen and len(results) < limit:
+                result['fuzzy'] = True
+                results.append(result)
+        return results
+
+    def _match(self, fts_query, limit):
+        rows = self._connection().execute(
+            """
+            SELECT w.id, w.name, w.distillery, w.bottler, w.region, w.abv, w.age, w.url, w.image_url
+            FROM whisky_fts JOIN whiskies w ON w.id = whisky_fts.rowid
+            WHERE whisky_fts MATCH ?
+            ORDER BY bm25(whisky_fts, 10.0, 5.0, 2.0, 1.0, 1.0, 1.0)
+            LIMIT ?
+            """,
+            (fts_query, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _has_prefix_match(self, token):
+        row = self._connection().execute(
+            'SELECT 1 FROM whisky_fts WHERE whisky_fts MATCH ? LIMIT 1', (f'"{token}"*',)
+        ).fetchone()
+        return row is not None
+
+    def _candidates(self, token):
+        """The indexed terms sharing most trigrams with token, within reach of FUZZY_CUTOFF
+
+        Two words can only reach a similarity ratio r if the shorter is at
+        least r / (2 - r) of the longer, so other lengths are skipped.
+        """
+        self._refresh_vocabulary()
+        shortest = math.ceil(len(token) * FUZZY_CUTOFF / (2 - FUZZY_CUTOFF))
+        longest = math.floor(len(token) * (2 - FUZZY_CUTOFF) / FUZZY_CUTOFF)
+        shared = collections.Counter()
+        with self._vocabulary_lock:
+            for trigram in _trigrams(token):
+                shared.update(term for term in self._vocabulary.get(trigram, ()) if shortest <= len(term) <= longest)
+        return heapq.nlargest(FUZZY_CANDIDATES, shared, key=shared.get)
+
+
+    def _refresh_vocabulary(self):
+        """Load the vocabulary once, then add the terms of records written since the last refresh"""
+        now = time.time()
+        if self._vocabulary is None:
+            vocabulary = {}
+            for term, in self._connection().execute('SELECT term FROM whisky_vocab'):
+                _add_term(vocabulary, term)
+            with self._vocabulary_lock:
+                self._vocabulary, self._vocabulary_loaded_at = vocabulary, now
+        elif now - self._vocabulary_loaded_at > VOCABULARY_TTL_SECONDS:
+            # A second of overlap covers writers whose clock is slightly behind; terms of
+            # replaced records linger, which only costs a correction that matches nothing
+            rows = self._connection().execute(
+                f"SELECT {', '.join(INDEXED_FIELDS)} FROM whiskies WHERE updated_at >= ?",
+                (self._vocabulary_loaded_at - 1,)
+            ).fetchall()
+            with self._vocabulary_lock:
+                for row in rows:
+                    _add_record_terms(self._vocabulary, row)
+                self._vocabulary_loaded_at = now
+
+
+def _trigrams(term):
+    # Padded, so short words and words differing in the middle still share some
+    padded = f"  {term} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def _add_term(vocabulary, term):
+    for trigram in _trigrams(term):
+        vocabulary.setdefault(trigram, set()).add(term)
+
+
+def _add_record_terms(vocabulary, row):
+    for field in INDEXED_FIELDS:
+        for term in TOKEN_PATTERN.findall((row[field] or '').lower()):
+            _add_term(vocabulary, term)
+
+
+def load_records(path, parse_payload):
+    """Read whisky records from a JSON file (object or list) or an NDJSON file"""
+    with open(path) as f:
+        if path.endswith('.ndjson') or path.endswith('.jsonl'):
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)
+            if not isinstance(items, list):
+                items = [items]
+
+    records = []
+    for item in items:
+        if 'name' in item and 'distillery' in item:
+            records.append(item)  # Already in parsed whisky_info form
+        else:
+            payload = item.get('whisky') or item.get('data') or item
+            if payload.get('id'):
+                records.append(parse_payload(item, int(payload['id'])))
+    return records
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('import', 'search'):
+        print("Usage: python whisky_index.py import <file.json|file.ndjson> [...]")
+        print("       python whisky_index.py search <query>")
+        sys.exit(1)
+
+    index = WhiskyIndex()
+    if sys.argv[1] == 'search':
+        started = time.perf_counter()
+        results = index.search(' '.join(sys.argv[2:]))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for result in results:
+            print(f"{result['id']:>8}  {result['name']} ({result['distillery']})")
+        print(f"{len(results)} result(s) in {elapsed_ms:.1f}ms")
+        return
+
+    from label_generator import WhiskyLabelGenerator
+    generator = WhiskyLabelGenerator()
+    generator.search_index = None  # Index the batch in one transaction below
+    total = 0
+    for path in sys.argv[2:]:
+        records = load_records(path, generator._parse_api_response)
+        total += index.add_many(records)
+        print(f"Imported {len(records)} record(s) from {path}")
+    print(f"Index now holds {index.count()} whiskies ({total} imported)")
+
+
+if __name__ == "__main__":
+    main()